@@ -0,0 +1,223 @@
+"""
+Admission control for the heavy media endpoints (/merge-videos,
+/watermark-video, /watermark-image).
+
+Each request declares a Cost (RAM, scratch disk, encode slots). It runs only
+if the cost fits in what is left of the global budgets; otherwise it waits
+in a FIFO queue, and when the queue is full or the wait would be too long it
+is rejected with a retry-after hint (429 at the HTTP layer). Requests are
+admitted in arrival order, so a big merge is not starved by a stream of
+small watermarks.
+
+A cost larger than a whole budget is clamped to it: such a request runs
+alone instead of never.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+import metrics
+
+
+@dataclass(frozen=True)
+class Cost:
+    ram_mb: float = 0.0
+    disk_mb: float = 0.0
+    encode_slots: int = 0
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, endpoint: str, reason: str, retry_after: int):
+        super().__init__(f"{endpoint}: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Waiter:
+    endpoint: str
+    cost: Cost
+    future: asyncio.Future
+
+
+def _container_memory_mb() -> Optional[float]:
+    """cgroup v2 / v1 memory limit, if the container has one."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) / 1024 / 1024
+    return None
+
+
+def default_budgets(reserved_disk_mb: float = 0.0) -> Dict[str, float]:
+    """
+    Budgets from ADMISSION_* env vars, else derived from the machine: 60% of
+    the container memory, 80% of the free space under the temp dir and one
+    encode per CPU.
+
+    reserved_disk_mb is taken off the derived disk budget: space that other
+    tenants of the temp dir (the clip and segment caches) may still grow
+    into. The budget never drops below 10% of the free space.
+    """
+    ram = os.environ.get("ADMISSION_RAM_MB")
+    disk = os.environ.get("ADMISSION_DISK_MB")
+    slots = os.environ.get("ADMISSION_ENCODE_SLOTS")
+    if disk:
+        disk_mb = float(disk)
+    else:
+        free_mb = shutil.disk_usage(tempfile.gettempdir()).free / 1024 / 1024
+        disk_mb = max(free_mb * 0.8 - reserved_disk_mb, free_mb * 0.1)
+    return {
+        "ram_mb": float(ram) if ram else (_container_memory_mb() or 2048) * 0.6,
+        "disk_mb": disk_mb,
+        "encode_slots": int(slots) if slots else max(1, os.cpu_count() or 1),
+    }
+
+
+class AdmissionController:
+
+    def __init__(
+        self,
+        ram_mb: float,
+        disk_mb: float,
+        encode_slots: int,
+        max_queue: int = 32,
+        max_wait_seconds: float = 60.0,
+    ):
+        self.budget = Cost(ram_mb, disk_mb, encode_slots)
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._used = Cost()
+        self._running: Dict[str, int] = {}
+        self._queue: Deque[_Waiter] = deque()
+        # Recent hold times, for the Retry-After estimate
+        self._hold_seconds: Deque[float] = deque(maxlen=50)
+
+    def _clamp(self, cost: Cost) -> Cost:
+        return Cost(
+            min(cost.ram_mb, self.budget.ram_mb),
+            min(cost.disk_mb, self.budget.disk_mb),
+            min(cost.encode_slots, self.budget.encode_slots),
+        )
+
+    def _fits(self, cost: Cost) -> bool:
+        return (
+            self._used.ram_mb + cost.ram_mb <= self.budget.ram_mb
+            and self._used.disk_mb + cost.disk_mb <= self.budget.disk_mb
+            and self._used.encode_slots + cost.encode_slots <= self.budget.encode_slots
+        )
+
+    def _take(self, endpoint: str, cost: Cost):
+        self._used = Cost(
+            self._used.ram_mb + cost.ram_mb,
+            self._used.disk_mb + cost.disk_mb,
+            self._used.encode_slots + cost.encode_slots,
+        )
+        self._running[endpoint] = self._running.get(endpoint, 0) + 1
+
+    def _give_back(self, endpoint: str, cost: Cost):
+        self._used = Cost(
+            max(0.0, self._used.ram_mb - cost.ram_mb),
+            max(0.0, self._used.disk_mb - cost.disk_mb),
+            max(0, self._used.encode_slots - cost.encode_slots),
+        )
+        self._running[endpoint] -= 1
+        self._drain()
+
+    def _drain(self):
+        """Admit waiters in order while the head fits."""
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                self._queue.popleft()
+                continue
+            if not self._fits(head.cost):
+                break
+            self._queue.popleft()
+            self._take(head.endpoint, head.cost)
+            head.future.set_result(None)
+
+    def _abandon(self, waiter: _Waiter):
+        """
+        Take a waiter that gave up out of the queue right away. Left in place
+        it would count toward max_queue and Retry-After until the head
+        reached it.
+        """
+        waiter.future.cancel()
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            pass
+        # It may have been the head blocking smaller requests behind it
+        self._drain()
+
+    def retry_after(self) -> int:
+        typical = sorted(self._hold_seconds)[len(self._hold_seconds) // 2] if self._hold_seconds else 10.0
+        return max(1, int(typical * (1 + len(self._queue) / max(1, self.budget.encode_slots))))
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, cost: Cost):
+        """Hold `cost` for the duration of the block. Raises AdmissionRejected."""
+        cost = self._clamp(cost)
+        if not self._queue and self._fits(cost):
+            self._take(endpoint, cost)
+        else:
+            if len(self._queue) >= self.max_queue:
+                metrics.incr(f"admission.{endpoint}.rejected")
+                raise AdmissionRejected(endpoint, "queue full", self.retry_after())
+            waiter = _Waiter(endpoint, cost, asyncio.get_running_loop().create_future())
+            self._queue.append(waiter)
+            metrics.incr(f"admission.{endpoint}.queued")
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait_seconds)
+            except asyncio.TimeoutError:
+                if waiter.future.done():
+                    # Admitted right as the wait expired: hand the budget back
+                    self._give_back(endpoint, cost)
+                else:
+                    self._abandon(waiter)
+                metrics.incr(f"admission.{endpoint}.rejected")
+                raise AdmissionRejected(endpoint, f"waited {self.max_wait_seconds:.0f}s", self.retry_after())
+            except BaseException:
+                # Client went away while queued
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._give_back(endpoint, cost)
+                else:
+                    self._abandon(waiter)
+                raise
+
+        metrics.incr(f"admission.{endpoint}.admitted")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_seconds.append(time.monotonic() - started)
+            self._give_back(endpoint, cost)
+
+    def utilization(self) -> dict:
+        def ratio(used, total):
+            return round(used / total, 3) if total else 0.0
+
+        return {
+            "ram_mb": {"used": round(self._used.ram_mb), "budget": round(self.budget.ram_mb),
+                       "utilization": ratio(self._used.ram_mb, self.budget.ram_mb)},
+            "disk_mb": {"used": round(self._used.disk_mb), "budget": round(self.budget.disk_mb),
+                        "utilization": ratio(self._used.disk_mb, self.budget.disk_mb)},
+            "encode_slots": {"used": self._used.encode_slots, "budget": self.budget.encode_slots,
+                             "utilization": ratio(self._used.encode_slots, self.budget.encode_slots)},
+            "running": {k: v for k, v in self._running.items() if v},
+            "queued": len(self._queue),
+        }
@@ -0,0 +1,221 @@
+"""
+Espelha videos e capas dos trending ads no Supabase Storage.
+
+As URLs de video_url/cover_url apontam para a CDN do TikTok e expiram; quem
+analisa os ads depois (ai_analysis) usa as copias espelhadas. Roda como
+etapa final do scraper (processo filho), depois que as linhas foram gravadas.
+
+  - downloads e uploads em streaming (arquivo temporario, nunca o video
+    inteiro em memoria), varios ads ao mesmo tempo
+  - sha256 calculado durante o download; o objeto fica em
+    {ad_id}/{sha256}.{ext}, entao o mesmo conteudo nunca sobe duas vezes
+  - thumbnail WEBP compacta gerada a partir da capa
+  - linhas cujo mirrored_hash ja bate com o content_hash sao puladas;
+    linhas antigas sem content_hash sao espelhadas uma vez e recebem um
+    mirrored_hash "legacy:" derivado do sha256 do asset
+"""
+
+import os
+import io
+import asyncio
+import hashlib
+import tempfile
+from typing import Optional
+
+import httpx
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
+SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
+
+ASSET_BUCKET = os.environ.get("TRENDING_ASSET_BUCKET", "trending-assets")
+MIRROR_CONCURRENCY = int(os.environ.get("ASSET_MIRROR_CONCURRENCY", "6"))
+MAX_ASSET_BYTES = int(os.environ.get("ASSET_MIRROR_MAX_MB", "150")) * 1024 * 1024
+THUMBNAIL_SIZE = (270, 480)
+CHUNK_SIZE = 256 * 1024
+
+
+def _headers(content_type: Optional[str] = None) -> dict:
+    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
+    if content_type:
+        headers["Content-Type"] = content_type
+    return headers
+
+
+def public_url(path: str) -> str:
+    return f"{SUPABASE_URL}/storage/v1/object/public/{ASSET_BUCKET}/{path}"
+
+
+async def download_to_file(client: httpx.AsyncClient, url: str, fileobj) -> tuple:
+    """Baixa em streaming para `fileobj`. Retorna (sha256, bytes, content-type)."""
+    digest = hashlib.sha256()
+    size = 0
+    async with client.stream("GET", url, timeout=120, follow_redirects=True) as res:
+        res.raise_for_status()
+        content_type = res.headers.get("content-type", "application/octet-stream").split(";")[0]
+        async for chunk in res.aiter_bytes(CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_ASSET_BYTES:
+                raise Exception(f"asset maior que {MAX_ASSET_BYTES // (1024 * 1024)}MB: {url[:120]}")
+            digest.update(chunk)
+            fileobj.write(chunk)
+    fileobj.flush()
+    return digest.hexdigest(), size, content_type
+
+
+async def _file_chunks(path: str):
+    with open(path, "rb") as f:
+        while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+            yield chunk
+
+
+async def object_exists(client: httpx.AsyncClient, path: str) -> bool:
+    res = await client.head(public_url(path), timeout=30)
+    return res.status_code == 200
+
+
+async def upload_file(client: httpx.AsyncClient, local_path: str, path: str, content_type: str):
+    """Upload em streaming; Content-Length explicito para o Storage nao receber chunked."""
+    headers = {
+        **_headers(content_type),
+        "x-upsert": "true",
+        "Content-Length": str(os.path.getsize(local_path)),
+    }
+    res = await client.post(
+        f"{SUPABASE_URL}/storage/v1/object/{ASSET_BUCKET}/{path}",
+        headers=headers,
+        content=_file_chunks(local_path),
+        timeout=300,
+    )
+    if res.status_code >= 400:
+        raise Exception(f"Upload de {path} falhou [{res.status_code}]: {res.text[:300]}")
+
+
+def make_thumbnail(image_path: str) -> bytes:
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        img.draft("RGB", THUMBNAIL_SIZE)
+        img = img.convert("RGB")
+        img.thumbnail(THUMBNAIL_SIZE)
+        buf = io.BytesIO()
+        img.save(buf, format="WEBP", quality=70, method=4)
+    return buf.getvalue()
+
+
+async def mirror_asset(client: httpx.AsyncClient, ad_id: str, url: str, kind: str, workdir: str) -> dict:
+    """
+    Baixa um asset e sobe para {ad_id}/{sha256}.{ext} se ainda nao existir.
+    Retorna {"url", "sha256", "bytes", "uploaded", "local_path"}.
+    """
+    ext = "mp4" if kind == "video" else "jpg"
+    local_path = os.path.join(workdir, f"{ad_id}_{kind}.{ext}")
+    with open(local_path, "wb") as f:
+        sha256, size, content_type = await download_to_file(client, url, f)
+
+    path = f"{ad_id}/{sha256}.{ext}"
+    uploaded = False
+    if not await object_exists(client, path):
+        await upload_file(client, local_path, path, content_type if "/" in content_type else "application/octet-stream")
+        uploaded = True
+    return {"url": public_url(path), "sha256": sha256, "bytes": size, "uploaded": uploaded, "local_path": local_path}
+
+
+async def mirror_row(client: httpx.AsyncClient, row: dict) -> dict:
+    """Espelha video, capa e thumbnail de uma linha e grava as URLs nela."""
+    ad_id = row["ad_id"]
+    update = {}
+    stats = {"bytes_downloaded": 0, "uploaded": 0}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        tasks = {}
+        if row.get("video_url"):
+            tasks["video"] = mirror_asset(client, ad_id, row["video_url"], "video", workdir)
+        if row.get("cover_url"):
+            tasks["cover"] = mirror_asset(client, ad_id, row["cover_url"], "cover", workdir)
+        results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+
+        for result in results.values():
+            stats["bytes_downloaded"] += result["bytes"]
+            stats["uploaded"] += int(result["uploaded"])
+
+        if "video" in results:
+            update["mirrored_video_url"] = results["video"]["url"]
+            update["video_sha256"] = results["video"]["sha256"]
+        if "cover" in results:
+            cover = results["cover"]
+            update["mirrored_cover_url"] = cover["url"]
+            thumb_path = f"{ad_id}/{cover['sha256']}_thumb.webp"
+            if not await object_exists(client, thumb_path):
+                thumb = await asyncio.to_thread(make_thumbnail, cover["local_path"])
+                res = await client.post(
+                    f"{SUPABASE_URL}/storage/v1/object/{ASSET_BUCKET}/{thumb_path}",
+                    headers={**_headers("image/webp"), "x-upsert": "true"},
+                    content=thumb,
+                    timeout=60,
+                )
+                if res.status_code >= 400:
+                    raise Exception(f"Upload da thumbnail falhou [{res.status_code}]: {res.text[:300]}")
+                stats["uploaded"] += 1
+            update["thumbnail_url"] = public_url(thumb_path)
+
+    # Sem content_hash (linhas de antes da migration 005) o mirrored_hash
+    # ainda precisa ser nao-nulo, senao a linha volta em toda execucao
+    asset_sha = (results.get("video") or results.get("cover") or {}).get("sha256")
+    update["mirrored_hash"] = row.get("content_hash") or f"legacy:{asset_sha or 'none'}"
+
+    res = await client.patch(
+        f"{SUPABASE_URL}/rest/v1/trending_videos?id=eq.{row['id']}",
+        headers={**_headers("application/json"), "Prefer": "return=minimal"},
+        json={**update, "mirrored_at": "now()"},
+        timeout=30,
+    )
+    res.raise_for_status()
+    return stats
+
+
+async def rows_to_mirror(client: httpx.AsyncClient, row_filter: str) -> list:
+    """Linhas ativas (filtradas por `row_filter`) cujo conteudo ainda nao foi espelhado."""
+    res = await client.get(
+        f"{SUPABASE_URL}/rest/v1/trending_videos"
+        f"?select=id,ad_id,content_hash,mirrored_hash,video_url,cover_url"
+        f"&is_active=eq.true&{row_filter}",
+        headers=_headers(),
+        timeout=30,
+    )
+    res.raise_for_status()
+    return [
+        r for r in res.json()
+        if (r.get("mirrored_hash") is None if r.get("content_hash") is None
+            else r.get("mirrored_hash") != r.get("content_hash"))
+    ]
+
+
+async def mirror_assets(row_filter: str) -> dict:
+    """
+    Espelha os assets das linhas ativas que casam com `row_filter` (query
+    string PostgREST, ex. "region=eq.BR&industry=eq.X&period=eq.7").
+    Falhas de um ad nao interrompem os outros.
+    """
+    limits = httpx.Limits(max_connections=MIRROR_CONCURRENCY * 2, max_keepalive_connections=MIRROR_CONCURRENCY * 2)
+    async with httpx.AsyncClient(limits=limits) as client:
+        rows = await rows_to_mirror(client, row_filter)
+        semaphore = asyncio.Semaphore(MIRROR_CONCURRENCY)
+        totals = {"rows": len(rows), "mirrored": 0, "failed": 0, "uploaded": 0, "bytes_downloaded": 0}
+
+        async def one(row):
+            async with semaphore:
+                try:
+                    stats = await mirror_row(client, row)
+                    totals["mirrored"] += 1
+                    totals["uploaded"] += stats["uploaded"]
+                    totals["bytes_downloaded"] += stats["bytes_downloaded"]
+                except Exception as e:
+                    totals["failed"] += 1
+                    print(f"[asset-mirror] Falha ao espelhar {row['ad_id']}: {e}")
+
+        await asyncio.gather(*(one(row) for row in rows))
+
+    print(f"[asset-mirror] {totals['mirrored']}/{totals['rows']} ads espelhados, "
+          f"{totals['uploaded']} objetos enviados, {totals['bytes_downloaded'] / 1024 / 1024:.1f}MB baixados, "
+          f"{totals['failed']} falhas")
+    return totals
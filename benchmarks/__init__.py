@@ -0,0 +1,6 @@
+"""
+Offline benchmarks for the render worker.
+
+Nothing in here talks to the real Vertex, OpenAI or Supabase endpoints:
+fake_providers.py stands in for all three so runs cost no credits.
+"""
@@ -0,0 +1,343 @@
+"""
+Local stand-ins for the providers the worker talks to.
+
+One FastAPI app serves all of them, so a single base URL can be handed to the
+worker through VERTEX_API_BASE, OPENAI_API_BASE, GCS_API_BASE and SUPABASE_URL:
+
+  - Google OAuth token endpoint      POST /token
+  - Vertex Veo                       POST /v1/projects/.../models/{model}:predictLongRunning
+                                     POST /v1/projects/.../models/{model}:fetchPredictOperation
+  - Google Cloud Storage (JSON API)   GET /storage/v1/b/{bucket}/o/{object}
+                                     POST /upload/storage/v1/b/{bucket}/o?uploadType=media&name=...
+  - OpenAI Sora                      POST /v1/videos, GET /v1/videos/{id}, GET /v1/videos/{id}/content
+  - Supabase Storage                 POST /storage/v1/object/{bucket}/{path}
+                                     GET/HEAD /storage/v1/object/public/{bucket}/{path} (ETag / If-None-Match)
+  - Supabase REST (PostgREST)        GET/POST/PATCH /rest/v1/{table}, POST /rest/v1/rpc/{function}
+
+Every provider has its own latency, jitter and failure rate. Renders finish
+after --render-seconds, so polling loops behave like the real thing.
+
+Usage:
+    python -m benchmarks.fake_providers --port 9100 --latency-ms 40 --failure-rate 0.01
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+PROVIDERS = ("google", "vertex", "gcs", "openai", "storage", "rest")
+
+
+@dataclass
+class ProviderProfile:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    failure_rate: float = 0.0
+    failure_status: int = 503
+
+
+@dataclass
+class FakeConfig:
+    profiles: Dict[str, ProviderProfile] = field(
+        default_factory=lambda: {name: ProviderProfile() for name in PROVIDERS}
+    )
+    # Seconds between submit and the operation reporting done
+    render_seconds: float = 1.0
+    # Fraction of finished renders that report a generation error (content policy etc.)
+    render_failure_rate: float = 0.0
+    # "bytes" returns bytesBase64Encoded like Veo does without storageUri, "gcs" returns a gcsUri
+    veo_output: str = "bytes"
+    video_bytes: bytes = b""
+
+
+@dataclass
+class _Operation:
+    started: float
+    failed: bool
+    samples: int = 1
+
+
+def _default_video(size_kb: int) -> bytes:
+    # Not a playable MP4, but the right size for transfer costs; pass
+    # --video-fixture when the merge/watermark paths need real media.
+    return os.urandom(size_kb * 1024)
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI()
+    operations: Dict[str, _Operation] = {}
+    objects: Dict[str, tuple] = {}
+    gcs_objects: Dict[str, bytes] = {}
+    stats = {name: {"requests": 0, "failures": 0, "bytes_in": 0, "bytes_out": 0} for name in PROVIDERS}
+
+    async def simulate(provider: str) -> Optional[Response]:
+        """Apply latency and maybe inject a failure. Returns the failure response, if any."""
+        profile = config.profiles[provider]
+        stats[provider]["requests"] += 1
+        delay = profile.latency_ms + random.uniform(-profile.jitter_ms, profile.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if profile.failure_rate and random.random() < profile.failure_rate:
+            stats[provider]["failures"] += 1
+            return JSONResponse(
+                status_code=profile.failure_status,
+                content={"error": {"code": profile.failure_status, "message": "injected failure", "status": "UNAVAILABLE"}},
+            )
+        return None
+
+    def operation_state(op_id: str) -> Optional[_Operation]:
+        op = operations.get(op_id)
+        if op and time.monotonic() - op.started < config.render_seconds:
+            return None
+        return op
+
+    # -------------------------------------------------
+    # Google OAuth
+    # -------------------------------------------------
+    @app.post("/token")
+    async def token():
+        if (failure := await simulate("google")) is not None:
+            return failure
+        return {"access_token": f"fake-{uuid.uuid4().hex}", "expires_in": 3600, "token_type": "Bearer"}
+
+    # -------------------------------------------------
+    # Vertex Veo
+    # -------------------------------------------------
+    @app.post("/v1/projects/{project}/locations/{location}/publishers/google/models/{model_action}")
+    async def vertex(project: str, location: str, model_action: str, request: Request):
+        if (failure := await simulate("vertex")) is not None:
+            return failure
+        body = await request.body()
+        stats["vertex"]["bytes_in"] += len(body)
+        model, _, action = model_action.partition(":")
+
+        if action == "predictLongRunning":
+            payload = await request.json()
+            # Staged reference images must exist, like on the real service
+            for instance in payload.get("instances", []):
+                uri = instance.get("image", {}).get("gcsUri")
+                if uri and uri[len("gs://"):] not in gcs_objects:
+                    return JSONResponse(status_code=400, content={"error": {"code": 400, "message": f"{uri} not found"}})
+            op_id = uuid.uuid4().hex
+            samples = int(payload.get("parameters", {}).get("sampleCount", 1))
+            operations[op_id] = _Operation(time.monotonic(), random.random() < config.render_failure_rate, samples)
+            name = f"projects/{project}/locations/{location}/publishers/google/models/{model}/operations/{op_id}"
+            return {"name": name}
+
+        if action == "fetchPredictOperation":
+            name = (await request.json())["operationName"]
+            op_id = name.rsplit("/", 1)[-1]
+            if op_id not in operations:
+                return JSONResponse(status_code=404, content={"error": {"code": 404, "message": "operation not found"}})
+            op = operation_state(op_id)
+            if op is None:
+                return {"name": name}
+            if op.failed:
+                return {"name": name, "done": True, "error": {"code": 3, "message": "injected INVALID_ARGUMENT"}}
+            videos = []
+            for i in range(op.samples):
+                if config.veo_output == "gcs":
+                    video = {"gcsUri": f"gs://fake-bucket/{op_id}/sample_{i}.mp4", "mimeType": "video/mp4"}
+                else:
+                    video = {"bytesBase64Encoded": base64.b64encode(config.video_bytes).decode(), "mimeType": "video/mp4"}
+                    stats["vertex"]["bytes_out"] += len(video["bytesBase64Encoded"])
+                videos.append(video)
+            return {"name": name, "done": True, "response": {"videos": videos}}
+
+        return JSONResponse(status_code=404, content={"error": {"code": 404, "message": f"unknown action {action}"}})
+
+    # -------------------------------------------------
+    # Google Cloud Storage
+    # -------------------------------------------------
+    @app.get("/storage/v1/b/{bucket}/o/{name:path}")
+    async def gcs_metadata(bucket: str, name: str):
+        if (failure := await simulate("gcs")) is not None:
+            return failure
+        data = gcs_objects.get(f"{bucket}/{name}")
+        if data is None:
+            return JSONResponse(status_code=404, content={"error": {"code": 404, "message": "No such object"}})
+        return {"bucket": bucket, "name": name, "size": str(len(data)), "generation": "1"}
+
+    @app.delete("/storage/v1/b/{bucket}/o/{name:path}")
+    async def gcs_delete(bucket: str, name: str):
+        # Lets a benchmark play the bucket lifecycle rule
+        if gcs_objects.pop(f"{bucket}/{name}", None) is None:
+            return JSONResponse(status_code=404, content={"error": {"code": 404, "message": "No such object"}})
+        return Response(status_code=204)
+
+    @app.post("/upload/storage/v1/b/{bucket}/o")
+    async def gcs_upload(bucket: str, request: Request):
+        if (failure := await simulate("gcs")) is not None:
+            return failure
+        name = request.query_params["name"]
+        key = f"{bucket}/{name}"
+        if request.query_params.get("ifGenerationMatch") == "0" and key in gcs_objects:
+            return JSONResponse(status_code=412, content={"error": {"code": 412, "message": "Precondition Failed"}})
+        body = await request.body()
+        stats["gcs"]["bytes_in"] += len(body)
+        gcs_objects[key] = body
+        return {"bucket": bucket, "name": name, "size": str(len(body)), "generation": "1"}
+
+    # -------------------------------------------------
+    # OpenAI Sora
+    # -------------------------------------------------
+    @app.post("/v1/videos")
+    async def sora_submit(request: Request):
+        if (failure := await simulate("openai")) is not None:
+            return failure
+        stats["openai"]["bytes_in"] += len(await request.body())
+        video_id = f"video_{uuid.uuid4().hex}"
+        operations[video_id] = _Operation(time.monotonic(), random.random() < config.render_failure_rate)
+        return {"id": video_id, "object": "video", "status": "queued"}
+
+    @app.get("/v1/videos/{video_id}")
+    async def sora_poll(video_id: str):
+        if (failure := await simulate("openai")) is not None:
+            return failure
+        if video_id not in operations:
+            return JSONResponse(status_code=404, content={"error": {"message": "video not found"}})
+        op = operation_state(video_id)
+        if op is None:
+            elapsed = time.monotonic() - operations[video_id].started
+            progress = int(100 * elapsed / config.render_seconds) if config.render_seconds else 100
+            return {"id": video_id, "status": "in_progress", "progress": progress}
+        if op.failed:
+            return {"id": video_id, "status": "failed", "error": {"code": "moderation_blocked", "message": "injected"}}
+        return {"id": video_id, "status": "completed", "progress": 100}
+
+    @app.get("/v1/videos/{video_id}/content")
+    async def sora_content(video_id: str):
+        if (failure := await simulate("openai")) is not None:
+            return failure
+        stats["openai"]["bytes_out"] += len(config.video_bytes)
+        return Response(content=config.video_bytes, media_type="video/mp4")
+
+    # -------------------------------------------------
+    # Supabase Storage
+    # -------------------------------------------------
+    @app.post("/storage/v1/object/{bucket}/{path:path}")
+    async def storage_upload(bucket: str, path: str, request: Request):
+        if (failure := await simulate("storage")) is not None:
+            return failure
+        body = await request.body()
+        stats["storage"]["bytes_in"] += len(body)
+        objects[f"{bucket}/{path}"] = (body, request.headers.get("content-type", "application/octet-stream"))
+        return {"Key": f"{bucket}/{path}"}
+
+    @app.api_route("/storage/v1/object/public/{bucket}/{path:path}", methods=["GET", "HEAD"])
+    async def storage_download(bucket: str, path: str, request: Request):
+        if (failure := await simulate("storage")) is not None:
+            return failure
+        obj = objects.get(f"{bucket}/{path}")
+        if obj is None:
+            return JSONResponse(status_code=404, content={"error": "not_found", "message": "Object not found"})
+        etag = f'"{hashlib.md5(obj[0]).hexdigest()}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        stats["storage"]["bytes_out"] += len(obj[0])
+        return Response(content=obj[0], media_type=obj[1], headers={"ETag": etag})
+
+    # -------------------------------------------------
+    # Supabase REST
+    # -------------------------------------------------
+    @app.api_route("/rest/v1/{table}", methods=["GET", "POST", "PATCH"])
+    async def rest(table: str, request: Request):
+        if (failure := await simulate("rest")) is not None:
+            return failure
+        if request.method == "GET":
+            # Nothing is persisted: every select comes back empty
+            return []
+        stats["rest"]["bytes_in"] += len(await request.body())
+        if "return=representation" in request.headers.get("prefer", ""):
+            return JSONResponse(status_code=201, content=[{"id": str(uuid.uuid4())}])
+        return Response(status_code=204)
+
+    @app.post("/rest/v1/rpc/{function}")
+    async def rpc(function: str, request: Request):
+        if (failure := await simulate("rest")) is not None:
+            return failure
+        stats["rest"]["bytes_in"] += len(await request.body())
+        return Response(status_code=204)
+
+    # -------------------------------------------------
+    # Introspection for the load driver
+    # -------------------------------------------------
+    @app.get("/__stats")
+    async def get_stats():
+        return {"providers": stats, "operations": len(operations), "objects": len(objects),
+                "gcs_objects": len(gcs_objects), "gcs_object_names": sorted(gcs_objects)}
+
+    return app
+
+
+def _parse_per_provider(value: Optional[str], default: float) -> Dict[str, float]:
+    """'40' applies to every provider, 'vertex=200,storage=20' sets individual ones."""
+    out = {name: default for name in PROVIDERS}
+    if not value:
+        return out
+    for part in value.split(","):
+        if "=" in part:
+            name, v = part.split("=", 1)
+            if name not in out:
+                raise SystemExit(f"unknown provider '{name}', expected one of {', '.join(PROVIDERS)}")
+            out[name] = float(v)
+        else:
+            out = {name: float(part) for name in PROVIDERS}
+    return out
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", help="per-request latency, e.g. '40' or 'vertex=200,storage=20'")
+    parser.add_argument("--jitter-ms", help="uniform +/- jitter, same syntax as --latency-ms")
+    parser.add_argument("--failure-rate", help="fraction of requests answered with 503, same syntax")
+    parser.add_argument("--render-seconds", type=float, default=1.0)
+    parser.add_argument("--render-failure-rate", type=float, default=0.0)
+    parser.add_argument("--veo-output", choices=("bytes", "gcs"), default="bytes")
+    parser.add_argument("--video-size-kb", type=int, default=2048)
+    parser.add_argument("--video-fixture", help="MP4 served as the generated video instead of random bytes")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    latency = _parse_per_provider(args.latency_ms, 0.0)
+    jitter = _parse_per_provider(args.jitter_ms, 0.0)
+    failure = _parse_per_provider(args.failure_rate, 0.0)
+    if args.video_fixture:
+        with open(args.video_fixture, "rb") as f:
+            video_bytes = f.read()
+    else:
+        video_bytes = _default_video(args.video_size_kb)
+    return FakeConfig(
+        profiles={
+            name: ProviderProfile(latency_ms=latency[name], jitter_ms=jitter[name], failure_rate=failure[name])
+            for name in PROVIDERS
+        },
+        render_seconds=args.render_seconds,
+        render_failure_rate=args.render_failure_rate,
+        veo_output=args.veo_output,
+        video_bytes=video_bytes,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Shared fixtures for the benchmarks: fake credentials, worker environment and
+generated media in typical phone sizes.
+"""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+from typing import Optional
+
+import rsa
+from PIL import Image, ImageDraw
+
+WORKER_SECRET = "bench-secret"
+SUPABASE_KEY = "bench-service-role-key"
+
+
+def make_service_account_json(token_uri: str) -> str:
+    """Service-account JSON with a throwaway RSA key and a local token_uri,
+    so google-auth can sign and refresh against the fake token endpoint."""
+    _, private_key = rsa.newkeys(1024)
+    return json.dumps({
+        "type": "service_account",
+        "project_id": "bench-project",
+        "private_key_id": "bench",
+        "private_key": private_key.save_pkcs1().decode(),
+        "client_email": "bench@bench-project.iam.gserviceaccount.com",
+        "client_id": "0",
+        "token_uri": token_uri,
+    })
+
+
+# Everything worker_env() sets; the startup benchmark strips these to check
+# that `import main` works without any provider configuration.
+PROVIDER_ENV_KEYS = (
+    "GOOGLE_CLOUD_PROJECT", "GOOGLE_CLOUD_LOCATION", "SUPABASE_URL",
+    "SUPABASE_SERVICE_ROLE_KEY", "GOOGLE_APPLICATION_CREDENTIALS_JSON",
+    "OPENAI_API_KEY", "RENDER_WORKER_SECRET", "VERTEX_API_BASE", "OPENAI_API_BASE", "GCS_API_BASE",
+    "VEO_POLL_INTERVAL_SECONDS", "SORA_POLL_INTERVAL_SECONDS",
+)
+
+
+def worker_env(fake_base_url: str, poll_interval: float = 0.2) -> dict:
+    """Environment for a worker process that talks only to the fake providers."""
+    env = dict(os.environ)
+    env.update({
+        "GOOGLE_CLOUD_PROJECT": "bench-project",
+        "GOOGLE_CLOUD_LOCATION": "local",
+        "SUPABASE_URL": fake_base_url,
+        "SUPABASE_SERVICE_ROLE_KEY": SUPABASE_KEY,
+        "GOOGLE_APPLICATION_CREDENTIALS_JSON": make_service_account_json(f"{fake_base_url}/token"),
+        "OPENAI_API_KEY": "bench-openai-key",
+        "RENDER_WORKER_SECRET": WORKER_SECRET,
+        "VERTEX_API_BASE": fake_base_url,
+        "OPENAI_API_BASE": fake_base_url,
+        "GCS_API_BASE": fake_base_url,
+        "VEO_POLL_INTERVAL_SECONDS": str(poll_interval),
+        "SORA_POLL_INTERVAL_SECONDS": str(poll_interval),
+    })
+    return env
+
+
+# =====================================================
+# MEDIA FIXTURES
+# =====================================================
+
+def _gradient(mode: str, size: tuple) -> Image.Image:
+    """Busy, photo-like content so encoders don't get an unrealistically easy job."""
+    w, h = size
+    img = Image.radial_gradient("L").resize(size)
+    channels = [img, img.rotate(90).resize(size), Image.linear_gradient("L").resize(size)]
+    if mode == "RGBA":
+        channels.append(Image.linear_gradient("L").rotate(45).resize(size))
+    out = Image.merge(mode, channels)
+    draw = ImageDraw.Draw(out)
+    for i in range(0, max(w, h), max(w, h) // 24):
+        draw.line((i, 0, 0, i), fill=(255, 255, 255, 255)[: len(mode)], width=3)
+    return out
+
+
+def make_jpeg(width: int, height: int, quality: int = 90) -> bytes:
+    buf = io.BytesIO()
+    _gradient("RGB", (width, height)).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def make_png_rgba(width: int, height: int) -> bytes:
+    buf = io.BytesIO()
+    _gradient("RGBA", (width, height)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# Typical phone captures: 12MP JPEG and 4K PNG with alpha, in both orientations
+PHONE_IMAGES = {
+    "12mp_jpeg_portrait": (3024, 4032, "jpeg"),
+    "12mp_jpeg_landscape": (4032, 3024, "jpeg"),
+    "4k_png_alpha_portrait": (2160, 3840, "png"),
+    "4k_png_alpha_landscape": (3840, 2160, "png"),
+}
+
+
+def make_phone_image(name: str) -> bytes:
+    w, h, fmt = PHONE_IMAGES[name]
+    return make_jpeg(w, h) if fmt == "jpeg" else make_png_rgba(w, h)
+
+
+def make_mp4(path: str, seconds: float = 4, size: str = "720x1280") -> Optional[str]:
+    """Render a small H.264 + AAC test clip with ffmpeg. Returns None without ffmpeg."""
+    if not shutil.which("ffmpeg"):
+        return None
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error",
+         "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={seconds}",
+         "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+         "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+         "-c:a", "aac", "-shortest", path],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg fixture error: {result.stderr[:500]}")
+    return path
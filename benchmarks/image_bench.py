@@ -0,0 +1,211 @@
+"""
+Micro-benchmarks for the CPU-bound image steps of the worker.
+
+Covers crop_image_to_ratio, compose_pet_canvas (the CPU half of
+compose_pet_image), resize_image_for_sora and apply_image_watermark over
+generated phone-sized fixtures. Each case runs in a fresh child process and
+peak memory is read from the RSS high-water mark, reset right before the
+timed loop (Pillow allocates outside the Python allocator, so tracemalloc
+would not see it).
+
+Usage:
+    python -m benchmarks.image_bench --repeat 5 --output image_bench.json
+    python -m benchmarks.image_bench --save-baseline benchmarks/baselines/image.json
+    python -m benchmarks.image_bench --baseline benchmarks/baselines/image.json --threshold 0.25
+
+With --baseline the run exits with status 1 when any case got slower (median
+time) or hungrier (peak memory) than the baseline by more than --threshold.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.fixtures import PHONE_IMAGES, make_phone_image, make_png_rgba, worker_env
+
+OPERATIONS = ("crop_9_16", "crop_16_9", "compose_pet", "resize_for_sora", "watermark_image")
+
+
+def _import_worker():
+    """Import main with an offline environment (it reads provider config at import)."""
+    for key, value in worker_env("http://127.0.0.1:9").items():
+        os.environ.setdefault(key, value)
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+        import sora2_engine
+    return main, sora2_engine
+
+
+def _rss_kb(field: str) -> int:
+    """VmRSS/VmHWM from /proc; falls back to ru_maxrss where /proc is unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux >= 4.0), so setup work doesn't count."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _run_case(operation: str, fixture_path: str, extras: dict, repeat: int) -> dict:
+    """Child-process body: time `operation` on one fixture and report peak RSS."""
+    main, sora2_engine = _import_worker()
+    with open(fixture_path, "rb") as f:
+        data = f.read()
+    aux = {}
+    for name, path in extras.items():
+        with open(path, "rb") as f:
+            aux[name] = f.read()
+
+    # The worker functions log with print(); keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        if operation == "crop_9_16":
+            fn = lambda: main.crop_image_to_ratio(data, "9:16")
+        elif operation == "crop_16_9":
+            fn = lambda: main.crop_image_to_ratio(data, "16:9")
+        elif operation == "compose_pet":
+            fn = lambda: main.compose_pet_canvas(data, aux["background"], aux["product"], "9:16")
+        elif operation == "resize_for_sora":
+            # Sora gets the already-cropped image in production
+            data = main.crop_image_to_ratio(data, "9:16")
+            size = sora2_engine.map_aspect_to_sora_size("9:16", "sora-2-pro")
+            fn = lambda: sora2_engine.resize_image_for_sora(data, size)
+        elif operation == "watermark_image":
+            fn = lambda: main.apply_image_watermark(data)
+        else:
+            raise ValueError(operation)
+
+        _reset_peak_rss()
+        rss_before_kb = _rss_kb("VmRSS")
+        timings = []
+        output = b""
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = fn()
+            timings.append(time.perf_counter() - started)
+        rss_after_kb = _rss_kb("VmHWM")
+
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 2),
+        "min_ms": round(min(timings) * 1000, 2),
+        "peak_mem_mb": round(max(0, rss_after_kb - rss_before_kb) / 1024, 2),
+        "input_bytes": len(data),
+        "output_bytes": len(output),
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    operations = [o.strip() for o in args.operations.split(",") if o.strip()]
+    fixtures = [f.strip() for f in args.fixtures.split(",") if f.strip()]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = {}
+        for name in fixtures:
+            paths[name] = os.path.join(workdir, name)
+            with open(paths[name], "wb") as f:
+                f.write(make_phone_image(name))
+        extras = {
+            "background": paths.get("12mp_jpeg_landscape") or paths[fixtures[0]],
+            "product": os.path.join(workdir, "product.png"),
+        }
+        with open(extras["product"], "wb") as f:
+            f.write(make_png_rgba(800, 1000))
+
+        # One task per child keeps ru_maxrss scoped to a single case
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx, max_tasks_per_child=1) as pool:
+            for op in operations:
+                for name in fixtures:
+                    case = f"{op}/{name}"
+                    result = pool.submit(_run_case, op, paths[name], extras, args.repeat).result()
+                    results[case] = result
+                    print(f"[image-bench] {case:<45} {result['median_ms']:>9.1f} ms  "
+                          f"{result['peak_mem_mb']:>7.1f} MB  {result['output_bytes']:>9} B")
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def check_regressions(report: dict, baseline: dict, threshold: float) -> list:
+    """Cases whose median time or peak memory grew past the threshold."""
+    regressions = []
+    for case, current in report["results"].items():
+        base = baseline.get("results", {}).get(case)
+        if not base:
+            continue
+        for metric in ("median_ms", "peak_mem_mb"):
+            # Ignore sub-millisecond / sub-megabyte noise on tiny baselines
+            floor = 1.0
+            if base[metric] >= floor and current[metric] > base[metric] * (1 + threshold):
+                regressions.append(
+                    f"{case}: {metric} {base[metric]} -> {current[metric]} "
+                    f"(+{(current[metric] / base[metric] - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", default=",".join(OPERATIONS))
+    parser.add_argument("--fixtures", default=",".join(PHONE_IMAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the full report as JSON")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", help="write this run as the new baseline")
+    args = parser.parse_args()
+
+    report = run(args)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[image-bench] report written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = check_regressions(report, baseline, args.threshold)
+        if regressions:
+            print(f"[image-bench] {len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"[image-bench] no regressions over {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+End-to-end load test against the fake providers.
+
+Starts benchmarks.fake_providers and a worker (uvicorn main:app) wired to it,
+seeds source media into the fake storage, then drives the worker endpoints
+at a fixed concurrency and writes throughput and latency percentiles as JSON.
+
+Usage:
+    python -m benchmarks.load_test --concurrency 16 --requests 200 \\
+        --endpoints generate-video,watermark-image --output bench_output.json
+    python -m benchmarks.load_test --compare old.json new.json
+
+The merge and watermark-video scenarios need ffmpeg to build real clips and
+are skipped without it.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import httpx
+
+from benchmarks import fake_providers
+from benchmarks.fixtures import SUPABASE_KEY, WORKER_SECRET, make_jpeg, make_mp4, worker_env
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("generate-video", "merge-videos", "watermark-image", "watermark-video")
+
+
+# =====================================================
+# STATS
+# =====================================================
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies: List[float], errors: dict, wall_seconds: float, total: int) -> dict:
+    ok = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "requests": total,
+        "succeeded": len(ok),
+        "failed": total - len(ok),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_ms": {
+            "min": ms(ok[0] if ok else None),
+            "mean": ms(sum(ok) / len(ok) if ok else None),
+            "p50": ms(percentile(ok, 50)),
+            "p95": ms(percentile(ok, 95)),
+            "p99": ms(percentile(ok, 99)),
+            "max": ms(ok[-1] if ok else None),
+        },
+    }
+
+
+# =====================================================
+# PROCESSES
+# =====================================================
+
+def _fake_cli_args(args: argparse.Namespace) -> List[str]:
+    out = []
+    for flag in ("latency_ms", "jitter_ms", "failure_rate", "render_seconds",
+                 "render_failure_rate", "veo_output", "video_size_kb", "video_fixture"):
+        value = getattr(args, flag)
+        if value is not None:
+            out += [f"--{flag.replace('_', '-')}", str(value)]
+    return out
+
+
+async def _wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"process for {url} exited with code {proc.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+# =====================================================
+# SCENARIOS
+# =====================================================
+
+async def seed_media(fake_url: str, workdir: str) -> dict:
+    """Upload source media into the fake storage and return their public URLs."""
+    media = {"image": make_jpeg(1080, 1920)}
+    for name, seconds in (("clip_a", 4), ("clip_b", 3)):
+        path = make_mp4(os.path.join(workdir, f"{name}.mp4"), seconds=seconds)
+        if path:
+            with open(path, "rb") as f:
+                media[name] = f.read()
+
+    urls = {}
+    headers = {"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
+    async with httpx.AsyncClient(timeout=30) as client:
+        for name, content in media.items():
+            ext = "jpg" if name == "image" else "mp4"
+            object_path = f"creative-media/bench/{name}.{ext}"
+            r = await client.post(f"{fake_url}/storage/v1/object/{object_path}", headers=headers, content=content)
+            r.raise_for_status()
+            urls[name] = f"{fake_url}/storage/v1/object/public/{object_path}"
+    return urls
+
+
+def build_payload(endpoint: str, media: dict, engine: str) -> Optional[dict]:
+    job_id = str(uuid.uuid4())
+    if endpoint == "generate-video":
+        return {"generation_id": job_id, "image_url": media["image"], "prompt": "benchmark scene",
+                "duration": 8, "aspect_ratio": "9:16", "engine": engine}
+    if endpoint == "watermark-image":
+        return {"image_url": media["image"], "generation_id": job_id}
+    if "clip_a" not in media:
+        return None
+    if endpoint == "merge-videos":
+        return {"sequence_id": job_id, "clips": [
+            {"url": media["clip_a"], "trim_start": 0.5},
+            {"url": media["clip_b"]},
+        ]}
+    if endpoint == "watermark-video":
+        return {"video_url": media["clip_a"], "generation_id": job_id}
+    raise ValueError(endpoint)
+
+
+async def run_scenario(worker_url: str, endpoint: str, media: dict, args: argparse.Namespace) -> Optional[dict]:
+    if build_payload(endpoint, media, args.engine) is None:
+        print(f"[load-test] skipping {endpoint}: needs ffmpeg for clip fixtures")
+        return None
+
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    errors: dict = {}
+    headers = {"Authorization": f"Bearer {WORKER_SECRET}"}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(timeout=args.request_timeout, limits=limits) as client:
+
+        async def one():
+            async with sem:
+                payload = build_payload(endpoint, media, args.engine)
+                started = time.perf_counter()
+                try:
+                    r = await client.post(f"{worker_url}/{endpoint}", json=payload, headers=headers)
+                    elapsed = time.perf_counter() - started
+                    body = r.json() if r.headers.get("content-type", "").startswith("application/json") else {}
+                    if r.status_code == 200 and body.get("status") == "success":
+                        latencies.append(elapsed)
+                        return
+                    key = f"http_{r.status_code}:{str(body.get('message', ''))[:80]}"
+                except Exception as e:
+                    key = type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+
+        print(f"[load-test] {endpoint}: {args.requests} requests at concurrency {args.concurrency}")
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        wall = time.perf_counter() - started
+
+    summary = summarize(latencies, errors, wall, args.requests)
+    lat = {k: "n/a" if v is None else f"{v}ms" for k, v in summary["latency_ms"].items()}
+    print(f"[load-test] {endpoint}: {summary['throughput_rps']} req/s, "
+          f"p50={lat['p50']} p95={lat['p95']} p99={lat['p99']}, failed={summary['failed']}")
+    return summary
+
+
+async def run(args: argparse.Namespace) -> dict:
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    for e in endpoints:
+        if e not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint '{e}', expected one of {', '.join(ENDPOINTS)}")
+
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    worker_url = args.worker_url or f"http://127.0.0.1:{args.worker_port}"
+    procs = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.video_fixture is None and any(e in ("merge-videos", "watermark-video") for e in endpoints):
+            # Make the "generated" video a real clip too, so downstream steps stay realistic
+            args.video_fixture = make_mp4(os.path.join(workdir, "generated.mp4"), seconds=8)
+
+        try:
+            fake = subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.fake_providers", "--port", str(args.fake_port)]
+                + _fake_cli_args(args),
+                cwd=REPO_ROOT,
+            )
+            procs.append(fake)
+            await _wait_until_up(f"{fake_url}/__stats", fake)
+
+            if not args.worker_url:
+                worker = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                     "--port", str(args.worker_port), "--log-level", "warning"],
+                    cwd=REPO_ROOT,
+                    env=worker_env(fake_url, poll_interval=args.poll_interval),
+                    stdout=None if args.verbose else subprocess.DEVNULL,
+                )
+                procs.append(worker)
+                await _wait_until_up(f"{worker_url}/docs", worker)
+
+            media = await seed_media(fake_url, workdir)
+
+            results = {}
+            for endpoint in endpoints:
+                summary = await run_scenario(worker_url, endpoint, media, args)
+                if summary:
+                    results[endpoint] = summary
+
+            async with httpx.AsyncClient(timeout=10) as client:
+                provider_stats = (await client.get(f"{fake_url}/__stats")).json()
+        finally:
+            for proc in reversed(procs):
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "host": platform.node(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "engine": args.engine,
+            "fake_providers": _fake_cli_args(args),
+        },
+        "results": results,
+        "providers": provider_stats,
+    }
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# =====================================================
+# COMPARE
+# =====================================================
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+
+    def delta(a, b):
+        if a in (None, 0) or b is None:
+            return "n/a"
+        return f"{(b - a) / a * 100:+.1f}%"
+
+    for endpoint in sorted(set(old) | set(new)):
+        if endpoint not in old or endpoint not in new:
+            print(f"{endpoint}: only in {'new' if endpoint in new else 'old'}")
+            continue
+        o, n = old[endpoint], new[endpoint]
+        print(f"{endpoint}:")
+        print(f"  throughput  {o['throughput_rps']:>10} -> {n['throughput_rps']:<10} {delta(o['throughput_rps'], n['throughput_rps'])}")
+        for p in ("p50", "p95", "p99"):
+            a, b = o["latency_ms"][p], n["latency_ms"][p]
+            print(f"  {p} ms      {a!s:>10} -> {b!s:<10} {delta(a, b)}")
+        print(f"  failed      {o['failed']:>10} -> {n['failed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+    parser.add_argument("--engine", choices=("veo3", "sora2"), default="veo3")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--worker-port", type=int, default=9180)
+    parser.add_argument("--worker-url", help="drive an already running worker instead of spawning one")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Veo/Sora poll interval for the spawned worker")
+    parser.add_argument("--request-timeout", type=float, default=600)
+    parser.add_argument("--verbose", action="store_true", help="show worker stdout")
+    fake_providers.add_arguments(parser)
+    # Only forward fake-provider flags the user actually set
+    parser.set_defaults(render_seconds=None, render_failure_rate=None, veo_output=None, video_size_kb=None)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[load-test] results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
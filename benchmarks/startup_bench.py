@@ -0,0 +1,157 @@
+"""
+Cold-start benchmark for the worker.
+
+Measures, in fresh interpreters:
+  - how long `import main` takes (median of --runs), against --budget-ms
+  - which heavy modules got imported eagerly (Pillow, httpx, google-auth,
+    the Sora engine should all wait for first use)
+  - with --serve, the time from spawning uvicorn until /ready returns 200,
+    with warmup running against the fake providers
+
+Exits with status 1 when the import budget is exceeded or a heavy module is
+imported at module load.
+
+Usage:
+    python -m benchmarks.startup_bench --runs 5 --budget-ms 900
+    python -m benchmarks.startup_bench --serve --output startup.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.fixtures import PROVIDER_ENV_KEYS, worker_env
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be loaded by `import main` alone
+LAZY_MODULES = ("PIL", "httpx", "google.auth", "google.oauth2", "sora2_engine")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({"import_ms": elapsed * 1000, "eager": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def measure_import(runs: int, env: dict) -> dict:
+    samples, eager = [], set()
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE], cwd=REPO_ROOT, env=env,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        data = json.loads(out)
+        samples.append(data["import_ms"])
+        eager.update(data["eager"])
+    return {
+        "runs": runs,
+        "import_ms_median": round(statistics.median(samples), 1),
+        "import_ms_min": round(min(samples), 1),
+        "eager_heavy_modules": sorted(eager),
+    }
+
+
+def top_imports(env: dict, limit: int = 10) -> list:
+    """Slowest modules by cumulative time, from -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name))
+    rows.sort(reverse=True)
+    return [{"module": name.strip(), "cumulative_ms": round(us / 1000, 1)} for us, name in rows[:limit]]
+
+
+async def measure_ready(port: int, fake_port: int) -> dict:
+    """Spawn fake providers + uvicorn and time until /ready answers 200."""
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    fake = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_providers", "--port", str(fake_port)], cwd=REPO_ROOT)
+    worker = None
+    try:
+        async with httpx.AsyncClient(timeout=2) as client:
+            for _ in range(150):
+                try:
+                    await client.get(f"{fake_url}/__stats")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+            env = worker_env(fake_url)
+            started = time.perf_counter()
+            worker = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                 "--port", str(port), "--log-level", "warning"],
+                cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL,
+            )
+            listening_ms = None
+            while time.perf_counter() - started < 60:
+                try:
+                    r = await client.get(f"http://127.0.0.1:{port}/ready")
+                    if listening_ms is None:
+                        listening_ms = (time.perf_counter() - started) * 1000
+                    if r.status_code == 200:
+                        return {
+                            "listening_ms": round(listening_ms, 1),
+                            "ready_ms": round((time.perf_counter() - started) * 1000, 1),
+                            "warmup": r.json(),
+                        }
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.05)
+            raise RuntimeError("worker did not become ready within 60s")
+    finally:
+        for proc in (worker, fake):
+            if proc:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=900, help="max median import time of main")
+    parser.add_argument("--serve", action="store_true", help="also measure spawn -> /ready")
+    parser.add_argument("--port", type=int, default=9181)
+    parser.add_argument("--fake-port", type=int, default=9101)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    # No provider credentials: importing must neither crash nor need them
+    env = {k: v for k, v in os.environ.items() if k not in PROVIDER_ENV_KEYS}
+
+    report = {"import": measure_import(args.runs, env), "top_imports": top_imports(env)}
+    if args.serve:
+        report["serve"] = asyncio.run(measure_ready(args.port, args.fake_port))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if report["import"]["import_ms_median"] > args.budget_ms:
+        failures.append(f"import main took {report['import']['import_ms_median']}ms (budget {args.budget_ms}ms)")
+    if report["import"]["eager_heavy_modules"]:
+        failures.append(f"heavy modules imported eagerly: {', '.join(report['import']['eager_heavy_modules'])}")
+    for failure in failures:
+        print(f"[startup-bench] FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
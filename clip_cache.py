@@ -0,0 +1,363 @@
+"""
+On-disk cache of downloaded clips for /merge-videos.
+
+Users re-merge the same sequence over and over while tuning trims, and every
+merge used to download every clip again. Entries are keyed by URL and hold
+the body plus its ETag; a cached clip is revalidated with If-None-Match, so a
+hit costs one 304 round trip instead of the whole download.
+
+  - byte budget with LRU eviction (least recently served goes first)
+  - one asyncio.Lock per URL: concurrent merges of the same sequence download
+    each clip once, the others wait and get the fresh entry
+  - clips are hardlinked into the caller's temp dir, so evicting an entry
+    never pulls a file out from under a running ffmpeg
+  - sha256 of the body is kept with the entry (content key for later stages)
+  - the index is rebuilt from the .json sidecars at startup
+
+Responses without an ETag are passed through uncached.
+
+SegmentCache holds the trimmed segments built from those clips, addressed by
+(clip sha256, trim_start, trim_end, output format), so a re-merge where one
+trim changed only re-cuts that one clip.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Dict, Optional
+
+import metrics
+
+if TYPE_CHECKING:
+    import httpx
+
+CHUNK_SIZE = 256 * 1024
+
+# Names the caches write: 64-hex key + .mp4 / .json / .mp4.part. Startup
+# cleanup only ever touches these, so a shared or misconfigured root (e.g.
+# SEGMENT_CACHE_DIR=/tmp) keeps everything else
+_CACHE_FILE = re.compile(r"^([0-9a-f]{64})\.(mp4|json|mp4\.part)$")
+
+
+def _link(src: str, dest: str):
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        # Different filesystem (or no hardlinks): plain copy
+        shutil.copyfile(src, dest)
+
+
+@dataclass
+class _Entry:
+    url: str
+    etag: str
+    sha256: str
+    size: int
+    last_used: float
+
+
+@dataclass
+class FetchResult:
+    path: str
+    sha256: str
+    size: int
+    # "hit" (304), "miss" (downloaded and cached), "uncached" (no ETag / cache off)
+    source: str
+
+
+class ClipCache:
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # -------------------------------------------------
+    # Index
+    # -------------------------------------------------
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.mp4")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.root):
+            match = _CACHE_FILE.match(name)
+            if match is None:
+                continue
+            key, ext = match.groups()
+            if ext == "mp4.part":
+                # Download interrupted by a crash
+                os.remove(os.path.join(self.root, name))
+                continue
+            if ext != "json":
+                continue
+            try:
+                with open(self._meta_path(key)) as f:
+                    entry = _Entry(**json.load(f))
+                if os.path.getsize(self._body_path(key)) != entry.size:
+                    raise ValueError("size mismatch")
+            except (OSError, ValueError, TypeError):
+                self._remove(key)
+                continue
+            entries.append((key, entry))
+        for key, entry in sorted(entries, key=lambda e: e[1].last_used):
+            self._entries[key] = entry
+            self._bytes += entry.size
+        self._evict()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        lock = self._locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._locks[key]
+        for path in (self._body_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, keep: Optional[str] = None):
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            self._remove(key)
+            metrics.incr("clip_cache.evictions")
+
+    def _touch(self, key: str, entry: _Entry):
+        entry.last_used = time.time()
+        self._entries.move_to_end(key)
+        # Only last_used changes; losing it on a crash just makes the LRU order stale
+        try:
+            with open(self._meta_path(key), "w") as f:
+                json.dump(asdict(entry), f)
+        except OSError:
+            pass
+
+    # -------------------------------------------------
+    # Fetch
+    # -------------------------------------------------
+    @staticmethod
+    async def _download(response: "httpx.Response", path: str) -> tuple:
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "wb") as f:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        return digest.hexdigest(), size
+
+    async def fetch(self, client: "httpx.AsyncClient", url: str, dest: str) -> FetchResult:
+        """Put the clip at `url` into `dest`, from the cache when its ETag still matches."""
+        if not self.enabled:
+            async with client.stream("GET", url, timeout=120) as response:
+                response.raise_for_status()
+                sha256, size = await self._download(response, dest)
+            self.bytes_downloaded += size
+            return FetchResult(dest, sha256, size, "uncached")
+
+        key = self._key(url)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            headers = {"If-None-Match": entry.etag} if entry is not None else {}
+
+            async with client.stream("GET", url, headers=headers, timeout=120) as response:
+                if response.status_code == 304 and entry is not None:
+                    self.hits += 1
+                    self.bytes_saved += entry.size
+                    metrics.incr("clip_cache.hits")
+                    self._touch(key, entry)
+                    _link(self._body_path(key), dest)
+                    return FetchResult(dest, entry.sha256, entry.size, "hit")
+
+                response.raise_for_status()
+                self.misses += 1
+                metrics.incr("clip_cache.misses")
+                etag = response.headers.get("etag")
+
+                if not etag:
+                    sha256, size = await self._download(response, dest)
+                    self.bytes_downloaded += size
+                    return FetchResult(dest, sha256, size, "uncached")
+
+                partial = self._body_path(key) + ".part"
+                try:
+                    sha256, size = await self._download(response, partial)
+                except BaseException:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+                    raise
+
+            self.bytes_downloaded += size
+            if entry is not None:
+                self._remove(key)
+            os.replace(partial, self._body_path(key))
+            entry = _Entry(url=url, etag=etag, sha256=sha256, size=size, last_used=time.time())
+            self._entries[key] = entry
+            self._bytes += size
+            self._touch(key, entry)
+            _link(self._body_path(key), dest)
+            self._evict(keep=key)
+            return FetchResult(dest, sha256, size, "miss")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "bytes_downloaded": self.bytes_downloaded,
+        }
+
+
+class SegmentCache:
+    """
+    Content-addressed trimmed segments: {key}.mp4 under `root`, LRU by mtime
+    within `max_bytes`. Keys come from key(); callers hold lock(key) around
+    get()/put() so two merges never cut the same segment twice.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # key -> (lock, holders + waiters), dropped when the last one leaves
+        self._locks: Dict[str, tuple] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            files = []
+            for name in os.listdir(root):
+                match = _CACHE_FILE.match(name)
+                if match is None:
+                    continue
+                path = os.path.join(root, name)
+                if match.group(2) != "mp4":
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, match.group(1), stat.st_size))
+            for _, key, size in sorted(files):
+                self._entries[key] = size
+                self._bytes += size
+            self._evict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(clip_sha256: str, trim_start: float, trim_end: Optional[float], output_format: str) -> str:
+        raw = f"{clip_sha256}|{trim_start:.3f}|{'' if trim_end is None else f'{trim_end:.3f}'}|{output_format}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.mp4")
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            metrics.incr("segment_cache.evictions")
+
+    @asynccontextmanager
+    async def lock(self, key: str):
+        lock, users = self._locks.get(key) or (asyncio.Lock(), 0)
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+    def get(self, key: str, dest: str) -> bool:
+        """Link the cached segment into `dest`; False if it is not cached."""
+        if not self.enabled or key not in self._entries:
+            self.misses += 1
+            metrics.incr("segment_cache.misses")
+            return False
+        try:
+            _link(self._path(key), dest)
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            self._bytes -= self._entries.pop(key)
+            self.misses += 1
+            metrics.incr("segment_cache.misses")
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        metrics.incr("segment_cache.hits")
+        return True
+
+    def put(self, key: str, path: str):
+        """Keep the segment at `path` (left in place for the caller)."""
+        if not self.enabled:
+            return
+        _link(path, self._path(key))
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)
+        size = os.path.getsize(path)
+        self._entries[key] = size
+        self._bytes += size
+        self._evict()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
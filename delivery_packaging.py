@@ -0,0 +1,203 @@
+"""
+Delivery packaging for finished videos (generate-video, merge, watermark).
+
+  - faststart: moves the moov atom ahead of mdat with a stream-copy remux,
+    so players start after the first bytes instead of fetching the whole
+    file. Files whose moov already comes first (or fragmented MP4s, which
+    start with an empty moov) are left untouched.
+  - HLS ladder (optional): one ffmpeg run splits the video into renditions
+    (e.g. 720p/480p/360p, by the short side, so 9:16 renders become 720x1280
+    and so on), each with 4s segments and its own playlist, plus a
+    master.m3u8. The caller uploads the tree next to the MP4.
+
+ffmpeg runs as an async subprocess; nothing here blocks the event loop.
+"""
+
+import asyncio
+import os
+import struct
+import tempfile
+from typing import List, Optional, Sequence
+
+HLS_SEGMENT_SECONDS = 4
+# Video bitrate per rendition (short side -> kbps); others get ~short_side*4
+HLS_BITRATES = {1080: 5000, 720: 2800, 480: 1400, 360: 800, 240: 400}
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".mp4": "video/mp4",
+}
+
+
+class PackagingError(Exception):
+    pass
+
+
+def moov_before_mdat(data: bytes) -> Optional[bool]:
+    """
+    Walk the top-level MP4 boxes: True if moov comes before mdat, False if
+    after, None if this does not look like an MP4 (or either box is missing).
+    """
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box = struct.unpack(">I4s", data[offset:offset + 8])
+        if size == 1:
+            if offset + 16 > len(data):
+                return None
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+        elif size == 0:
+            size = len(data) - offset
+        if size < 8:
+            return None
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        offset += size
+    return None
+
+
+async def _ffmpeg(args: Sequence[str], timeout: float = 600):
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-v", "error", *args,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise PackagingError(f"ffmpeg timed out after {timeout:.0f}s")
+    if process.returncode != 0:
+        raise PackagingError(f"ffmpeg failed: {stderr.decode(errors='replace')[-500:]}")
+
+
+async def remux_faststart(src_path: str, dst_path: str):
+    """Stream-copy remux with the moov atom up front (no re-encode)."""
+    await _ffmpeg(["-i", src_path, "-map", "0", "-c", "copy", "-movflags", "+faststart", dst_path])
+
+
+async def faststart_bytes(data: bytes) -> bytes:
+    """`data` with its moov moved to the front; unchanged if already there or not an MP4."""
+    if moov_before_mdat(data) is not False:
+        return data
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "in.mp4")
+        dst = os.path.join(tmpdir, "out.mp4")
+        await asyncio.to_thread(_write, src, data)
+        await remux_faststart(src, dst)
+        return await asyncio.to_thread(_read, dst)
+
+
+def _moov_before_mdat_file(path: str) -> Optional[bool]:
+    """moov_before_mdat() reading only the top-level box headers of a file."""
+    size_total = os.path.getsize(path)
+    offset = 0
+    with open(path, "rb") as f:
+        while offset + 8 <= size_total:
+            f.seek(offset)
+            header = f.read(16)
+            size, box = struct.unpack(">I4s", header[:8])
+            if size == 1:
+                if len(header) < 16:
+                    return None
+                size = struct.unpack(">Q", header[8:16])[0]
+            elif size == 0:
+                size = size_total - offset
+            if size < 8:
+                return None
+            if box == b"moov":
+                return True
+            if box == b"mdat":
+                return False
+            offset += size
+    return None
+
+
+async def faststart_file(path: str) -> str:
+    """Path of a faststart version of `path`: itself if moov is already first, else a remuxed sibling."""
+    if await asyncio.to_thread(_moov_before_mdat_file, path) is not False:
+        return path
+    root, ext = os.path.splitext(path)
+    dst = f"{root}.faststart{ext or '.mp4'}"
+    await remux_faststart(path, dst)
+    return dst
+
+
+def _write(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def parse_ladder(value: str) -> List[int]:
+    """'720,480,360' -> [720, 480, 360] (largest first, duplicates dropped)."""
+    sizes = {int(v) for v in value.replace(" ", "").split(",") if v.isdigit() and int(v) > 0}
+    return sorted(sizes, reverse=True)
+
+
+async def build_hls(
+    src_path: str,
+    out_dir: str,
+    rungs: Sequence[int],
+    source_short_side: Optional[int] = None,
+    has_audio: bool = True,
+) -> List[str]:
+    """
+    Encode an HLS ladder of `src_path` into `out_dir`:
+      master.m3u8, v0/index.m3u8, v0/seg_000.ts, v1/...
+    `rungs` are short-side sizes; rungs above the source are skipped (never
+    upscale). Returns the written files relative to out_dir, master last.
+    """
+    rungs = [r for r in rungs if source_short_side is None or r <= source_short_side] or [min(rungs)]
+
+    split = f"[0:v]split={len(rungs)}" + "".join(f"[s{i}]" for i in range(len(rungs)))
+    # Short side to the rung, long side keeps the aspect ratio (even, for x264)
+    scales = [f"[s{i}]scale='if(gt(iw,ih),-2,{r})':'if(gt(iw,ih),{r},-2)'[v{i}]" for i, r in enumerate(rungs)]
+    args = ["-i", src_path, "-filter_complex", ";".join([split, *scales])]
+
+    stream_map = []
+    for i, r in enumerate(rungs):
+        kbps = HLS_BITRATES.get(r, r * 4)
+        args += [
+            "-map", f"[v{i}]",
+            f"-c:v:{i}", "libx264", f"-preset:v:{i}", "veryfast",
+            f"-b:v:{i}", f"{kbps}k", f"-maxrate:v:{i}", f"{int(kbps * 1.1)}k", f"-bufsize:v:{i}", f"{kbps * 2}k",
+        ]
+        if has_audio:
+            args += ["-map", "0:a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", "128k"]
+        stream_map.append(f"v:{i},a:{i}" if has_audio else f"v:{i}")
+
+    args += [
+        # Keyframes on segment boundaries so every rendition switches cleanly
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(out_dir, "v%v", "seg_%03d.ts"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(stream_map),
+        os.path.join(out_dir, "v%v", "index.m3u8"),
+    ]
+    await _ffmpeg(args, timeout=1800)
+
+    files = []
+    for root, _, names in os.walk(out_dir):
+        for name in sorted(names):
+            rel = os.path.relpath(os.path.join(root, name), out_dir)
+            if rel != "master.m3u8":
+                files.append(rel)
+    if not os.path.exists(os.path.join(out_dir, "master.m3u8")):
+        raise PackagingError("ffmpeg did not write master.m3u8")
+    # Segments, then rendition playlists, master last: whatever a playlist
+    # points to is uploaded before it
+    return sorted(files, key=lambda f: (f.endswith(".m3u8"), f)) + ["master.m3u8"]
+
+
+def content_type(path: str) -> str:
+    return CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
@@ -0,0 +1,155 @@
+"""
+In-process fan-out of job progress events, served as SSE on GET /jobs/{id}/events.
+
+Memory is bounded per job, not per subscriber: each job keeps its last
+`history` events in a ring buffer plus one asyncio.Event that is swapped on
+every publish. A subscriber is just a cursor (last sequence number seen)
+waiting on that Event, so thousands of idle connections cost a suspended
+coroutine each and no queues. A subscriber that falls more than `history`
+events behind skips ahead instead of holding memory for it.
+
+Finished jobs (a "done" or "error" event) are kept for `retain_seconds` so a
+client that connects late still gets the final event. A non-terminal event
+on a finished job starts it over: its history is cleared first. Beyond `max_jobs`,
+jobs nobody is subscribed to are dropped, oldest finished ones first; a job
+with a subscriber is never dropped.
+
+Subscribing to an id nothing was published for yet (the client connected
+before the job started) creates a waiting entry, outside `max_jobs` and
+capped at `max_waiting`, so requests for random ids cannot push real jobs
+out. A waiting entry goes away with its last subscriber.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import metrics
+
+TERMINAL_EVENTS = ("done", "error")
+
+
+class _Job:
+    __slots__ = ("events", "seq", "changed", "finished_at", "subscribers")
+
+    def __init__(self, history: int):
+        self.events: deque = deque(maxlen=history)
+        self.seq = 0
+        self.changed = asyncio.Event()
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+
+
+class EventHub:
+
+    def __init__(
+        self,
+        history: int = 32,
+        retain_seconds: float = 600,
+        max_jobs: int = 5000,
+        max_waiting: int = 1000,
+    ):
+        self.history = history
+        self.retain_seconds = retain_seconds
+        self.max_jobs = max_jobs
+        self.max_waiting = max_waiting
+        self._jobs: "OrderedDict[str, _Job]" = OrderedDict()
+        # Subscribed to, nothing published yet
+        self._waiting: Dict[str, _Job] = {}
+
+    def _job(self, job_id: str) -> _Job:
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = self._waiting.pop(job_id, None) or _Job(self.history)
+            self._jobs[job_id] = job
+            self._prune()
+        return job
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id in [k for k, j in self._jobs.items()
+                       if j.finished_at is not None and not j.subscribers and now - j.finished_at > self.retain_seconds]:
+            del self._jobs[job_id]
+        excess = len(self._jobs) - self.max_jobs
+        if excess > 0:
+            # Unsubscribed jobs only, finished before unfinished; the sort is
+            # stable, so each group stays oldest first
+            idle = sorted((k for k, j in self._jobs.items() if not j.subscribers),
+                          key=lambda k: self._jobs[k].finished_at is None)
+            for job_id in idle[:excess]:
+                del self._jobs[job_id]
+                metrics.incr("events.jobs_evicted")
+
+    def accepts(self, job_id: str) -> bool:
+        """False when `job_id` is unknown and the waiting entries are at their cap."""
+        return job_id in self._jobs or job_id in self._waiting or len(self._waiting) < self.max_waiting
+
+    def publish(self, job_id: str, event: str, data: dict, skip_repeat: bool = False):
+        """
+        Record an event for `job_id` and wake its subscribers. Never blocks.
+        skip_repeat drops an event identical to the job's previous one (a
+        poll loop reporting "rendering" every few seconds).
+        """
+        job = self._job(job_id)
+        if skip_repeat and job.events and job.events[-1][1:] == (event, data):
+            return
+        if job.finished_at is not None and event not in TERMINAL_EVENTS:
+            # The id is reused (a retry, watermarking after the render): a new
+            # subscriber must not replay the old done/error and disconnect.
+            # seq keeps counting so Last-Event-ID cursors stay valid
+            job.events.clear()
+            metrics.incr("events.jobs_reopened")
+        job.seq += 1
+        job.events.append((job.seq, event, data))
+        job.finished_at = time.monotonic() if event in TERMINAL_EVENTS else None
+        self._jobs.move_to_end(job_id)
+        changed, job.changed = job.changed, asyncio.Event()
+        changed.set()
+        metrics.incr("events.published")
+
+    async def subscribe(
+        self,
+        job_id: str,
+        last_event_id: int = 0,
+        heartbeat: float = 15.0,
+    ) -> AsyncIterator[Optional[Tuple[int, str, dict]]]:
+        """
+        Yield (seq, event, data) after `last_event_id`, then new ones as they
+        arrive, until a terminal event. Yields None every `heartbeat` seconds
+        of silence so the caller can keep the connection alive.
+        """
+        job = self._jobs.get(job_id) or self._waiting.get(job_id)
+        if job is None:
+            if len(self._waiting) >= self.max_waiting:
+                metrics.incr("events.subscribe_rejected")
+                return
+            job = self._waiting[job_id] = _Job(self.history)
+        job.subscribers += 1
+        cursor = last_event_id
+        try:
+            while True:
+                waiter = job.changed
+                pending = [e for e in job.events if e[0] > cursor]
+                if pending and pending[0][0] > cursor + 1 and cursor:
+                    metrics.incr("events.subscriber_skipped")
+                for seq, event, data in pending:
+                    cursor = seq
+                    yield seq, event, data
+                    if event in TERMINAL_EVENTS:
+                        return
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            job.subscribers -= 1
+            if not job.subscribers and self._waiting.get(job_id) is job:
+                del self._waiting[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "jobs": len(self._jobs),
+            "waiting": len(self._waiting),
+            "subscribers": sum(j.subscribers for j in (*self._jobs.values(), *self._waiting.values())),
+        }
@@ -0,0 +1,97 @@
+"""
+Idempotency for long-running jobs keyed by an external id (generation_id).
+
+A retry of a job that is still running attaches to the running task instead
+of starting a second, billable generation; a retry of a job that already
+succeeded gets the stored result back until it expires.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import metrics
+
+STARTED = "started"
+ATTACHED = "attached"
+CACHED = "cached"
+
+
+class IdempotencyRegistry:
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float = 3600,
+        max_results: int = 5000,
+        cache_if: Optional[Callable[[dict], bool]] = None,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_results = max_results
+        # Only successes are cached by default: a retry after a failure should run again
+        self.cache_if = cache_if or (lambda result: result.get("status") == "success")
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._results: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    def _cached(self, key: str) -> Optional[dict]:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._results[key]
+            return None
+        return result
+
+    def _store(self, key: str, result: dict):
+        self._results[key] = (time.monotonic() + self.ttl_seconds, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def is_running(self, key: str) -> bool:
+        return key in self._inflight
+
+    def adopt(self, key: str, task: asyncio.Task):
+        """Register a task started elsewhere (e.g. resumed at startup) under `key`."""
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            result = task.result()
+            if isinstance(result, dict) and self.cache_if(result):
+                self._store(key, result)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[dict]]) -> Tuple[dict, str]:
+        """
+        Run factory() once per key. Returns (result, outcome) where outcome is
+        "started", "attached" (joined a running task) or "cached".
+        """
+        cached = self._cached(key)
+        if cached is not None:
+            metrics.incr(f"{self.name}.cached")
+            metrics.incr(f"{self.name}.double_submits")
+            return cached, CACHED
+
+        task = self._inflight.get(key)
+        if task is not None:
+            outcome = ATTACHED
+            metrics.incr(f"{self.name}.attached")
+            metrics.incr(f"{self.name}.double_submits")
+        else:
+            outcome = STARTED
+            metrics.incr(f"{self.name}.started")
+            task = asyncio.create_task(factory())
+            self.adopt(key, task)
+
+        # Shield so a caller going away (gateway timeout) doesn't cancel the job
+        # for the retry that is about to attach to it.
+        return await asyncio.shield(task), outcome
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._inflight), "cached_results": len(self._results)}
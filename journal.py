@@ -0,0 +1,155 @@
+"""
+Durable journal of submitted provider operations (Veo operation names,
+Sora video ids).
+
+Every generation is paid for once the provider accepts it, so the id is
+written down before polling starts. If the worker restarts mid-render, the
+pending entries are read back at startup and polling resumes instead of the
+result being lost with the process.
+
+Backed by SQLite. The file must live on a persistent volume to survive
+redeploys: OPERATION_JOURNAL_PATH, else the Railway volume
+(RAILWAY_VOLUME_MOUNT_PATH). The last-resort default under /tmp only
+survives process restarts inside the same container; ephemeral_reason()
+says why a path will not survive, so startup can complain loudly.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+ABANDONED = "abandoned"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    operation_id  TEXT PRIMARY KEY,
+    provider      TEXT NOT NULL,
+    generation_id TEXT NOT NULL,
+    context       TEXT NOT NULL,
+    status        TEXT NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_operations_status ON operations(status);
+"""
+
+
+@dataclass
+class JournalEntry:
+    operation_id: str
+    provider: str
+    generation_id: str
+    context: dict
+    attempts: int
+    created_at: float
+
+
+class OperationJournal:
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Writes are a handful of tiny rows per generation; a plain connection
+        # behind a lock is simpler than pushing them to a thread.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def record(self, operation_id: str, provider: str, generation_id: str, context: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO operations "
+                "(operation_id, provider, generation_id, context, status, attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                (operation_id, provider, generation_id, json.dumps(context), PENDING, now, now),
+            )
+
+    def complete(self, operation_id: Optional[str], status: str = DONE):
+        if not operation_id:
+            return
+        with self._lock:
+            self._conn.execute(
+                "UPDATE operations SET status = ?, updated_at = ? WHERE operation_id = ?",
+                (status, time.time(), operation_id),
+            )
+
+    def pending(self, max_age_seconds: float = 2 * 24 * 3600, max_attempts: int = 5) -> List[JournalEntry]:
+        """
+        Pending entries to resume, oldest first. Entries older than
+        max_age_seconds (providers expire their operations long before that)
+        or already resumed max_attempts times are marked abandoned; every
+        returned entry gets its attempt counter bumped.
+        """
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            self._conn.execute(
+                "UPDATE operations SET status = ?, updated_at = ? "
+                "WHERE status = ? AND (created_at < ? OR attempts >= ?)",
+                (ABANDONED, time.time(), PENDING, cutoff, max_attempts),
+            )
+            rows = self._conn.execute(
+                "SELECT operation_id, provider, generation_id, context, attempts, created_at "
+                "FROM operations WHERE status = ? ORDER BY created_at",
+                (PENDING,),
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE operations SET attempts = attempts + 1 WHERE status = ?", (PENDING,)
+            )
+        return [
+            JournalEntry(op_id, provider, gen_id, json.loads(ctx), attempts, created_at)
+            for op_id, provider, gen_id, ctx, attempts, created_at in rows
+        ]
+
+    def prune(self, older_than_seconds: float = 7 * 24 * 3600):
+        """Drop finished entries so the file doesn't grow forever."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM operations WHERE status != ? AND updated_at < ?",
+                (PENDING, time.time() - older_than_seconds),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM operations GROUP BY status").fetchall()
+        return dict(rows)
+
+
+def default_journal_path() -> str:
+    if os.environ.get("OPERATION_JOURNAL_PATH"):
+        return os.environ["OPERATION_JOURNAL_PATH"]
+    if os.environ.get("RAILWAY_VOLUME_MOUNT_PATH"):
+        return os.path.join(os.environ["RAILWAY_VOLUME_MOUNT_PATH"], "operation_journal.db")
+    return os.path.join(tempfile.gettempdir(), "render-worker", "operation_journal.db")
+
+
+def _mount_point(path: str) -> str:
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def ephemeral_reason(path: str) -> Optional[str]:
+    """Why a journal at `path` would be lost on redeploy, None if it looks persistent."""
+    directory = os.path.dirname(os.path.realpath(path))
+    tmp = os.path.realpath(tempfile.gettempdir())
+    if directory == tmp or directory.startswith(tmp + os.sep):
+        return f"{path} is under the temp dir"
+    # In a container the root filesystem is the image's writable layer,
+    # thrown away with the container; only a mounted volume persists
+    if os.path.exists("/.dockerenv") or os.environ.get("RAILWAY_ENVIRONMENT"):
+        if _mount_point(directory) == "/":
+            return f"{path} is on the container filesystem, not on a mounted volume"
+    return None
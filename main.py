@@ -1,23 +1,40 @@
 import os
+import sys
 import json
 import base64
 import asyncio
+import time
 import uuid
 import subprocess
 import tempfile
 import io
-import httpx
+import hashlib
+import functools
+from collections import OrderedDict
 
-from PIL import Image
-from typing import Optional, List
+from typing import Callable, Optional, List, TYPE_CHECKING
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
 
-from sora2_engine import call_sora, map_aspect_to_sora_size, resize_image_for_sora
-
-from fastapi.responses import JSONResponse
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request as GoogleRequest
+from fastapi.responses import JSONResponse, StreamingResponse
+
+import journal
+import metrics
+import delivery_packaging
+import status_writer as stages
+from admission import AdmissionController, AdmissionRejected, Cost, default_budgets
+from clip_cache import ClipCache, SegmentCache
+from events import EventHub
+from idempotency import IdempotencyRegistry
+from media_probe import MediaProbe, ProbeError
+from status_writer import StatusWriter
+from veo_stream import InlineVideoExtractor
+
+# Pillow, httpx, google-auth and the Sora engine are imported where they are
+# first used, so a replica can start serving before paying for all of them.
+if TYPE_CHECKING:
+    import httpx
+    from PIL import Image
 
 # =====================================================
 # INIT FASTAPI FIRST (CRITICAL)
@@ -46,30 +63,184 @@ def verify_worker_auth(request: Request) -> bool:
 # ENV VARIABLES
 # =====================================================
 
-PROJECT_ID = os.environ["GOOGLE_CLOUD_PROJECT"]
-LOCATION = os.environ["GOOGLE_CLOUD_LOCATION"]
+# Read leniently: a missing variable only fails the requests that need it,
+# instead of crashing the whole replica at import.
+PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT", "")
+LOCATION = os.environ.get("GOOGLE_CLOUD_LOCATION", "")
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
+SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
 
-SUPABASE_URL = os.environ["SUPABASE_URL"]
-SUPABASE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+SERVICE_ACCOUNT_JSON = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_JSON", "")
 
-SERVICE_ACCOUNT_JSON = os.environ["GOOGLE_APPLICATION_CREDENTIALS_JSON"]
+_missing_env = [
+    name for name in (
+        "GOOGLE_CLOUD_PROJECT", "GOOGLE_CLOUD_LOCATION", "SUPABASE_URL",
+        "SUPABASE_SERVICE_ROLE_KEY", "GOOGLE_APPLICATION_CREDENTIALS_JSON",
+    )
+    if not os.environ.get(name)
+]
+if _missing_env:
+    print(f"WARNING: missing env vars: {', '.join(_missing_env)}")
+
+# Provider endpoints and poll cadence are overridable so the worker can be
+# pointed at the local stand-in servers in benchmarks/fake_providers.py.
+VERTEX_API_BASE = os.environ.get(
+    "VERTEX_API_BASE", f"https://{LOCATION}-aiplatform.googleapis.com"
+).rstrip("/")
+VEO_POLL_INTERVAL = max(0.05, float(os.environ.get("VEO_POLL_INTERVAL_SECONDS", "10")))
+GCS_API_BASE = os.environ.get("GCS_API_BASE", "https://storage.googleapis.com").rstrip("/")
+# Bucket for Veo reference images; when set they are sent as gcsUri instead of inline base64
+VEO_IMAGE_BUCKET = os.environ.get("VEO_IMAGE_BUCKET", "")
+# How long a staged image is trusted without re-checking the bucket; keep it
+# well below the bucket's lifecycle delete age
+VEO_IMAGE_MEMO_SECONDS = float(os.environ.get("VEO_IMAGE_MEMO_SECONDS", "3600"))
 
 # =====================================================
 # AUTH - dinamico (token renovado automaticamente)
 # =====================================================
 
-credentials_info = json.loads(SERVICE_ACCOUNT_JSON)
+_credentials = None
 
-credentials = service_account.Credentials.from_service_account_info(
-    credentials_info,
-    scopes=["https://www.googleapis.com/auth/cloud-platform"],
-)
+def get_credentials():
+    """Parse the service account on first use rather than at import."""
+    global _credentials
+    if _credentials is None:
+        if not SERVICE_ACCOUNT_JSON:
+            raise Exception("GOOGLE_APPLICATION_CREDENTIALS_JSON not configured")
+        from google.oauth2 import service_account
+
+        _credentials = service_account.Credentials.from_service_account_info(
+            json.loads(SERVICE_ACCOUNT_JSON),
+            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        )
+    return _credentials
 
 def get_access_token() -> str:
+    from google.auth.transport.requests import Request as GoogleRequest
+
+    credentials = get_credentials()
     if not credentials.valid:
         credentials.refresh(GoogleRequest())
     return credentials.token
 
+# =====================================================
+# HTTP CLIENT - pool compartilhado entre requests
+# =====================================================
+
+_http_client: "Optional[httpx.AsyncClient]" = None
+
+def get_http_client() -> "httpx.AsyncClient":
+    """
+    Shared AsyncClient so Supabase/Vertex connections are reused across
+    requests. Timeouts are passed per call, matching what each call site
+    used to configure on its own client.
+    """
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(
+            timeout=60,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _http_client
+
+# =====================================================
+# WARMUP / READINESS
+# =====================================================
+
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") != "0"
+
+_warmup_task: Optional[asyncio.Task] = None
+_warmup_report: Optional[dict] = None
+
+async def _run_warmup() -> dict:
+    """
+    Pay the cold-start costs up front: heavy imports, the service-account
+    token and TLS connections to Supabase/Vertex in the shared pool.
+    Failures are reported but don't block readiness, so a replica with bad
+    Google credentials can still serve watermark traffic.
+    """
+    global _warmup_report
+    report = {"steps_ms": {}, "errors": {}}
+
+    async def step(name, fn):
+        started = time.perf_counter()
+        try:
+            await fn()
+        except Exception as e:
+            report["errors"][name] = str(e)[:300]
+        report["steps_ms"][name] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def imports():
+        import sora2_engine  # noqa: F401 (pulls in Pillow and httpx too)
+        _load_watermark()
+
+    async def token():
+        # google-auth refreshes with blocking I/O, keep it off the event loop
+        await asyncio.to_thread(get_access_token)
+
+    async def connections():
+        client = get_http_client()
+        hosts = [u for u in (SUPABASE_URL, VERTEX_API_BASE) if u.startswith("http")]
+        results = await asyncio.gather(*(client.head(u, timeout=10) for u in hosts), return_exceptions=True)
+        errors = [f"{u}: {r}" for u, r in zip(hosts, results) if isinstance(r, Exception)]
+        if errors:
+            raise Exception("; ".join(errors))
+
+    await step("imports", imports)
+    await step("token", token)
+    await step("connections", connections)
+
+    print(f"Warmup done: {report}")
+    _warmup_report = report
+    return report
+
+def _start_warmup() -> asyncio.Task:
+    global _warmup_task
+    if _warmup_task is None:
+        _warmup_task = asyncio.create_task(_run_warmup())
+    return _warmup_task
+
+@app.on_event("startup")
+async def on_startup():
+    if WARMUP_ON_STARTUP:
+        _start_warmup()
+    resume_pending_operations()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await status_writer.close()
+    if _http_client is not None:
+        await _http_client.aclose()
+    _kill_scraper_process()
+    if _scraper_supervisor is not None:
+        _scraper_supervisor.cancel()
+
+@app.post("/warmup")
+async def warmup(request: Request):
+    """Run (or join) the warmup and return what it did. Safe to call repeatedly."""
+    if not verify_worker_auth(request):
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+    report = await asyncio.shield(_start_warmup())
+    return {"status": "success", **report}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until warmup has finished."""
+    if _warmup_report is None:
+        if not WARMUP_ON_STARTUP:
+            _start_warmup()
+        return JSONResponse(status_code=503, content={"status": "warming"})
+    return {"status": "ready", **_warmup_report}
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    if not verify_worker_auth(request):
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+    return metrics.snapshot()
+
 # =====================================================
 # REQUEST MODELS
 # =====================================================
@@ -96,6 +267,8 @@ class GenerateVideoRequest(BaseModel):
     sora_model: Optional[str] = None
     custom_instructions: Optional[str] = None
     prompt_language: Optional[str] = "pt"
+    # Variations of the same scene in one Veo operation (sampleCount, 1-4; Veo only)
+    samples: Optional[int] = 1
     # Pet video fields
     is_pet: Optional[bool] = False
     background_reference_url: Optional[str] = None
@@ -110,6 +283,11 @@ class MergeVideosRequest(BaseModel):
     sequence_id: str
     video_urls: Optional[List[str]] = None
     clips: Optional[List[ClipConfig]] = None
+    # Pipe ffmpeg's output (fragmented MP4) into the upload while it encodes;
+    # defaults to MERGE_STREAM_OUTPUT
+    stream_output: Optional[bool] = None
+    # Fast watermarked 360p proxy to check the edit; the full render is a separate call
+    preview: Optional[bool] = False
 
 # =====================================================
 # BUILD VEO PROMPT (enriquece com metadados cinematicos)
@@ -141,13 +319,13 @@ def build_veo_prompt(req: GenerateVideoRequest) -> str:
 
 async def download_image_bytes(url: str):
 
-    async with httpx.AsyncClient(timeout=60) as client:
+    client = get_http_client()
 
-        response = await client.get(url)
+    response = await client.get(url, timeout=60)
 
-        response.raise_for_status()
+    response.raise_for_status()
 
-        return response.content
+    return response.content
 
 
 async def compose_pet_image(
@@ -162,6 +340,32 @@ async def compose_pet_image(
     When product is provided, overlay it in the bottom-right corner.
     This gives Veo3/Sora2 visual context for the scene.
     """
+    bg_bytes = None
+    if background_url:
+        try:
+            bg_bytes = await download_image_bytes(background_url)
+        except Exception as e:
+            print(f"Failed to compose background, using pet only: {e}")
+
+    prod_bytes = None
+    if product_url:
+        try:
+            prod_bytes = await download_image_bytes(product_url)
+        except Exception as e:
+            print(f"Failed to compose product: {e}")
+
+    return compose_pet_canvas(pet_bytes, bg_bytes, prod_bytes, target_ratio)
+
+
+def compose_pet_canvas(
+    pet_bytes: bytes,
+    bg_bytes: bytes = None,
+    prod_bytes: bytes = None,
+    target_ratio: str = "9:16",
+) -> bytes:
+    """CPU half of compose_pet_image, kept separate so it can be benchmarked offline."""
+    from PIL import Image
+
     w_ratio, h_ratio = map(int, target_ratio.split(":"))
     # Target canvas size
     if w_ratio > h_ratio:
@@ -171,9 +375,8 @@ async def compose_pet_image(
 
     pet_img = Image.open(io.BytesIO(pet_bytes)).convert("RGB")
 
-    if background_url:
+    if bg_bytes:
         try:
-            bg_bytes = await download_image_bytes(background_url)
             bg_img = Image.open(io.BytesIO(bg_bytes)).convert("RGB")
             # Resize background to fill canvas
             bg_img = bg_img.resize((canvas_w, canvas_h), Image.LANCZOS)
@@ -193,9 +396,8 @@ async def compose_pet_image(
     else:
         canvas = pet_img.resize((canvas_w, canvas_h), Image.LANCZOS)
 
-    if product_url:
+    if prod_bytes:
         try:
-            prod_bytes = await download_image_bytes(product_url)
             prod_img = Image.open(io.BytesIO(prod_bytes)).convert("RGBA")
             # Resize product to ~25% of canvas height
             prod_h = int(canvas_h * 0.25)
@@ -228,6 +430,8 @@ def crop_image_to_ratio(image_bytes: bytes, target_ratio: str = "9:16") -> bytes
     Veo image-to-video mode uses source image dimensions,
     so we must pre-process to ensure correct output ratio.
     """
+    from PIL import Image
+
     try:
         w_ratio, h_ratio = map(int, target_ratio.split(":"))
         target_aspect = w_ratio / h_ratio
@@ -268,15 +472,112 @@ def crop_image_to_ratio(image_bytes: bytes, target_ratio: str = "9:16") -> bytes
         print(f"Image crop warning (using original): {e}")
         return image_bytes
 
+# =====================================================
+# PACKAGING - faststart / HLS dos videos entregues
+# =====================================================
+
+# Stream-copy remux with moov up front before every MP4 upload (cheap)
+PACKAGE_FASTSTART = os.environ.get("PACKAGE_FASTSTART", "1") == "1"
+# HLS ladder uploaded next to the MP4 as {name}/hls/master.m3u8 (re-encodes, off by default)
+PACKAGE_HLS = os.environ.get("PACKAGE_HLS", "0") == "1"
+PACKAGE_HLS_LADDER = delivery_packaging.parse_ladder(os.environ.get("PACKAGE_HLS_LADDER", "720,480,360"))
+
+_packaging_tasks: set = set()
+
+# Attempts from the spooled file when a streamed relay upload fails
+RELAY_UPLOAD_RETRIES = 3
+# How much of a relayed download is read before deciding whether its moov
+# comes first (the top-level box headers are in the first few KB)
+RELAY_PEEK_BYTES = 4 * 1024 * 1024
+
+def hls_object_prefix(file_name: str) -> str:
+    return f"{os.path.splitext(file_name)[0]}/hls"
+
+async def _upload_storage_object(data: bytes, object_path: str, content_type: str):
+
+    client = get_http_client()
+
+    response = await client.post(
+        f"{SUPABASE_URL}/storage/v1/object/videos/{object_path}",
+        headers={
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
+            "Content-Type": content_type,
+            "x-upsert": "true",
+        },
+        content=data,
+        timeout=120,
+    )
+
+    response.raise_for_status()
+
+async def _package_hls(video_bytes: bytes, file_name: str):
+    """Encode the HLS ladder for an uploaded MP4 and upload it under hls_object_prefix()."""
+
+    prefix = hls_object_prefix(file_name)
+
+    try:
+        async with admission.admit("package-hls", HLS_PACKAGE_COST):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                src_path = os.path.join(tmpdir, "source.mp4")
+                with open(src_path, "wb") as f:
+                    f.write(video_bytes)
+
+                try:
+                    info = await media_probe.probe(src_path)
+                    short_side = min(info.width, info.height) if info.width and info.height else None
+                    has_audio = info.has_audio
+                except ProbeError as e:
+                    print(f"[packaging] Probe warning for {file_name}: {e}")
+                    short_side, has_audio = None, True
+
+                out_dir = os.path.join(tmpdir, "hls")
+                files = await delivery_packaging.build_hls(
+                    src_path, out_dir, PACKAGE_HLS_LADDER, source_short_side=short_side, has_audio=has_audio,
+                )
+
+                # Segments and rendition playlists first, master last (build_hls order)
+                for rel in files:
+                    with open(os.path.join(out_dir, rel), "rb") as f:
+                        data = f.read()
+                    await _upload_storage_object(data, f"{prefix}/{rel}", delivery_packaging.content_type(rel))
+
+        metrics.incr("packaging.hls_packaged")
+        print(f"[packaging] HLS ready: {SUPABASE_URL}/storage/v1/object/public/videos/{prefix}/master.m3u8")
+
+    except AdmissionRejected as e:
+        metrics.incr("packaging.hls_skipped")
+        print(f"[packaging] HLS skipped for {file_name}: {e}")
+
+    except Exception as e:
+        metrics.incr("packaging.hls_failed")
+        print(f"[packaging] HLS failed for {file_name}: {e}")
+
+def schedule_hls_packaging(video_bytes: bytes, file_name: str):
+    """Package HLS in the background: the MP4 is already delivered, previews follow."""
+    task = asyncio.create_task(_package_hls(video_bytes, file_name))
+    _packaging_tasks.add(task)
+    task.add_done_callback(_packaging_tasks.discard)
+
 # =====================================================
 # UPLOAD VIDEO TO SUPABASE STORAGE
 # =====================================================
 
-async def upload_video_to_supabase(video_bytes: bytes, file_name: str = None) -> str:
+async def upload_video_to_supabase(
+    video_bytes: bytes, file_name: str = None, upsert: bool = False, package: bool = True,
+) -> str:
 
     if not file_name:
         file_name = f"{uuid.uuid4()}.mp4"
 
+    if PACKAGE_FASTSTART:
+        try:
+            video_bytes = await delivery_packaging.faststart_bytes(video_bytes)
+        except delivery_packaging.PackagingError as e:
+            # Deliver the original rather than fail the job over packaging
+            metrics.incr("packaging.faststart_failed")
+            print(f"[packaging] Faststart failed for {file_name}, uploading as-is: {e}")
+
     upload_url = f"{SUPABASE_URL}/storage/v1/object/videos/{file_name}"
 
     headers = {
@@ -285,18 +586,239 @@ async def upload_video_to_supabase(video_bytes: bytes, file_name: str = None) ->
         "Content-Type": "video/mp4",
     }
 
-    async with httpx.AsyncClient(timeout=300) as client:
+    if upsert:
+        headers["x-upsert"] = "true"
 
-        response = await client.post(upload_url, headers=headers, content=video_bytes)
+    client = get_http_client()
 
-        response.raise_for_status()
+    response = await client.post(upload_url, headers=headers, content=video_bytes, timeout=300)
 
-        public_url = f"{SUPABASE_URL}/storage/v1/object/public/videos/{file_name}"
+    response.raise_for_status()
+
+    public_url = f"{SUPABASE_URL}/storage/v1/object/public/videos/{file_name}"
+
+    print("Video uploaded to Supabase Storage:", public_url)
+
+    if PACKAGE_HLS and package:
+        schedule_hls_packaging(video_bytes, file_name)
+
+    return public_url
+
+async def upload_video_file_to_supabase(path: str, file_name: str = None, upsert: bool = False) -> str:
+    """
+    Upload an MP4 from disk without loading it: faststart remux into a
+    sibling file when needed, then a streamed body with Content-Length.
+    """
+
+    if not file_name:
+        file_name = f"{uuid.uuid4()}.mp4"
+
+    if PACKAGE_FASTSTART:
+        try:
+            path = await delivery_packaging.faststart_file(path)
+        except delivery_packaging.PackagingError as e:
+            metrics.incr("packaging.faststart_failed")
+            print(f"[packaging] Faststart failed for {file_name}, uploading as-is: {e}")
+
+    async def file_chunks():
+        with open(path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, 1024 * 1024):
+                yield chunk
+
+    upload_url = f"{SUPABASE_URL}/storage/v1/object/videos/{file_name}"
+
+    headers = {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "video/mp4",
+        "Content-Length": str(os.path.getsize(path)),
+    }
+
+    if upsert:
+        headers["x-upsert"] = "true"
+
+    client = get_http_client()
+
+    response = await client.post(upload_url, headers=headers, content=file_chunks(), timeout=300)
+
+    response.raise_for_status()
+
+    public_url = f"{SUPABASE_URL}/storage/v1/object/public/videos/{file_name}"
+
+    print("Video uploaded to Supabase Storage:", public_url)
+
+    if PACKAGE_HLS:
+        # The ladder is built in the background, after this file's temp dir is gone
+        with open(path, "rb") as f:
+            schedule_hls_packaging(f.read(), file_name)
+
+    return public_url
+
+async def relay_video_to_supabase(source: "httpx.Response", file_name: str = None) -> str:
+    """
+    Pipe a provider download (an open streaming response) into the Storage
+    upload chunk by chunk, so the upload runs while the download does and
+    the video is never held in memory. Every chunk is also spooled to a
+    temp file: if the upload fails, or the stored object's ETag does not
+    match the md5 of what was relayed, the rest of the download is drained
+    to the spool and the upload is retried from the file.
+
+    With PACKAGE_FASTSTART, a download whose mdat comes before its moov is
+    not streamed: it is spooled, remuxed and uploaded once, instead of being
+    uploaded as-is and then overwritten with the faststart copy.
+    """
+
+    if not file_name:
+        file_name = f"{uuid.uuid4()}.mp4"
+
+    expected = source.headers.get("content-length")
+    expected = int(expected) if expected and expected.isdigit() else None
+
+    md5 = hashlib.md5()
+    received = 0
+    abandoned = False
+    queue: asyncio.Queue = asyncio.Queue(maxsize=8)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        spool_path = os.path.join(tmpdir, "relay.mp4")
+
+        body = source.aiter_bytes(1024 * 1024)
+        head_chunks: List[bytes] = []
+        head = b""
+        async for chunk in body:
+            head_chunks.append(chunk)
+            head += chunk
+            if delivery_packaging.moov_before_mdat(head) is not None or len(head) >= RELAY_PEEK_BYTES:
+                break
+        stream = not (PACKAGE_FASTSTART and delivery_packaging.moov_before_mdat(head) is False)
+        del head
+
+        async def pump():
+            nonlocal received
+
+            async def downloaded():
+                for chunk in head_chunks:
+                    yield chunk
+                head_chunks.clear()
+                async for chunk in body:
+                    yield chunk
+
+            try:
+                with open(spool_path, "wb") as spool:
+                    async for chunk in downloaded():
+                        md5.update(chunk)
+                        received += len(chunk)
+                        await asyncio.to_thread(spool.write, chunk)
+                        if not abandoned:
+                            await queue.put(chunk)
+            finally:
+                if not abandoned:
+                    await queue.put(None)
+
+        if not stream:
+            # Nothing is streamed: the spooled file is remuxed and uploaded once below
+            abandoned = True
+
+        async def chunks():
+            while (chunk := await queue.get()) is not None:
+                yield chunk
+
+        pump_task = asyncio.create_task(pump())
+
+        headers = {
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
+            "Content-Type": "video/mp4",
+            "x-upsert": "true",
+        }
+        if expected is not None:
+            headers["Content-Length"] = str(expected)
 
-        print("Video uploaded to Supabase Storage:", public_url)
+        public_url = f"{SUPABASE_URL}/storage/v1/object/public/videos/{file_name}"
+        client = get_http_client()
+        relay_error = None
+
+        if stream:
+            try:
+                response = await client.post(
+                    f"{SUPABASE_URL}/storage/v1/object/videos/{file_name}",
+                    headers=headers, content=chunks(), timeout=300,
+                )
+                response.raise_for_status()
+            except Exception as e:
+                relay_error = e
+                # Stop feeding the upload; unblock a pending put and let the pump finish the spool
+                abandoned = True
+                while not queue.empty():
+                    queue.get_nowait()
+
+        # A failed download is a failed job: nothing complete to retry with
+        await pump_task
+
+        if expected is not None and received != expected:
+            raise Exception(f"Sora download truncated: {received} of {expected} bytes")
+
+        if stream and relay_error is None:
+            check = await client.head(public_url, timeout=30)
+            etag = check.headers.get("etag", "").strip('"')
+            # Single-part S3 ETags are the md5; multipart ones ("...-N") cannot be checked
+            if check.status_code != 200:
+                relay_error = Exception(f"could not verify the upload (HEAD {check.status_code})")
+            elif len(etag) == 32 and etag != md5.hexdigest():
+                relay_error = Exception(f"checksum mismatch (etag={etag}, md5={md5.hexdigest()})")
+
+        if not stream:
+            metrics.incr("relay.spooled_for_faststart")
+            print(f"Relay of {file_name}: moov after mdat, uploading the faststart copy of the spooled file")
+        elif relay_error is not None:
+            metrics.incr("relay.fallbacks")
+            print(f"Relay upload of {file_name} failed ({relay_error}), retrying from the spooled file")
+
+        if not stream or relay_error is not None:
+            # upload_video_file_to_supabase remuxes (faststart) and schedules HLS itself
+            for attempt in range(RELAY_UPLOAD_RETRIES):
+                try:
+                    return await upload_video_file_to_supabase(spool_path, file_name, upsert=True)
+                except Exception as e:
+                    if attempt == RELAY_UPLOAD_RETRIES - 1:
+                        raise
+                    print(f"Retry {attempt + 1} of {file_name} failed: {e}")
+                    await asyncio.sleep(2 ** attempt)
+
+        metrics.incr("relay.streamed")
+        print(f"Video relayed to Supabase Storage ({received} bytes, md5 ok): {public_url}")
+
+        if PACKAGE_HLS:
+            with open(spool_path, "rb") as f:
+                schedule_hls_packaging(f.read(), file_name)
 
         return public_url
 
+async def upload_stream_to_supabase(chunks, file_name: str) -> str:
+    """Upload an async iterator of bytes (chunked transfer) to the videos bucket."""
+
+    upload_url = f"{SUPABASE_URL}/storage/v1/object/videos/{file_name}"
+
+    headers = {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "video/mp4",
+        "x-upsert": "true",
+    }
+
+    client = get_http_client()
+
+    response = await client.post(upload_url, headers=headers, content=chunks, timeout=300)
+
+    response.raise_for_status()
+
+    public_url = f"{SUPABASE_URL}/storage/v1/object/public/videos/{file_name}"
+
+    print("Video streamed to Supabase Storage:", public_url)
+
+    return public_url
+
 # =====================================================
 # PARSE VEO ERROR (transforma erros tecnicos em mensagens amigaveis)
 # =====================================================
@@ -348,6 +870,63 @@ def parse_veo_error(raw_error: str) -> str:
 
     return f"Erro na geracao: {str(raw_error)[:300]}"
 
+# =====================================================
+# GCS STAGING - imagem de referencia do Veo
+# =====================================================
+
+# sha256 of images known to be in VEO_IMAGE_BUCKET -> when that was last
+# confirmed; skips the existence check for VEO_IMAGE_MEMO_SECONDS
+_staged_images: "OrderedDict[str, float]" = OrderedDict()
+
+async def stage_veo_image(image_bytes: bytes, token: str) -> str:
+    """
+    Upload the preprocessed reference image to VEO_IMAGE_BUCKET once, named
+    by its sha256, and return its gs:// URI. Variants and retries of the same
+    image reuse the object.
+    """
+    from urllib.parse import quote
+
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    name = f"veo-inputs/{digest}.jpg"
+    uri = f"gs://{VEO_IMAGE_BUCKET}/{name}"
+
+    confirmed_at = _staged_images.get(digest)
+    if confirmed_at is not None and time.monotonic() - confirmed_at < VEO_IMAGE_MEMO_SECONDS:
+        _staged_images.move_to_end(digest)
+        metrics.incr("veo_image_staging.reused")
+        return uri
+
+    client = get_http_client()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    existing = await client.get(
+        f"{GCS_API_BASE}/storage/v1/b/{VEO_IMAGE_BUCKET}/o/{quote(name, safe='')}",
+        headers=headers, timeout=30,
+    )
+    if existing.status_code == 200:
+        metrics.incr("veo_image_staging.reused")
+    else:
+        if existing.status_code != 404:
+            existing.raise_for_status()
+        # ifGenerationMatch=0: create only; a concurrent upload of the same image answers 412
+        response = await client.post(
+            f"{GCS_API_BASE}/upload/storage/v1/b/{VEO_IMAGE_BUCKET}/o",
+            params={"uploadType": "media", "name": name, "ifGenerationMatch": "0"},
+            headers={**headers, "Content-Type": "image/jpeg"},
+            content=image_bytes,
+            timeout=120,
+        )
+        if response.status_code != 412:
+            response.raise_for_status()
+        metrics.incr("veo_image_staging.uploaded")
+        print(f"Reference image staged: {uri} ({len(image_bytes)} bytes)")
+
+    _staged_images[digest] = time.monotonic()
+    _staged_images.move_to_end(digest)
+    while len(_staged_images) > 4096:
+        _staged_images.popitem(last=False)
+    return uri
+
 # =====================================================
 # CALL VEO USING PREDICT LONG RUNNING
 # =====================================================
@@ -358,7 +937,17 @@ async def call_veo(
     aspect_ratio: str = "9:16",
     duration_seconds: int = 8,
     model: str = "veo-3.1-fast-generate-001",
-):
+    on_submitted: Optional[Callable[[str], None]] = None,
+    on_stage: Optional[Callable[..., None]] = None,
+    sample_count: int = 1,
+) -> List[str]:
+    """
+    Submit an image-to-video job to Veo and wait for it; returns one URL per
+    sample (sample_count, 1-4). on_submitted(operation_name) is called as soon
+    as Veo accepts the job, so the caller can persist it and resume with
+    poll_veo_operation() after a restart. on_stage(stage) reports
+    rendering/uploading progress.
+    """
 
     token = get_access_token()
 
@@ -368,12 +957,20 @@ async def call_veo(
     }
 
     submit_url = (
-        f"https://{LOCATION}-aiplatform.googleapis.com/v1/"
+        f"{VERTEX_API_BASE}/v1/"
         f"projects/{PROJECT_ID}/locations/{LOCATION}/"
         f"publishers/google/models/{model}:predictLongRunning"
     )
 
-    image_base64 = base64.b64encode(image_bytes).decode()
+    image = None
+    if VEO_IMAGE_BUCKET:
+        try:
+            image = {"gcsUri": await stage_veo_image(image_bytes, token), "mimeType": "image/jpeg"}
+        except Exception as e:
+            metrics.incr("veo_image_staging.failed")
+            print(f"Warning: staging reference image failed, sending it inline: {e}")
+    if image is None:
+        image = {"bytesBase64Encoded": base64.b64encode(image_bytes).decode(), "mimeType": "image/jpeg"}
 
     # Clamp duration to Veo3 valid values (4, 6, 8)
     valid_durations = [4, 6, 8]
@@ -383,11 +980,11 @@ async def call_veo(
         "instances": [
             {
                 "prompt": prompt,
-                "image": {"bytesBase64Encoded": image_base64, "mimeType": "image/jpeg"}
+                "image": image
             }
         ],
         "parameters": {
-            "sampleCount": 1,
+            "sampleCount": sample_count,
             "aspectRatio": aspect_ratio,
             "durationSeconds": clamped_duration,
             "negativePrompt": (
@@ -409,43 +1006,81 @@ async def call_veo(
         }
     }
 
-    print(f"Veo params: model={model}, duration={clamped_duration}s, aspect={aspect_ratio}")
+    print(f"Veo params: model={model}, duration={clamped_duration}s, aspect={aspect_ratio}, samples={sample_count}")
 
-    async with httpx.AsyncClient(timeout=600) as client:
+    client = get_http_client()
 
-        print(f"Calling Veo 3.1 | aspect_ratio={aspect_ratio}")
+    print(f"Calling Veo 3.1 | aspect_ratio={aspect_ratio}")
 
-        response = await client.post(submit_url, headers=headers, json=payload)
+    response = await client.post(submit_url, headers=headers, json=payload, timeout=600)
 
-        response.raise_for_status()
+    staged_uri = image.get("gcsUri")
+    if staged_uri and response.status_code in (400, 404) and staged_uri in response.text:
+        # The staged object is gone (bucket lifecycle) although it was memoized: stage it again
+        metrics.incr("veo_image_staging.restaged")
+        print(f"Veo could not read {staged_uri}, staging it again")
+        _staged_images.pop(hashlib.sha256(image_bytes).hexdigest(), None)
+        payload["instances"][0]["image"]["gcsUri"] = await stage_veo_image(image_bytes, token)
+        response = await client.post(submit_url, headers=headers, json=payload, timeout=600)
 
-        operation = response.json()
+    response.raise_for_status()
 
-        operation_name = operation["name"]
+    operation = response.json()
 
-        print("Operation started:", operation_name)
+    operation_name = operation["name"]
 
-        fetch_url = (
-            f"https://{LOCATION}-aiplatform.googleapis.com/v1/"
-            f"projects/{PROJECT_ID}/locations/{LOCATION}/"
-            f"publishers/google/models/{model}:fetchPredictOperation"
-        )
+    print("Operation started:", operation_name)
 
-        print("Polling via fetchPredictOperation...")
+    if on_submitted:
+        on_submitted(operation_name)
 
-        while True:
+    return await poll_veo_operation(operation_name, model, on_stage=on_stage)
 
-            token = get_access_token()
-            headers["Authorization"] = f"Bearer {token}"
 
-            poll_response = await client.post(
-                fetch_url, headers=headers,
-                json={"operationName": operation_name}
-            )
+async def poll_veo_operation(
+    operation_name: str,
+    model: str,
+    on_stage: Optional[Callable[..., None]] = None,
+) -> List[str]:
+    """
+    Poll a Veo operation until done and return one video URL per sample
+    (inline samples are uploaded concurrently).
+    """
+
+    client = get_http_client()
+
+    headers = {"Content-Type": "application/json"}
+
+    fetch_url = (
+        f"{VERTEX_API_BASE}/v1/"
+        f"projects/{PROJECT_ID}/locations/{LOCATION}/"
+        f"publishers/google/models/{model}:fetchPredictOperation"
+    )
 
-            poll_response.raise_for_status()
+    print("Polling via fetchPredictOperation...")
 
-            result = poll_response.json()
+    while True:
+
+        token = get_access_token()
+        headers["Authorization"] = f"Bearer {token}"
+
+        with tempfile.TemporaryDirectory() as workdir:
+
+            # Inline videos are decoded to files while the body streams in (off the loop)
+            extractor = InlineVideoExtractor(workdir)
+
+            async with client.stream(
+                "POST", fetch_url, headers=headers,
+                json={"operationName": operation_name},
+                timeout=600,
+            ) as poll_response:
+
+                poll_response.raise_for_status()
+
+                async for chunk in poll_response.aiter_bytes(1024 * 1024):
+                    await asyncio.to_thread(extractor.feed, chunk)
+
+            result = extractor.finish()
 
             if result.get("done"):
 
@@ -458,32 +1093,46 @@ async def call_veo(
                 if not videos:
                     raise Exception("Nenhum video retornado: " + str(result))
 
-                video = videos[0]
+                uploads = []
+                for video in videos:
+                    video_uri = video.get("gcsUri") or video.get("uri")
+                    video_path = extractor.resolve(video.get("bytesBase64Encoded"))
+                    if video_uri:
+                        print("Video URI recebido:", video_uri)
+                    elif video_path:
+                        print(f"Video retornado como bytes ({os.path.getsize(video_path)} bytes)")
+                    else:
+                        raise Exception("Formato de video desconhecido: " + str(video))
+                    uploads.append(video_uri or video_path)
+
+                if any(not u.startswith("gs://") and not u.startswith("http") for u in uploads):
+                    print(f"Fazendo upload de {len(uploads)} video(s) para Supabase...")
+                    if on_stage:
+                        on_stage(stages.UPLOADING)
 
-                video_uri = video.get("gcsUri") or video.get("uri")
-                if video_uri:
-                    print("Video URI recebido:", video_uri)
-                    return video_uri
+                async def deliver(source: str) -> str:
+                    if source.startswith("gs://") or source.startswith("http"):
+                        return source
+                    return await upload_video_file_to_supabase(source)
 
-                video_b64 = video.get("bytesBase64Encoded")
-                if video_b64:
-                    print("Video retornado como bytes, fazendo upload para Supabase...")
-                    video_bytes_decoded = base64.b64decode(video_b64)
-                    return await upload_video_to_supabase(video_bytes_decoded)
+                # Inside the temp dir: the decoded files go away with it
+                return list(await asyncio.gather(*(deliver(u) for u in uploads)))
 
-                raise Exception("Formato de video desconhecido: " + str(video))
+        print(f"Still processing... waiting {VEO_POLL_INTERVAL:g}s")
 
-            print("Still processing... waiting 10s")
+        if on_stage:
+            on_stage(stages.RENDERING)
 
-            await asyncio.sleep(10)
+        await asyncio.sleep(VEO_POLL_INTERVAL)
 
 # =====================================================
-# UPDATE SUPABASE - sucesso
+# STATUS WRITER - video_generations
 # =====================================================
 
-async def update_supabase(generation_id: str, video_url: str):
+async def _patch_generations(generation_ids: List[str], payload: dict):
+    """One PATCH for every row that gets the same payload (status_writer batches)."""
 
-    url = f"{SUPABASE_URL}/rest/v1/video_generations?id=eq.{generation_id}"
+    url = f"{SUPABASE_URL}/rest/v1/video_generations?id=in.({','.join(generation_ids)})"
 
     headers = {
         "apikey": SUPABASE_KEY,
@@ -492,59 +1141,195 @@ async def update_supabase(generation_id: str, video_url: str):
         "Prefer": "return=minimal"
     }
 
+    client = get_http_client()
+
+    response = await client.patch(url, headers=headers, json=payload, timeout=30)
+
+    response.raise_for_status()
+
+# Stage transitions are coalesced per row and flushed in batches; the final
+# completed/failed write is retried until it lands.
+status_writer = StatusWriter(
+    "status_writer",
+    _patch_generations,
+    flush_interval=float(os.environ.get("STATUS_FLUSH_INTERVAL_SECONDS", "1.0")),
+)
+metrics.register_gauge("status_writer", status_writer.stats)
+
+# How long /generate-video waits for its completed/failed row write before
+# answering; past that the write keeps retrying in the background
+FINAL_WRITE_WAIT_SECONDS = float(os.environ.get("FINAL_WRITE_WAIT_SECONDS", "10"))
+
+async def wait_final_write(persisted: "asyncio.Future[None]", generation_id: str):
+    """Wait (bounded) for a status_writer.final() write, so the response follows the row."""
+    try:
+        await asyncio.wait_for(asyncio.shield(persisted), timeout=FINAL_WRITE_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        metrics.incr("status_writer.final_wait_timeouts")
+        print(f"Final status write for {generation_id} not persisted after "
+              f"{FINAL_WRITE_WAIT_SECONDS:g}s, still retrying in the background")
+
+# =====================================================
+# JOB EVENTS (SSE) - GET /jobs/{id}/events
+# =====================================================
+
+# Job ids are the caller's ids: generation_id for /generate-video and the
+# watermark endpoints, sequence_id for /merge-videos
+event_hub = EventHub()
+metrics.register_gauge("events", event_hub.stats)
+
+def report_stage(job_id: str, stage: str, persist: bool = True, **fields):
+    """Stage transition: coalesced write to video_generations + SSE event."""
+    if persist:
+        status_writer.stage(job_id, stage, **fields)
+    event_hub.publish(job_id, "stage", {"stage": stage, **fields}, skip_repeat=True)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events for one job: stage changes, ffmpeg progress and a
+    final "done" (with the URL) or "error" event, after which the stream ends.
+    Reconnects resume from the Last-Event-ID header.
+    """
+    if not verify_worker_auth(request):
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+
+    if not event_hub.accepts(job_id):
+        return JSONResponse(status_code=429, content={"status": "error", "message": "Too many subscriptions to unknown jobs"})
+
+    try:
+        last_event_id = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        last_event_id = 0
+
+    async def stream():
+        async for item in event_hub.subscribe(job_id, last_event_id):
+            if item is None:
+                # Heartbeat comment keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            seq, event, data = item
+            yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# =====================================================
+# UPDATE SUPABASE - sucesso
+# =====================================================
+
+def update_supabase(
+    generation_id: str,
+    video_url: str,
+    on_persisted: Optional[Callable[[], None]] = None,
+    video_urls: Optional[List[str]] = None,
+) -> "asyncio.Future[None]":
+    """Queue the completed write; the returned future resolves once it is persisted."""
+
     payload = {
         "status": "completed",
         "video_url": video_url,
-        "final_video_url": video_url
+        "final_video_url": video_url,
+        "worker_stage": "completed",
+        "worker_stage_at": "now()",
     }
 
-    async with httpx.AsyncClient(timeout=60) as client:
-
-        response = await client.patch(url, headers=headers, json=payload)
+    # Only multi-sample generations write the column (migration 008)
+    if video_urls and len(video_urls) > 1:
+        payload["sample_video_urls"] = video_urls
 
-        response.raise_for_status()
+    return status_writer.final(generation_id, payload, on_persisted)
 
 # =====================================================
 # UPDATE SUPABASE - falha
 # =====================================================
 
-async def update_supabase_failed(generation_id: str, error_message: str):
+def update_supabase_failed(
+    generation_id: str,
+    error_message: str,
+    on_persisted: Optional[Callable[[], None]] = None,
+) -> "asyncio.Future[None]":
     """
     Atualiza a cena como 'failed' com mensagem de erro amigavel.
     Sem isso, cenas com erro ficam presas em 'processing_worker' para sempre.
+    O future retornado resolve quando a escrita foi persistida.
     """
-    url = f"{SUPABASE_URL}/rest/v1/video_generations?id=eq.{generation_id}"
-
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal"
-    }
 
     payload = {
         "status": "failed",
-        "error_message": error_message[:1000]
+        "error_message": error_message[:1000],
+        "worker_stage": "failed",
+        "worker_stage_at": "now()",
     }
 
-    try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.patch(url, headers=headers, json=payload)
-            response.raise_for_status()
-            print(f"Supabase updated: generation {generation_id} -> failed")
-    except Exception as e:
-        print(f"Warning: could not update failed status in Supabase: {e}")
+    return status_writer.final(generation_id, payload, on_persisted)
 
 # =====================================================
 # ENDPOINT: GENERATE SINGLE VIDEO
 # =====================================================
 
+# Retries from the edge function (after a gateway timeout) reuse the same
+# generation_id: attach them to the running generation instead of paying for
+# a second one, and answer finished ones from memory for a while.
+generation_registry = IdempotencyRegistry(
+    "generate_video",
+    ttl_seconds=float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600")),
+)
+metrics.register_gauge("generate_video", generation_registry.stats)
+
+# Opened on first use (startup resume at the latest): importing main must not
+# create the SQLite file
+_operation_journal: Optional[journal.OperationJournal] = None
+
+def get_operation_journal() -> journal.OperationJournal:
+    global _operation_journal
+    if _operation_journal is None:
+        _operation_journal = journal.OperationJournal(journal.default_journal_path())
+    return _operation_journal
+
+metrics.register_gauge(
+    "operation_journal", lambda: _operation_journal.stats() if _operation_journal is not None else {},
+)
+
 @app.post("/generate-video")
 async def generate_video(req: GenerateVideoRequest, request: Request):
 
     if not verify_worker_auth(request):
         return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
 
+    result, outcome = await generation_registry.run(req.generation_id, lambda: _run_generation(req))
+
+    if outcome != "started":
+        print(f"Duplicate submit for generation {req.generation_id}: {outcome}")
+
+    return result
+
+def relay_sora_result(on_stage: Callable[..., None]):
+    """relay= for the Sora engine: stream the finished video straight into Storage."""
+    async def relay(response: "httpx.Response") -> str:
+        on_stage(stages.UPLOADING)
+        return await relay_video_to_supabase(response)
+    return relay
+
+async def _run_generation(req: GenerateVideoRequest) -> dict:
+
+    # Set once the provider has accepted (and billed) the job
+    operation_id = None
+
+    def journal_submitted(provider: str, context: dict):
+        def record(op_id: str):
+            nonlocal operation_id
+            operation_id = op_id
+            get_operation_journal().record(op_id, provider, req.generation_id, context)
+            report_stage(req.generation_id, stages.SUBMITTED)
+        return record
+
+    def on_stage(stage: str, **fields):
+        report_stage(req.generation_id, stage, **fields)
+
     try:
 
         veo_model = req.model or "veo-3.1-fast-generate-001"
@@ -552,12 +1337,18 @@ async def generate_video(req: GenerateVideoRequest, request: Request):
         selected_engine = req.engine or "veo3"
 
         is_pet = req.is_pet or False
-        print(f"Starting generation: {req.generation_id} | engine={selected_engine} | model={veo_model} | duration={duration}s | pet={is_pet}")
+        # Veo accepts 1-4 samples per operation; Sora renders one
+        samples = max(1, min(4, req.samples or 1))
+        print(f"Starting generation: {req.generation_id} | engine={selected_engine} | model={veo_model} | duration={duration}s | pet={is_pet} | samples={samples}")
 
         aspect = req.aspect_ratio or "9:16"
 
+        on_stage(stages.DOWNLOADING)
+
         image_bytes = await download_image_bytes(req.image_url)
 
+        on_stage(stages.PREPROCESSING)
+
         # For pet videos with background/product, compose a single reference image
         if is_pet and (req.background_reference_url or req.product_image_url):
             print(f"Pet mode: composing image with bg={bool(req.background_reference_url)}, product={bool(req.product_image_url)}")
@@ -571,32 +1362,52 @@ async def generate_video(req: GenerateVideoRequest, request: Request):
             image_bytes = crop_image_to_ratio(image_bytes, aspect)
 
         if selected_engine == "sora2":
+            from sora2_engine import call_sora, map_aspect_to_sora_size, resize_image_for_sora
+
             # Sora 2 path: use raw prompt (build_sora_prompt handles cleanup internally)
             # Pass custom_instructions as structured data for priority placement
             sora_model_name = req.sora_model if req.sora_model in ("sora-2", "sora-2-pro") else "sora-2"
             sora_size = map_aspect_to_sora_size(aspect, sora_model_name)
             sora_image = resize_image_for_sora(image_bytes, sora_size)
-            video_bytes = await call_sora(
+            if samples > 1:
+                print(f"Sora renders one sample per job, ignoring samples={samples}")
+            video_url = await call_sora(
                 sora_image, req.prompt, aspect, duration,
                 custom_instructions=req.custom_instructions,
                 model_override=req.sora_model,
                 prompt_language=req.prompt_language,
+                on_submitted=journal_submitted("sora", {"model": sora_model_name}),
+                on_stage=on_stage,
+                relay=relay_sora_result(on_stage),
             )
-            video_url = await upload_video_to_supabase(video_bytes)
+            video_urls = [video_url]
         else:
             # Veo3 path (default — no changes)
             enhanced_prompt = build_veo_prompt(req)
-            video_url = await call_veo(
+            video_urls = await call_veo(
                 image_bytes,
                 enhanced_prompt,
                 aspect_ratio=aspect,
                 duration_seconds=duration,
                 model=veo_model,
+                on_submitted=journal_submitted("veo", {"model": veo_model, "samples": samples}),
+                on_stage=on_stage,
+                sample_count=samples,
             )
+            video_url = video_urls[0]
 
-        await update_supabase(req.generation_id, video_url)
+        event_hub.publish(req.generation_id, "done",
+                          {"kind": "generation", "video_url": video_url, "video_urls": video_urls})
 
-        return {"status": "success", "video_url": video_url}
+        # The journal entry is closed only once the row really says completed
+        op_id = operation_id
+        await wait_final_write(update_supabase(
+            req.generation_id, video_url,
+            on_persisted=lambda: get_operation_journal().complete(op_id, journal.DONE),
+            video_urls=video_urls,
+        ), req.generation_id)
+
+        return {"status": "success", "video_url": video_url, "video_urls": video_urls}
 
     except Exception as e:
 
@@ -605,10 +1416,289 @@ async def generate_video(req: GenerateVideoRequest, request: Request):
 
         friendly_error = parse_veo_error(raw_error)
 
-        await update_supabase_failed(req.generation_id, friendly_error)
+        event_hub.publish(req.generation_id, "error", {"kind": "generation", "message": friendly_error})
+
+        op_id = operation_id
+        await wait_final_write(update_supabase_failed(
+            req.generation_id, friendly_error,
+            on_persisted=lambda: get_operation_journal().complete(op_id, journal.FAILED),
+        ), req.generation_id)
+
+        return {"status": "error", "message": friendly_error}
+
+# =====================================================
+# RESUME - operacoes pendentes de antes do restart
+# =====================================================
+
+async def _resume_operation(entry: "journal.JournalEntry") -> dict:
+    """Finish a generation whose provider job was submitted before a restart."""
+
+    print(f"Resuming {entry.provider} operation {entry.operation_id} for generation {entry.generation_id} "
+          f"(attempt {entry.attempts + 1})")
+
+    def on_stage(stage: str, **fields):
+        report_stage(entry.generation_id, stage, **fields)
+
+    try:
+
+        if entry.provider == "sora":
+            from sora2_engine import wait_for_sora_video
+
+            video_url = await wait_for_sora_video(
+                entry.operation_id, on_stage=on_stage, relay=relay_sora_result(on_stage),
+            )
+        else:
+            video_urls = await poll_veo_operation(entry.operation_id, entry.context["model"], on_stage=on_stage)
+            video_url = video_urls[0]
+
+        if entry.provider == "sora":
+            video_urls = [video_url]
+
+        event_hub.publish(entry.generation_id, "done",
+                          {"kind": "generation", "video_url": video_url, "video_urls": video_urls})
+        await wait_final_write(update_supabase(
+            entry.generation_id, video_url,
+            on_persisted=lambda: get_operation_journal().complete(entry.operation_id, journal.DONE),
+            video_urls=video_urls,
+        ), entry.generation_id)
+        metrics.incr("journal.resumed_completed")
+
+        return {"status": "success", "video_url": video_url, "video_urls": video_urls}
+
+    except Exception as e:
+
+        raw_error = str(e)
+        print(f"ERROR resuming {entry.operation_id}:", raw_error)
+
+        friendly_error = parse_veo_error(raw_error)
+
+        event_hub.publish(entry.generation_id, "error", {"kind": "generation", "message": friendly_error})
+        await wait_final_write(update_supabase_failed(
+            entry.generation_id, friendly_error,
+            on_persisted=lambda: get_operation_journal().complete(entry.operation_id, journal.FAILED),
+        ), entry.generation_id)
+        metrics.incr("journal.resumed_failed")
 
         return {"status": "error", "message": friendly_error}
 
+def resume_pending_operations():
+    operation_journal = get_operation_journal()
+    reason = journal.ephemeral_reason(operation_journal.path)
+    if reason:
+        # Resume still covers process restarts, but a redeploy loses every pending operation
+        print("=" * 60)
+        print(f"WARNING: operation journal is not persistent ({reason}).")
+        print("Veo/Sora operations in flight during a redeploy will be lost. Mount a volume")
+        print("and point OPERATION_JOURNAL_PATH at it (see Dockerfile).")
+        print("=" * 60)
+        metrics.incr("journal.ephemeral_path")
+    operation_journal.prune()
+    entries = operation_journal.pending()
+    if entries:
+        print(f"Operation journal: resuming {len(entries)} pending operation(s)")
+    for entry in entries:
+        # Registered with the idempotency layer so a retry of the same
+        # generation_id attaches to the resumed task
+        generation_registry.adopt(entry.generation_id, asyncio.create_task(_resume_operation(entry)))
+
+# =====================================================
+# MERGE OUTPUT MODE / CLIP CACHE
+# =====================================================
+MERGE_STREAM_OUTPUT = os.environ.get("MERGE_STREAM_OUTPUT", "0") == "1"
+
+# Downloaded clips, revalidated by ETag on every merge (CLIP_CACHE_MAX_MB=0 disables)
+CLIP_CACHE_DIR = os.environ.get("CLIP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "clip-cache"))
+CLIP_CACHE_MAX_BYTES = int(os.environ.get("CLIP_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# Trimmed segments by (clip sha256, trim_start, trim_end, output format): a
+# re-merge only re-cuts the clips whose trim changed
+SEGMENT_CACHE_DIR = os.environ.get("SEGMENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "segment-cache"))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# Both are built on the first merge: their constructors create and scan the
+# cache directories, which importing main must not do
+_clip_cache: Optional[ClipCache] = None
+_segment_cache: Optional[SegmentCache] = None
+
+def get_clip_cache() -> ClipCache:
+    global _clip_cache
+    if _clip_cache is None:
+        _clip_cache = ClipCache(CLIP_CACHE_DIR, CLIP_CACHE_MAX_BYTES)
+    return _clip_cache
+
+def get_segment_cache() -> SegmentCache:
+    global _segment_cache
+    if _segment_cache is None:
+        _segment_cache = SegmentCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
+    return _segment_cache
+
+metrics.register_gauge("clip_cache", lambda: _clip_cache.stats() if _clip_cache is not None else {})
+metrics.register_gauge("segment_cache", lambda: _segment_cache.stats() if _segment_cache is not None else {})
+
+# Part of the segment key: changing how segments are cut must not reuse old ones
+SEGMENT_FORMAT = "mp4-copy-v1"
+
+# ffprobe results by content sha256, shared by merge, trim and watermark
+media_probe = MediaProbe()
+metrics.register_gauge("media_probe", media_probe.stats)
+
+# Preview proxies (preview=true): stored by fingerprint of clips + trims + these settings
+PREVIEW_SHORT_SIDE = 360
+PREVIEW_FORMAT = f"h264-ultrafast-crf32-{PREVIEW_SHORT_SIDE}p-wm-v1"
+
+# =====================================================
+# ADMISSION CONTROL - merge / watermark
+# =====================================================
+
+# Global budgets (ADMISSION_RAM_MB / _DISK_MB / _ENCODE_SLOTS, else derived
+# from the container) shared by every heavy media request on this replica.
+# The caches live under the same temp dir and can grow to their max_bytes
+admission = AdmissionController(
+    **default_budgets(reserved_disk_mb=(CLIP_CACHE_MAX_BYTES + SEGMENT_CACHE_MAX_BYTES) / 1024 / 1024),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "32")),
+    max_wait_seconds=float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "60")),
+)
+metrics.register_gauge("admission", admission.utilization)
+
+# Rough per-request footprint: downloads are held in memory and on disk,
+# plus the ffmpeg process itself
+MERGE_RAM_MB_PER_CLIP = 40
+MERGE_DISK_MB_PER_CLIP = 60
+WATERMARK_VIDEO_COST = Cost(ram_mb=400, disk_mb=150, encode_slots=1)
+WATERMARK_IMAGE_COST = Cost(ram_mb=250)
+HLS_PACKAGE_COST = Cost(ram_mb=500, disk_mb=200, encode_slots=1)
+
+def merge_cost(clip_count: int) -> Cost:
+    return Cost(
+        ram_mb=64 + MERGE_RAM_MB_PER_CLIP * clip_count,
+        disk_mb=MERGE_DISK_MB_PER_CLIP * clip_count,
+        encode_slots=1,
+    )
+
+def busy_response(rejected: AdmissionRejected) -> JSONResponse:
+    print(f"Admission rejected {rejected}")
+    return JSONResponse(
+        status_code=429,
+        content={"status": "error", "message": f"Worker busy ({rejected.reason}), retry later"},
+        headers={"Retry-After": str(rejected.retry_after)},
+    )
+
+# =====================================================
+# FFMPEG - async runner com progresso
+# =====================================================
+
+def _parse_ffmpeg_duration(line: str) -> Optional[float]:
+    """'  Duration: 00:00:08.02, start: ...' -> 8.02 (None for N/A)."""
+    try:
+        value = line.split("Duration:", 1)[1].split(",", 1)[0].strip()
+        h, m, sec = value.split(":")
+        return int(h) * 3600 + int(m) * 60 + float(sec)
+    except (IndexError, ValueError):
+        return None
+
+async def _drain_ffmpeg_stderr(
+    process: asyncio.subprocess.Process,
+    job_id: Optional[str],
+    total_seconds: Optional[float],
+    label: str,
+) -> str:
+    """Read ffmpeg's stderr to the end, publishing -progress lines as events."""
+    from collections import deque
+
+    stderr_tail = deque(maxlen=50)
+    last_percent = -1
+
+    async for raw in process.stderr:
+        line = raw.decode(errors="replace").rstrip()
+        key, sep, value = line.partition("=")
+        if job_id and sep and key in ("out_time_us", "out_time_ms", "progress"):
+            # out_time_ms is also microseconds (historical ffmpeg naming)
+            if key == "progress":
+                percent = 100 if value == "end" else None
+            elif total_seconds and value.isdigit():
+                percent = min(99, int(int(value) / 1_000_000 / total_seconds * 100))
+            else:
+                percent = None
+            if percent is not None and percent > last_percent:
+                last_percent = percent
+                event_hub.publish(job_id, "progress", {"step": label, "percent": percent})
+            continue
+        if total_seconds is None and "Duration:" in line:
+            total_seconds = _parse_ffmpeg_duration(line)
+        stderr_tail.append(line)
+
+    return "\n".join(stderr_tail)
+
+def _with_progress(cmd: List[str], job_id: Optional[str]) -> List[str]:
+    return [cmd[0], "-progress", "pipe:2", "-nostats", *cmd[1:]] if job_id else cmd
+
+async def run_ffmpeg(
+    cmd: List[str],
+    job_id: Optional[str] = None,
+    total_seconds: Optional[float] = None,
+    label: str = "encode",
+) -> "tuple[int, str]":
+    """
+    Run ffmpeg without blocking the event loop. With job_id, `-progress pipe:2`
+    is added and percentages are published as "progress" events; the total
+    comes from total_seconds or the first input's Duration line.
+    Returns (returncode, tail of stderr).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *_with_progress(cmd, job_id), stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    stderr = await _drain_ffmpeg_stderr(process, job_id, total_seconds, label)
+    await process.wait()
+    return process.returncode, stderr
+
+async def run_ffmpeg_to_upload(
+    cmd: List[str],
+    file_name: str,
+    job_id: Optional[str] = None,
+    total_seconds: Optional[float] = None,
+    label: str = "encode",
+) -> str:
+    """
+    Run an ffmpeg command that writes to pipe:1 and stream its stdout straight
+    into a Supabase upload while it encodes, so neither a temp file nor the
+    whole output in memory is needed. Returns the public URL.
+    Raises if either side fails; the object may then be partial, so callers
+    retry with upsert.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *_with_progress(cmd, job_id), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    sent = 0
+
+    async def chunks():
+        nonlocal sent
+        while chunk := await process.stdout.read(256 * 1024):
+            sent += len(chunk)
+            yield chunk
+
+    upload = asyncio.create_task(upload_stream_to_supabase(chunks(), file_name))
+    drain = asyncio.create_task(_drain_ffmpeg_stderr(process, job_id, total_seconds, label))
+
+    try:
+        await asyncio.wait({upload, drain}, return_when=asyncio.FIRST_EXCEPTION)
+        if upload.done() and upload.exception() is not None:
+            # Nobody reads stdout any more: stop ffmpeg before it blocks on the pipe
+            process.kill()
+        public_url = await upload
+        stderr = await drain
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        if not drain.done():
+            drain.cancel()
+
+    if process.returncode != 0:
+        raise Exception(f"FFmpeg error: {stderr[-500:]}")
+
+    print(f"Streamed {sent} bytes from ffmpeg to {file_name}")
+    return public_url
+
 # =====================================================
 # ENDPOINT: MERGE VIDEOS (com suporte a trim por cena)
 # =====================================================
@@ -619,6 +1709,16 @@ async def merge_videos(req: MergeVideosRequest, request: Request):
     if not verify_worker_auth(request):
         return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
 
+    clip_count = len(req.clips or req.video_urls or [])
+
+    try:
+        async with admission.admit("merge-videos", merge_cost(clip_count)):
+            return await _merge_videos(req)
+    except AdmissionRejected as e:
+        return busy_response(e)
+
+async def _merge_videos(req: MergeVideosRequest) -> dict:
+
     try:
 
         if req.clips:
@@ -630,60 +1730,102 @@ async def merge_videos(req: MergeVideosRequest, request: Request):
 
         print(f"Starting merge for sequence: {req.sequence_id} | {len(clip_list)} clips")
 
+        report_stage(req.sequence_id, stages.DOWNLOADING, persist=False)
+
         with tempfile.TemporaryDirectory() as tmpdir:
 
             trimmed_paths = []
 
-            async with httpx.AsyncClient(timeout=120) as client:
+            segments = {"reused": 0, "trimmed": 0, "untrimmed": 0}
+
+            # Output length for the concat progress events (None unless every clip was probed)
+            expected_seconds: Optional[float] = 0.0
+
+            # Clip contents and trims, in order: names the preview proxy
+            fingerprint = hashlib.sha256(PREVIEW_FORMAT.encode())
+            first_info = None
+
+            client = get_http_client()
+            clip_cache = get_clip_cache()
+            segment_cache = get_segment_cache()
+
+            for i, clip in enumerate(clip_list):
+
+                print(f"Downloading clip {i + 1}/{len(clip_list)}: {clip.url}")
+
+                raw_path = os.path.join(tmpdir, f"raw_{i:03d}.mp4")
+
+                fetched = await clip_cache.fetch(client, clip.url, raw_path)
+
+                if fetched.source == "hit":
+                    print(f"Clip {i + 1} served from cache ({fetched.size} bytes)")
+
+                fingerprint.update(f"{fetched.sha256}|{clip.trim_start or 0.0:.3f}|{clip.trim_end}\n".encode())
+
+                trim_start = clip.trim_start or 0.0
+                needs_trim = trim_start > 0 or clip.trim_end is not None
 
-                for i, clip in enumerate(clip_list):
+                # Probed only when something depends on it: the trim_end cut,
+                # or the preview proxy size (first clip)
+                info = None
+                if clip.trim_end is not None or (i == 0 and req.preview):
+                    try:
+                        info = await media_probe.probe(raw_path, fetched.sha256)
+                    except ProbeError as e:
+                        print(f"Probe warning clip {i}: {e}")
 
-                    print(f"Downloading clip {i + 1}/{len(clip_list)}: {clip.url}")
+                # trim_end is measured from the end: without the duration the cut is impossible
+                if clip.trim_end is not None and (info is None or info.duration is None):
+                    raise Exception(f"Could not read the duration of clip {i + 1} to apply trim_end")
 
-                    response = await client.get(clip.url)
+                if i == 0:
+                    first_info = info
 
-                    response.raise_for_status()
+                if info is not None and info.duration is not None and expected_seconds is not None:
+                    expected_seconds += max(0.0, info.duration - trim_start - (clip.trim_end or 0.0))
+                else:
+                    expected_seconds = None
 
-                    raw_path = os.path.join(tmpdir, f"raw_{i:03d}.mp4")
+                if needs_trim:
+                    trimmed_path = os.path.join(tmpdir, f"clip_{i:03d}.mp4")
+                    segment_key = SegmentCache.key(fetched.sha256, trim_start, clip.trim_end, SEGMENT_FORMAT)
 
-                    with open(raw_path, "wb") as f:
-                        f.write(response.content)
+                    async with segment_cache.lock(segment_key):
 
-                    trim_start = clip.trim_start or 0.0
-                    needs_trim = trim_start > 0 or clip.trim_end is not None
+                        if segment_cache.get(segment_key, trimmed_path):
+                            segments["reused"] += 1
+                            trimmed_paths.append(trimmed_path)
+                            continue
 
-                    if needs_trim:
-                        trimmed_path = os.path.join(tmpdir, f"clip_{i:03d}.mp4")
                         ffmpeg_cmd = ["ffmpeg", "-y", "-i", raw_path]
 
                         if trim_start > 0:
                             ffmpeg_cmd += ["-ss", str(trim_start)]
 
                         if clip.trim_end is not None:
-                            probe = subprocess.run(
-                                ["ffprobe", "-v", "error",
-                                 "-show_entries", "format=duration",
-                                 "-of", "default=noprint_wrappers=1:nokey=1",
-                                 raw_path],
-                                capture_output=True, text=True
-                            )
-                            total_duration = float(probe.stdout.strip())
-                            end_time = total_duration - clip.trim_end
+                            end_time = info.duration - clip.trim_end
                             if end_time > trim_start:
                                 ffmpeg_cmd += ["-to", str(end_time)]
 
                         ffmpeg_cmd += ["-c", "copy", trimmed_path]
-                        result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+                        returncode, stderr = await run_ffmpeg(ffmpeg_cmd)
 
-                        if result.returncode != 0:
-                            print(f"Trim warning clip {i}: {result.stderr}")
+                        if returncode != 0:
+                            print(f"Trim warning clip {i}: {stderr}")
                             trimmed_path = raw_path
+                            segments["untrimmed"] += 1
                         else:
                             print(f"Clip {i + 1} trimmed: start={trim_start}s, trim_end={clip.trim_end}s")
-                    else:
-                        trimmed_path = raw_path
+                            segment_cache.put(segment_key, trimmed_path)
+                            segments["trimmed"] += 1
+                else:
+                    trimmed_path = raw_path
+                    segments["untrimmed"] += 1
+
+                trimmed_paths.append(trimmed_path)
 
-                    trimmed_paths.append(trimmed_path)
+            print(f"Segments for {req.sequence_id}: {segments['reused']} reused, "
+                  f"{segments['trimmed']} trimmed, {segments['untrimmed']} untrimmed")
 
             concat_file = os.path.join(tmpdir, "concat.txt")
 
@@ -691,25 +1833,53 @@ async def merge_videos(req: MergeVideosRequest, request: Request):
                 for path in trimmed_paths:
                     f.write(f"file '{path}'\n")
 
+            if req.preview:
+                return await _render_preview(req, concat_file, fingerprint.hexdigest(), first_info, expected_seconds)
+
+            file_name = f"sequence_{req.sequence_id}.mp4"
+
+            report_stage(req.sequence_id, "merging", persist=False)
+
+            stream_output = MERGE_STREAM_OUTPUT if req.stream_output is None else req.stream_output
+
+            if stream_output:
+                try:
+                    # Fragmented MP4 needs no seekable output: moov first, then moof/mdat fragments
+                    public_url = await run_ffmpeg_to_upload(
+                        ["ffmpeg", "-y", "-f", "concat", "-safe", "0",
+                         "-i", concat_file, "-c", "copy",
+                         "-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+                         "pipe:1"],
+                        file_name, job_id=req.sequence_id, total_seconds=expected_seconds, label="merge",
+                    )
+                    event_hub.publish(req.sequence_id, "done", {"kind": "merge", "video_url": public_url})
+                    return {"status": "success", "video_url": public_url}
+                except Exception as e:
+                    # Inputs are still on disk: redo it the buffered way (upsert over any partial object)
+                    print(f"Streaming merge failed, falling back to file output: {e}")
+                    metrics.incr("merge.stream_fallbacks")
+
             output_path = os.path.join(tmpdir, "merged.mp4")
 
-            result = subprocess.run(
+            returncode, stderr = await run_ffmpeg(
                 ["ffmpeg", "-y", "-f", "concat", "-safe", "0",
-                 "-i", concat_file, "-c", "copy", output_path],
-                capture_output=True, text=True
+                 "-i", concat_file, "-c", "copy", "-movflags", "+faststart", output_path],
+                job_id=req.sequence_id, total_seconds=expected_seconds, label="merge",
             )
 
-            if result.returncode != 0:
-                raise Exception(f"FFmpeg error: {result.stderr}")
+            if returncode != 0:
+                raise Exception(f"FFmpeg error: {stderr}")
 
             print("FFmpeg merge completed successfully")
 
             with open(output_path, "rb") as f:
                 merged_bytes = f.read()
 
-            file_name = f"sequence_{req.sequence_id}.mp4"
+            report_stage(req.sequence_id, stages.UPLOADING, persist=False)
+
+            public_url = await upload_video_to_supabase(merged_bytes, file_name, upsert=stream_output)
 
-            public_url = await upload_video_to_supabase(merged_bytes, file_name)
+            event_hub.publish(req.sequence_id, "done", {"kind": "merge", "video_url": public_url})
 
             return {"status": "success", "video_url": public_url}
 
@@ -717,41 +1887,321 @@ async def merge_videos(req: MergeVideosRequest, request: Request):
 
         print(f"ERROR in merge: {str(e)}")
 
+        event_hub.publish(req.sequence_id, "error", {"kind": "merge", "message": str(e)})
+
         return {"status": "error", "message": str(e)}
 
     
 
+async def _render_preview(
+    req: MergeVideosRequest,
+    concat_file: str,
+    fingerprint: str,
+    first_info,
+    expected_seconds: Optional[float],
+) -> dict:
+    """
+    Concat + 360p ultrafast encode + watermark in one ffmpeg pass. The proxy
+    is stored as previews/{fingerprint}.mp4, so the same clips and trims are
+    never rendered twice.
+    """
+
+    file_name = f"previews/{fingerprint}.mp4"
+    public_url = f"{SUPABASE_URL}/storage/v1/object/public/videos/{file_name}"
+
+    client = get_http_client()
+    existing = await client.head(public_url, timeout=30)
+    if existing.status_code == 200:
+        metrics.incr("merge.preview_cache_hits")
+        print(f"Preview for {req.sequence_id} already rendered: {public_url}")
+        event_hub.publish(req.sequence_id, "done", {"kind": "preview", "video_url": public_url})
+        return {"status": "success", "video_url": public_url, "preview": True, "cached": True}
+
+    metrics.incr("merge.preview_renders")
+    report_stage(req.sequence_id, "previewing", persist=False)
+
+    tmpdir = os.path.dirname(concat_file)
+
+    # Proxy size: short side PREVIEW_SHORT_SIDE, aspect from the first clip (even dimensions for x264)
+    src_w = first_info.width if first_info is not None and first_info.width else 1080
+    src_h = first_info.height if first_info is not None and first_info.height else 1920
+    scale = PREVIEW_SHORT_SIDE / min(src_w, src_h)
+    out_w, out_h = round(src_w * scale / 2) * 2, round(src_h * scale / 2) * 2
+
+    # Watermark overlay at the proxy size, cached per size like watermark-video's
+    overlay_path = os.path.join(tmpdir, "overlay.png")
+    with open(overlay_path, "wb") as f:
+        f.write(await asyncio.to_thread(video_watermark_overlay, out_w, out_h))
+
+    output_path = os.path.join(tmpdir, "preview.mp4")
+    returncode, stderr = await run_ffmpeg(
+        ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_file, "-i", overlay_path,
+         "-filter_complex",
+         f"[0:v]scale={out_w}:{out_h},setsar=1[base];[base][1:v]overlay=0:0:format=auto,format=yuv420p[out]",
+         "-map", "[out]", "-map", "0:a?",
+         "-c:v", "libx264", "-preset", "ultrafast", "-crf", "32",
+         "-maxrate", "600k", "-bufsize", "1200k",
+         "-c:a", "aac", "-b:a", "64k",
+         "-movflags", "+faststart", output_path],
+        job_id=req.sequence_id, total_seconds=expected_seconds, label="preview",
+    )
+
+    if returncode != 0:
+        raise Exception(f"FFmpeg error: {stderr[-500:]}")
+
+    with open(output_path, "rb") as f:
+        preview_bytes = f.read()
+
+    report_stage(req.sequence_id, stages.UPLOADING, persist=False)
+
+    public_url = await upload_video_to_supabase(preview_bytes, file_name, upsert=True, package=False)
+
+    event_hub.publish(req.sequence_id, "done", {"kind": "preview", "video_url": public_url})
+
+    return {"status": "success", "video_url": public_url, "preview": True, "cached": False}
+
 # =====================================================
 # ENV: SCRAPER SECRET
 # =====================================================
 SCRAPER_SECRET = os.environ.get("SCRAPER_SECRET", "")
 
+# The scraper runs as a child process (python scraper.py --run-id ...) so
+# Chromium never competes with render traffic on this event loop.
+SCRAPER_TIMEOUT_SECONDS = float(os.environ.get("SCRAPER_TIMEOUT_SECONDS", "900"))
+# RSS cap for the whole process group (scraper + Chromium); RLIMIT_AS would
+# break Chromium, which reserves far more address space than it uses
+SCRAPER_MAX_RSS_MB = int(os.environ.get("SCRAPER_MAX_RSS_MB", "1536"))
+# Per-process CPU seconds (RLIMIT_CPU) and scheduling priority
+SCRAPER_CPU_SECONDS = int(os.environ.get("SCRAPER_CPU_SECONDS", "600"))
+SCRAPER_NICE = int(os.environ.get("SCRAPER_NICE", "10"))
+
+SCRAPER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraper.py")
+
+_scraper_process: Optional[asyncio.subprocess.Process] = None
+_scraper_run_id: Optional[str] = None
+# The loop only keeps weak references to tasks: hold the supervisor here
+_scraper_supervisor: Optional[asyncio.Task] = None
+
+metrics.register_gauge("scraper", lambda: {
+    "running_run_id": _scraper_run_id,
+    "pid": _scraper_process.pid if _scraper_process is not None else None,
+})
+
+
+# =====================================================
+# SCRAPER PROCESS
+# =====================================================
+def _limit_scraper_process():
+    """preexec_fn for the scraper child: lower priority and cap CPU time."""
+    import resource
+
+    os.nice(SCRAPER_NICE)
+    resource.setrlimit(resource.RLIMIT_CPU, (SCRAPER_CPU_SECONDS, SCRAPER_CPU_SECONDS))
+
+def _process_group_rss_mb(pgid: int) -> float:
+    """Sum of RSS over every process in the group (scraper + Chromium children)."""
+    page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+    total_kb = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # Fields after the "(comm)" — comm may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) == pgid:
+                total_kb += int(fields[21]) * page_kb
+        except (OSError, IndexError, ValueError):
+            continue
+    return total_kb / 1024
+
+def _kill_scraper_process():
+    import signal
+
+    if _scraper_process is not None and _scraper_process.returncode is None:
+        try:
+            os.killpg(_scraper_process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+async def _fail_scraper_run(run_id: Optional[str], message: str):
+    """Close a run the child could not close itself (killed, crashed)."""
+    if not run_id:
+        return
+    client = get_http_client()
+    try:
+        response = await client.patch(
+            f"{SUPABASE_URL}/rest/v1/scraper_runs?id=eq.{run_id}&status=eq.running",
+            headers={
+                "apikey": SUPABASE_KEY,
+                "Authorization": f"Bearer {SUPABASE_KEY}",
+                "Content-Type": "application/json",
+                "Prefer": "return=minimal",
+            },
+            json={"status": "error", "error_message": message[:500], "finished_at": "now()"},
+            timeout=15,
+        )
+        response.raise_for_status()
+    except Exception as e:
+        print(f"[scraper] Warning: could not close scraper_run {run_id}: {e}")
+
+async def _supervise_scraper(process: asyncio.subprocess.Process, run_id: Optional[str]):
+    """Enforce the wall-clock timeout and the RSS cap, then record abnormal exits."""
+    global _scraper_process, _scraper_run_id, _scraper_supervisor
+
+    started = time.monotonic()
+    reason = None
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(process.wait(), timeout=2)
+                break
+            except asyncio.TimeoutError:
+                pass
+            if time.monotonic() - started > SCRAPER_TIMEOUT_SECONDS:
+                reason = f"timeout after {SCRAPER_TIMEOUT_SECONDS:.0f}s"
+            else:
+                rss_mb = await asyncio.to_thread(_process_group_rss_mb, process.pid)
+                if rss_mb > SCRAPER_MAX_RSS_MB:
+                    reason = f"memory cap exceeded ({rss_mb:.0f}MB > {SCRAPER_MAX_RSS_MB}MB)"
+            if reason:
+                print(f"[scraper] Killing run {run_id}: {reason}")
+                _kill_scraper_process()
+                await process.wait()
+                break
+
+        elapsed = time.monotonic() - started
+        print(f"[scraper] Run {run_id} exited with {process.returncode} after {elapsed:.1f}s")
+        metrics.incr("scraper.runs")
+        if reason or process.returncode != 0:
+            metrics.incr("scraper.failed_runs")
+            await _fail_scraper_run(run_id, reason or f"scraper process exited with {process.returncode}")
+    finally:
+        _scraper_process = None
+        _scraper_run_id = None
+        _scraper_supervisor = None
+
 
 # =====================================================
 # ENDPOINT: SCRAPE TRENDING (TikTok Creative Center)
 # =====================================================
 @app.post("/scrape-trending")
 async def scrape_trending(request: Request):
+    """
+    Start a scrape in a child process and return its scraper_runs id right
+    away; progress and the outcome are tracked in scraper_runs. Only one run
+    at a time: a second call while one is running returns that run's id.
+    """
+    global _scraper_process, _scraper_run_id, _scraper_supervisor
+
     secret = request.headers.get("X-Scraper-Secret", "")
     if not SCRAPER_SECRET or secret != SCRAPER_SECRET:
         return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+
+    if _scraper_process is not None:
+        return {"status": "running", "run_id": _scraper_run_id, "message": "A scrape is already running"}
+
     try:
-        from scraper import run_scraper
-        result = await run_scraper()
-        return result
+        # Same insert the scraper uses when run by hand; importing it does not load Playwright
+        from scraper import create_scraper_run, current_week
+
+        run_id = await create_scraper_run(get_http_client(), current_week())
+        args = [sys.executable, SCRAPER_SCRIPT]
+        if run_id:
+            args += ["--run-id", run_id]
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=os.path.dirname(SCRAPER_SCRIPT),
+            start_new_session=True,
+            preexec_fn=_limit_scraper_process,
+        )
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+    _scraper_process = process
+    _scraper_run_id = run_id
+    _scraper_supervisor = asyncio.create_task(_supervise_scraper(process, run_id))
+    print(f"[scraper] Started run {run_id} (pid {process.pid})")
+    return {"status": "started", "run_id": run_id}
+
 # =====================================================
 # WATERMARK CONFIG
 # =====================================================
 # Path to the local watermark PNG shipped with the worker
 WATERMARK_PATH = os.path.join(os.path.dirname(__file__), "watermark.png")
 
-def _load_watermark() -> Image.Image:
+def _load_watermark() -> "Image.Image":
     """Load the watermark PNG (white text on transparent bg, 400x100)."""
+    from PIL import Image
+
     return Image.open(WATERMARK_PATH).convert("RGBA")
 
+@functools.lru_cache(maxsize=8)
+def video_watermark_overlay(vid_w: int, vid_h: int) -> bytes:
+    """Full-frame tiled watermark (PNG) for a video of this size; cached, videos come in a few sizes."""
+    from PIL import Image
+
+    wm = _load_watermark()
+    wm_scale = max(1, int(vid_w * 0.30 / wm.width))
+    wm_resized = wm.resize((wm.width * wm_scale, wm.height * wm_scale), Image.LANCZOS)
+    wm_rotated = wm_resized.rotate(30, expand=True, resample=Image.BICUBIC)
+
+    overlay = Image.new("RGBA", (vid_w, vid_h), (0, 0, 0, 0))
+    wm_w, wm_h = wm_rotated.size
+    step_x = int(wm_w * 1.5)
+    step_y = int(wm_h * 2.5)
+    for y_off in range(-vid_h, vid_h * 2, step_y):
+        for x_off in range(-vid_w, vid_w * 2, step_x):
+            row_idx = (y_off + vid_h) // step_y
+            x_shift = (step_x // 2) * (row_idx % 2)
+            px, py = x_off + x_shift, y_off
+            if 0 - wm_w < px < vid_w and 0 - wm_h < py < vid_h:
+                overlay.paste(wm_rotated, (px, py), wm_rotated)
+
+    buf = io.BytesIO()
+    overlay.save(buf, format="PNG")
+    return buf.getvalue()
+
+def apply_image_watermark(img_bytes: bytes) -> bytes:
+    """Tile the rotated watermark diagonally over the image and return it as JPEG bytes."""
+    from PIL import Image
+
+    base_img = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
+    w, h = base_img.size
+
+    # Load watermark and scale relative to image (watermark width = ~30% of image width)
+    wm = _load_watermark()
+    wm_scale = max(1, int(w * 0.30 / wm.width))
+    wm_resized = wm.resize((wm.width * wm_scale, wm.height * wm_scale), Image.LANCZOS)
+
+    # Create overlay with diagonal repeated pattern
+    overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    wm_w, wm_h = wm_resized.size
+    # Step between watermarks: ~1.5x the watermark size
+    step_x = int(wm_w * 1.5)
+    step_y = int(wm_h * 2.5)
+
+    for y_off in range(-h, h * 2, step_y):
+        for x_off in range(-w, w * 2, step_x):
+            # Diagonal offset: shift every other row
+            row_idx = (y_off + h) // step_y
+            x_shift = (step_x // 2) * (row_idx % 2)
+            px, py = x_off + x_shift, y_off
+
+            # Rotate watermark 30 degrees for diagonal effect
+            wm_rotated = wm_resized.rotate(30, expand=True, resample=Image.BICUBIC)
+            if 0 - wm_rotated.width < px < w and 0 - wm_rotated.height < py < h:
+                overlay.paste(wm_rotated, (px, py), wm_rotated)
+
+    # Composite
+    result = Image.alpha_composite(base_img, overlay)
+    result_rgb = result.convert("RGB")
+
+    # Save to bytes
+    buf = io.BytesIO()
+    result_rgb.save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
 # =====================================================
 # ENDPOINT: WATERMARK IMAGE
 # =====================================================
@@ -765,6 +2215,14 @@ async def watermark_image(request: Request):
     if not verify_worker_auth(request):
         return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
 
+    try:
+        async with admission.admit("watermark-image", WATERMARK_IMAGE_COST):
+            return await _watermark_image(request)
+    except AdmissionRejected as e:
+        return busy_response(e)
+
+async def _watermark_image(request: Request):
+
     try:
         body = await request.json()
         image_url = body["image_url"]
@@ -774,41 +2232,7 @@ async def watermark_image(request: Request):
 
         # Download source image
         img_bytes = await download_image_bytes(image_url)
-        base_img = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
-        w, h = base_img.size
-
-        # Load watermark and scale relative to image (watermark width = ~30% of image width)
-        wm = _load_watermark()
-        wm_scale = max(1, int(w * 0.30 / wm.width))
-        wm_resized = wm.resize((wm.width * wm_scale, wm.height * wm_scale), Image.LANCZOS)
-
-        # Create overlay with diagonal repeated pattern
-        overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-        wm_w, wm_h = wm_resized.size
-        # Step between watermarks: ~1.5x the watermark size
-        step_x = int(wm_w * 1.5)
-        step_y = int(wm_h * 2.5)
-
-        for y_off in range(-h, h * 2, step_y):
-            for x_off in range(-w, w * 2, step_x):
-                # Diagonal offset: shift every other row
-                row_idx = (y_off + h) // step_y
-                x_shift = (step_x // 2) * (row_idx % 2)
-                px, py = x_off + x_shift, y_off
-
-                # Rotate watermark 30 degrees for diagonal effect
-                wm_rotated = wm_resized.rotate(30, expand=True, resample=Image.BICUBIC)
-                if 0 - wm_rotated.width < px < w and 0 - wm_rotated.height < py < h:
-                    overlay.paste(wm_rotated, (px, py), wm_rotated)
-
-        # Composite
-        result = Image.alpha_composite(base_img, overlay)
-        result_rgb = result.convert("RGB")
-
-        # Save to bytes
-        buf = io.BytesIO()
-        result_rgb.save(buf, format="JPEG", quality=92)
-        result_bytes = buf.getvalue()
+        result_bytes = apply_image_watermark(img_bytes)
 
         # Upload to Supabase Storage
         file_name = f"watermarked/{generation_id}.jpg"
@@ -818,9 +2242,9 @@ async def watermark_image(request: Request):
             "Authorization": f"Bearer {SUPABASE_KEY}",
             "Content-Type": "image/jpeg",
         }
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(upload_url, headers=headers, content=result_bytes)
-            resp.raise_for_status()
+        client = get_http_client()
+        resp = await client.post(upload_url, headers=headers, content=result_bytes, timeout=60)
+        resp.raise_for_status()
 
         public_url = f"{SUPABASE_URL}/storage/v1/object/public/creative-media/{file_name}"
         print(f"[watermark-image] Done: {public_url}")
@@ -844,56 +2268,45 @@ async def watermark_video(request: Request):
     if not verify_worker_auth(request):
         return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
 
+    try:
+        async with admission.admit("watermark-video", WATERMARK_VIDEO_COST):
+            return await _watermark_video(request)
+    except AdmissionRejected as e:
+        return busy_response(e)
+
+async def _watermark_video(request: Request):
+
+    generation_id = None
+
     try:
         body = await request.json()
         video_url = body["video_url"]
         generation_id = body.get("generation_id", str(uuid.uuid4()))
 
         print(f"[watermark-video] Starting for generation={generation_id}")
+        report_stage(generation_id, "watermarking", persist=False)
 
         with tempfile.TemporaryDirectory() as tmpdir:
             # Download video
-            async with httpx.AsyncClient(timeout=120) as client:
-                resp = await client.get(video_url)
-                resp.raise_for_status()
-                video_path = os.path.join(tmpdir, "input.mp4")
-                with open(video_path, "wb") as f:
-                    f.write(resp.content)
+            client = get_http_client()
+            resp = await client.get(video_url, timeout=120)
+            resp.raise_for_status()
+            video_path = os.path.join(tmpdir, "input.mp4")
+            with open(video_path, "wb") as f:
+                f.write(resp.content)
 
             # Probe video dimensions
-            probe = subprocess.run(
-                ["ffprobe", "-v", "error", "-select_streams", "v:0",
-                 "-show_entries", "stream=width,height",
-                 "-of", "csv=s=x:p=0", video_path],
-                capture_output=True, text=True
-            )
-            vid_w, vid_h = 1080, 1920  # defaults
-            if probe.stdout.strip():
-                parts = probe.stdout.strip().split("x")
-                if len(parts) == 2:
-                    vid_w, vid_h = int(parts[0]), int(parts[1])
-
-            # Create a tiled watermark image matching video dimensions
-            wm = _load_watermark()
-            wm_scale = max(1, int(vid_w * 0.30 / wm.width))
-            wm_resized = wm.resize((wm.width * wm_scale, wm.height * wm_scale), Image.LANCZOS)
-            wm_rotated = wm_resized.rotate(30, expand=True, resample=Image.BICUBIC)
-
-            # Build full-frame watermark overlay
-            overlay = Image.new("RGBA", (vid_w, vid_h), (0, 0, 0, 0))
-            wm_w, wm_h = wm_rotated.size
-            step_x = int(wm_w * 1.5)
-            step_y = int(wm_h * 2.5)
-            for y_off in range(-vid_h, vid_h * 2, step_y):
-                for x_off in range(-vid_w, vid_w * 2, step_x):
-                    row_idx = (y_off + vid_h) // step_y
-                    x_shift = (step_x // 2) * (row_idx % 2)
-                    px, py = x_off + x_shift, y_off
-                    if 0 - wm_w < px < vid_w and 0 - wm_h < py < vid_h:
-                        overlay.paste(wm_rotated, (px, py), wm_rotated)
-
+            vid_w, vid_h, duration = 1080, 1920, None  # defaults
+            try:
+                info = await media_probe.probe(video_path)
+                vid_w, vid_h, duration = info.width or vid_w, info.height or vid_h, info.duration
+            except ProbeError as e:
+                print(f"[watermark-video] Probe warning: {e}")
+
+            # Tiled watermark overlay matching the video dimensions
             overlay_path = os.path.join(tmpdir, "overlay.png")
-            overlay.save(overlay_path)
+            with open(overlay_path, "wb") as f:
+                f.write(await asyncio.to_thread(video_watermark_overlay, vid_w, vid_h))
 
             # FFmpeg: overlay watermark on video
             output_path = os.path.join(tmpdir, "output.mp4")
@@ -904,11 +2317,14 @@ async def watermark_video(request: Request):
                 "-filter_complex", "[0:v][1:v]overlay=0:0:format=auto",
                 "-c:v", "libx264", "-preset", "fast", "-crf", "23",
                 "-c:a", "copy",
+                "-movflags", "+faststart",
                 output_path
             ]
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"FFmpeg error: {result.stderr[:500]}")
+            returncode, stderr = await run_ffmpeg(
+                ffmpeg_cmd, job_id=generation_id, total_seconds=duration, label="watermark",
+            )
+            if returncode != 0:
+                raise Exception(f"FFmpeg error: {stderr[-500:]}")
 
             # Read output and upload
             with open(output_path, "rb") as f:
@@ -916,9 +2332,12 @@ async def watermark_video(request: Request):
 
             file_name = f"watermarked/{generation_id}.mp4"
             public_url = await upload_video_to_supabase(output_bytes, file_name)
+            event_hub.publish(generation_id, "done", {"kind": "watermark", "video_url": public_url})
             print(f"[watermark-video] Done: {public_url}")
             return {"status": "success", "video_url": public_url}
 
     except Exception as e:
         print(f"[watermark-video] ERROR: {e}")
+        if generation_id:
+            event_hub.publish(generation_id, "error", {"kind": "watermark", "message": str(e)})
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
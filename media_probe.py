@@ -0,0 +1,189 @@
+"""
+ffprobe metadata for the media endpoints, one call per file content.
+
+Merge (trim), watermark and the packaging steps all need a bit of the same
+information: duration, dimensions, codecs. Each used to spawn its own
+blocking ffprobe for a single field. probe() runs ffprobe once, without
+blocking the event loop, reads the full format and stream info as JSON and
+returns a MediaInfo. Results are cached by content hash (sha256 of the
+file), so the same clip merged again, or watermarked after being merged,
+is not probed twice.
+"""
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import metrics
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ProbeError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    duration: Optional[float]
+    format_name: str
+    size: Optional[int]
+    bit_rate: Optional[int]
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    video_codec: Optional[str] = None
+    pix_fmt: Optional[str] = None
+    audio_codec: Optional[str] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+
+    @property
+    def has_video(self) -> bool:
+        return self.video_codec is not None
+
+    @property
+    def has_audio(self) -> bool:
+        return self.audio_codec is not None
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate(value: Optional[str]) -> Optional[float]:
+    """'30000/1001' -> 29.97 (None for 0/0 or missing)."""
+    if not value:
+        return None
+    num, _, den = value.partition("/")
+    num, den = _float(num), _float(den or "1")
+    if not num or not den:
+        return None
+    return round(num / den, 3)
+
+
+def parse(data: dict) -> MediaInfo:
+    """Build a MediaInfo from `ffprobe -show_format -show_streams -of json` output."""
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    duration = _float(fmt.get("duration"))
+    if duration is None and video is not None:
+        duration = _float(video.get("duration"))
+
+    info = {
+        "duration": duration,
+        "format_name": fmt.get("format_name", ""),
+        "size": _int(fmt.get("size")),
+        "bit_rate": _int(fmt.get("bit_rate")),
+    }
+    if video is not None:
+        width, height = _int(video.get("width")), _int(video.get("height"))
+        rotation = abs(_int(video.get("tags", {}).get("rotate")) or 0)
+        for side_data in video.get("side_data_list", []):
+            rotation = abs(_int(side_data.get("rotation")) or rotation)
+        if rotation % 180 == 90:
+            # Phone footage stored landscape with a rotation flag: report what players show
+            width, height = height, width
+        info.update(
+            width=width,
+            height=height,
+            fps=_rate(video.get("avg_frame_rate")) or _rate(video.get("r_frame_rate")),
+            video_codec=video.get("codec_name"),
+            pix_fmt=video.get("pix_fmt"),
+        )
+    if audio is not None:
+        info.update(
+            audio_codec=audio.get("codec_name"),
+            sample_rate=_int(audio.get("sample_rate")),
+            channels=_int(audio.get("channels")),
+        )
+    return MediaInfo(**info)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaProbe:
+
+    def __init__(self, max_entries: int = 1024, timeout: float = 30.0):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._cache: "OrderedDict[str, MediaInfo]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def _run(self, path: str) -> dict:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            raise ProbeError(f"could not run ffprobe: {e}")
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise ProbeError(f"ffprobe timed out after {self.timeout:.0f}s on {path}")
+        if process.returncode != 0:
+            raise ProbeError(f"ffprobe failed on {path}: {stderr.decode(errors='replace')[-300:]}")
+        try:
+            return json.loads(stdout)
+        except ValueError as e:
+            raise ProbeError(f"ffprobe returned invalid JSON for {path}: {e}")
+
+    async def probe(self, path: str, content_hash: Optional[str] = None) -> MediaInfo:
+        """
+        Metadata for the file at `path`. Pass the content sha256 when the
+        caller already has it (e.g. from the clip cache); otherwise it is
+        computed here, off the event loop.
+        """
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(file_sha256, path)
+
+        info = self._cache.get(content_hash)
+        if info is not None:
+            self.hits += 1
+            metrics.incr("media_probe.hits")
+            self._cache.move_to_end(content_hash)
+            return info
+
+        self.misses += 1
+        metrics.incr("media_probe.misses")
+        info = parse(await self._run(path))
+        self._cache[content_hash] = info
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return info
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
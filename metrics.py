@@ -0,0 +1,36 @@
+"""
+In-process counters and gauges for the worker, exposed on GET /metrics.
+
+Deliberately tiny: plain dicts, no labels, no external exporter. Each
+replica reports its own numbers.
+"""
+
+import time
+from typing import Callable, Dict
+
+_started_at = time.time()
+_counters: Dict[str, int] = {}
+_gauges: Dict[str, Callable[[], object]] = {}
+
+
+def incr(name: str, value: int = 1):
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def register_gauge(name: str, fn: Callable[[], object]):
+    """Register a callable sampled at snapshot time (queue sizes, cache stats...)."""
+    _gauges[name] = fn
+
+
+def snapshot() -> dict:
+    gauges = {}
+    for name, fn in _gauges.items():
+        try:
+            gauges[name] = fn()
+        except Exception as e:
+            gauges[name] = f"error: {e}"
+    return {
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "counters": dict(sorted(_counters.items())),
+        "gauges": gauges,
+    }
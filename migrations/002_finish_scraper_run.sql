@@ -0,0 +1,40 @@
+-- Migration 002: finish_scraper_run RPC
+-- Run this in Supabase SQL Editor
+--
+-- Closes a scraper run and, on success, deactivates ads from other weeks in a
+-- single round trip (POST /rest/v1/rpc/finish_scraper_run).
+
+CREATE OR REPLACE FUNCTION finish_scraper_run(
+  p_run_id          UUID,
+  p_week_of         DATE,
+  p_status          TEXT,
+  p_items           INTEGER,
+  p_error           TEXT DEFAULT NULL,
+  p_deactivate_old  BOOLEAN DEFAULT false
+)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  IF p_deactivate_old THEN
+    UPDATE trending_videos
+       SET is_active = false
+     WHERE is_active = true
+       AND week_of <> p_week_of;
+  END IF;
+
+  IF p_run_id IS NOT NULL THEN
+    UPDATE scraper_runs
+       SET status        = p_status,
+           items_scraped = p_items,
+           error_message = LEFT(p_error, 500),
+           finished_at   = NOW()
+     WHERE id = p_run_id;
+  END IF;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION finish_scraper_run(UUID, DATE, TEXT, INTEGER, TEXT, BOOLEAN) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION finish_scraper_run(UUID, DATE, TEXT, INTEGER, TEXT, BOOLEAN) TO service_role;
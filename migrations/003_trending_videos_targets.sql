@@ -0,0 +1,39 @@
+-- Migration 003: trending_videos keyed per scrape target
+-- Run this in Supabase SQL Editor
+--
+-- The scraper now covers several (region, industry, period) targets, and the
+-- same ad can rank in more than one of them. ad_id alone is no longer unique;
+-- the upsert uses on_conflict=ad_id,region,industry,period.
+
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS industry TEXT;
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS period   INTEGER;
+
+-- Existing rows all came from the old single target (BR, cosmetics, 7 days)
+UPDATE trending_videos SET industry = '14104000000' WHERE industry IS NULL;
+UPDATE trending_videos SET period = 7 WHERE period IS NULL;
+UPDATE trending_videos SET region = 'BR' WHERE region IS NULL;
+
+ALTER TABLE trending_videos ALTER COLUMN industry SET DEFAULT '14104000000';
+ALTER TABLE trending_videos ALTER COLUMN industry SET NOT NULL;
+ALTER TABLE trending_videos ALTER COLUMN period   SET DEFAULT 7;
+ALTER TABLE trending_videos ALTER COLUMN period   SET NOT NULL;
+ALTER TABLE trending_videos ALTER COLUMN region   SET NOT NULL;
+
+-- ============================================================
+-- KEYS
+-- ============================================================
+ALTER TABLE trending_videos DROP CONSTRAINT IF EXISTS trending_videos_ad_id_key;
+
+ALTER TABLE trending_videos
+  ADD CONSTRAINT trending_videos_target_key UNIQUE (ad_id, region, industry, period);
+
+-- ============================================================
+-- INDEXES
+-- ============================================================
+-- Per-target listing: "active ads for BR / cosmetics / 7d ordered by rank"
+CREATE INDEX IF NOT EXISTS idx_trending_videos_target_active
+  ON trending_videos(region, industry, period, rank)
+  WHERE is_active;
+
+CREATE INDEX IF NOT EXISTS idx_trending_videos_target_week
+  ON trending_videos(region, industry, period, week_of);
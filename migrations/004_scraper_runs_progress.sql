@@ -0,0 +1,14 @@
+-- Migration 004: progress tracking for out-of-process scraper runs
+-- Run this in Supabase SQL Editor
+--
+-- POST /scrape-trending now creates the scraper_runs row and returns its id
+-- right away; the scraper child process reports progress after each target.
+
+ALTER TABLE scraper_runs ADD COLUMN IF NOT EXISTS targets_total INTEGER;
+ALTER TABLE scraper_runs ADD COLUMN IF NOT EXISTS targets_done  INTEGER DEFAULT 0;
+ALTER TABLE scraper_runs ADD COLUMN IF NOT EXISTS progress_at   TIMESTAMPTZ;
+
+-- "Is a run still going?" for dashboards and stuck-run cleanup
+CREATE INDEX IF NOT EXISTS idx_scraper_runs_running
+  ON scraper_runs(started_at)
+  WHERE status = 'running';
@@ -0,0 +1,33 @@
+-- Migration 005: change detection and rank history for trending ads
+-- Run this in Supabase SQL Editor
+--
+-- The scraper fingerprints each normalized ad (content_hash) and only rewrites
+-- rows whose content changed; rank moves are kept in trending_rank_history
+-- and ads that dropped out of a target are deactivated by id.
+
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- ============================================================
+-- TABLE: trending_rank_history
+-- One row per (ad, target, week) where the rank changed or the ad appeared
+-- ============================================================
+CREATE TABLE IF NOT EXISTS trending_rank_history (
+  ad_id          TEXT NOT NULL,
+  region         TEXT NOT NULL,
+  industry       TEXT NOT NULL,
+  period         INTEGER NOT NULL,
+  week_of        DATE NOT NULL,
+  rank           INTEGER NOT NULL,
+  previous_rank  INTEGER,
+  recorded_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (ad_id, region, industry, period, week_of)
+);
+
+CREATE INDEX IF NOT EXISTS idx_trending_rank_history_target_week
+  ON trending_rank_history(region, industry, period, week_of);
+
+ALTER TABLE trending_rank_history ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role full access - trending_rank_history"
+  ON trending_rank_history FOR ALL
+  USING (auth.role() = 'service_role');
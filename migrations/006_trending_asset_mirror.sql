@@ -0,0 +1,20 @@
+-- Migration 006: mirrored copies of trending ad assets
+-- Run this in Supabase SQL Editor
+--
+-- asset_mirror.py copies each active ad's video and cover from the TikTok
+-- CDN (links expire) into the trending-assets bucket and builds a WEBP
+-- thumbnail. mirrored_hash is the content_hash the copies were made from;
+-- rows where it already matches are skipped.
+
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS mirrored_video_url TEXT;
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS mirrored_cover_url TEXT;
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS thumbnail_url      TEXT;
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS video_sha256       TEXT;
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS mirrored_hash      TEXT;
+ALTER TABLE trending_videos ADD COLUMN IF NOT EXISTS mirrored_at        TIMESTAMPTZ;
+
+-- Public bucket: the objects are public ads, and the mirror checks for
+-- existing objects through the public URL
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('trending-assets', 'trending-assets', true)
+ON CONFLICT (id) DO NOTHING;
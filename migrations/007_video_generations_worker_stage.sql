@@ -0,0 +1,12 @@
+-- Migration 007: worker stage on video_generations
+-- Run this in Supabase SQL Editor
+--
+-- The render worker reports where a generation is (downloading,
+-- preprocessing, submitted, rendering, uploading, then completed / failed)
+-- so the UI can show progress during long renders. Updates are coalesced
+-- per row and batched by the worker's status writer.
+
+ALTER TABLE video_generations ADD COLUMN IF NOT EXISTS worker_stage     TEXT;
+ALTER TABLE video_generations ADD COLUMN IF NOT EXISTS worker_stage_at  TIMESTAMPTZ;
+-- Provider-reported percentage when available (Sora), NULL otherwise
+ALTER TABLE video_generations ADD COLUMN IF NOT EXISTS worker_progress  INTEGER;
@@ -0,0 +1,9 @@
+-- Migration 008: extra Veo samples on video_generations
+-- Run this in Supabase SQL Editor
+--
+-- A generation can ask Veo for several samples (sampleCount) in one
+-- operation. video_url keeps the first one, as before; when more than one
+-- sample was rendered the worker also stores all of their URLs, in the
+-- order Veo returned them, so the UI can let the user pick.
+
+ALTER TABLE video_generations ADD COLUMN IF NOT EXISTS sample_video_urls TEXT[];
@@ -1,16 +1,20 @@
 """
 TikTok Creative Center Scraper
-Coleta os top ads de cosmeticos semanalmente via Playwright (route interception).
+Coleta os top ads de cosmeticos semanalmente via Playwright (route interception),
+ou direto pela API com a sessao salva da ultima execucao com browser.
 Exposto como endpoint POST /scrape-trending no worker FastAPI.
 """
 
 import os
+import json
+import time
+import hashlib
 import asyncio
+from dataclasses import dataclass
 from datetime import date, timedelta
-from typing import Optional
+from typing import List, Optional
 
 import httpx
-from playwright.async_api import async_playwright
 
 # ─────────────────────────────────────────────
 # CONFIG
@@ -20,10 +24,45 @@ SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
 
 TIKTOK_CC_URL = (
     "https://ads.tiktok.com/business/creativecenter/inspiration/topads/pc/en"
-    "?period=7&region=BR&secondIndustry=14104000000"
+    "?period={period}&region={region}&secondIndustry={industry}"
 )
 API_PATTERN = "creative_radar_api/v1/top_ads/v2/list"
-MAX_ADS = 20
+TIKTOK_API_BASE = "https://ads.tiktok.com"
+PAGE_SIZE = 20
+
+# Alvos do scraping: "regiao:industria:periodo" separados por virgula
+SCRAPER_TARGETS = os.environ.get("SCRAPER_TARGETS", "BR:14104000000:7")
+# Ads por alvo (paginado de PAGE_SIZE em PAGE_SIZE)
+MAX_ADS = int(os.environ.get("SCRAPER_MAX_ADS", "100"))
+# Alvos raspados ao mesmo tempo (paginas abertas no contexto compartilhado)
+SCRAPER_CONCURRENCY = int(os.environ.get("SCRAPER_CONCURRENCY", "3"))
+# Espelha videos/capas no Storage depois do scrape (asset_mirror.py)
+MIRROR_ASSETS = os.environ.get("TRENDING_MIRROR_ASSETS", "1") == "1"
+
+# Cookies + headers de uma sessao de browser que deu certo, reaproveitados
+# pelo modo direto (httpx) ate o TikTok rejeitar a sessao
+SCRAPER_SESSION_PATH = os.environ.get("SCRAPER_SESSION_PATH", "/tmp/tiktok_cc_session.json")
+SCRAPER_SESSION_MAX_AGE = float(os.environ.get("SCRAPER_SESSION_MAX_AGE_HOURS", "72")) * 3600
+
+
+@dataclass(frozen=True)
+class ScrapeTarget:
+    region: str
+    industry: str
+    period: int = 7
+
+    def __str__(self):
+        return f"{self.region}/{self.industry}/{self.period}d"
+
+
+def parse_targets(value: str) -> List[ScrapeTarget]:
+    targets = []
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        region, industry, *period = part.strip().split(":")
+        targets.append(ScrapeTarget(region.upper(), industry, int(period[0]) if period else 7))
+    return targets
 
 
 # ─────────────────────────────────────────────
@@ -38,27 +77,67 @@ def supabase_headers() -> dict:
     }
 
 
-async def create_scraper_run(week_of: date) -> Optional[str]:
+def current_week() -> date:
+    today = date.today()
+    return today - timedelta(days=today.weekday())
+
+
+async def create_scraper_run(client: httpx.AsyncClient, week_of: date) -> Optional[str]:
+    """Cria o scraper_run "running". Usado aqui e pelo worker antes de disparar o processo."""
     url = f"{SUPABASE_URL}/rest/v1/scraper_runs"
     payload = {"week_of": str(week_of), "status": "running"}
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            r = await client.post(
-                url,
-                headers={**supabase_headers(), "Prefer": "return=representation"},
-                json=payload,
-            )
-            r.raise_for_status()
-            data = r.json()
-            return data[0]["id"] if data else None
+        r = await client.post(
+            url,
+            headers={**supabase_headers(), "Prefer": "return=representation"},
+            json=payload,
+            timeout=15,
+        )
+        r.raise_for_status()
+        data = r.json()
+        return data[0]["id"] if data else None
     except Exception as e:
         print(f"[scraper] Aviso: nao foi possivel criar scraper_run: {e}")
         return None
 
 
 async def finish_scraper_run(
-    run_id: Optional[str], status: str, items: int, error: str = None
+    client: httpx.AsyncClient,
+    run_id: Optional[str],
+    week_of: date,
+    status: str,
+    items: int,
+    error: str = None,
+    deactivate_old: bool = False,
 ):
+    """
+    Fecha o scraper_run e (opcionalmente) desativa os ads de outras semanas
+    num unico round trip, via RPC finish_scraper_run (migrations/002).
+    Se a funcao ainda nao existir no banco, cai para os PATCHes separados.
+    """
+    payload = {
+        "p_run_id": run_id,
+        "p_week_of": str(week_of),
+        "p_status": status,
+        "p_items": items,
+        "p_error": error[:500] if error else None,
+        "p_deactivate_old": deactivate_old,
+    }
+    try:
+        r = await client.post(
+            f"{SUPABASE_URL}/rest/v1/rpc/finish_scraper_run",
+            headers=supabase_headers(),
+            json=payload,
+        )
+        if r.status_code != 404:
+            r.raise_for_status()
+            return
+        print("[scraper] Aviso: RPC finish_scraper_run ausente, usando PATCHes separados")
+    except Exception as e:
+        print(f"[scraper] Aviso: RPC finish_scraper_run falhou ({e}), usando PATCHes separados")
+
+    if deactivate_old:
+        await deactivate_old_ads(client, week_of)
     if not run_id:
         return
     url = f"{SUPABASE_URL}/rest/v1/scraper_runs?id=eq.{run_id}"
@@ -66,39 +145,54 @@ async def finish_scraper_run(
     if error:
         payload["error_message"] = error[:500]
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            await client.patch(url, headers=supabase_headers(), json=payload)
+        r = await client.patch(url, headers=supabase_headers(), json=payload)
+        r.raise_for_status()
     except Exception as e:
         print(f"[scraper] Aviso: nao foi possivel atualizar scraper_run: {e}")
 
 
-async def deactivate_old_ads(week_of: date):
+async def update_scraper_progress(client: httpx.AsyncClient, run_id: Optional[str], **fields):
+    """Progresso parcial do run (migrations/004). Falha aqui nunca derruba o scrape."""
+    if not run_id:
+        return
+    url = f"{SUPABASE_URL}/rest/v1/scraper_runs?id=eq.{run_id}"
+    try:
+        r = await client.patch(url, headers=supabase_headers(), json={**fields, "progress_at": "now()"})
+        r.raise_for_status()
+    except Exception as e:
+        print(f"[scraper] Aviso: nao foi possivel atualizar progresso: {e}")
+
+
+async def deactivate_old_ads(client: httpx.AsyncClient, week_of: date):
     url = f"{SUPABASE_URL}/rest/v1/trending_videos?week_of=neq.{week_of}&is_active=eq.true"
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            await client.patch(url, headers=supabase_headers(), json={"is_active": False})
+        r = await client.patch(url, headers=supabase_headers(), json={"is_active": False})
+        r.raise_for_status()
     except Exception as e:
         print(f"[scraper] Aviso ao desativar antigos: {e}")
 
 
-async def upsert_trending_video(item: dict, week_of: date, rank: int):
+def build_trending_row(item: dict, week_of: date, rank: int, target: ScrapeTarget) -> Optional[dict]:
+    """Normaliza um item da API do Creative Center numa linha de trending_videos."""
     ad_id = str(item.get("id", ""))
     if not ad_id:
-        return
+        return None
 
     video_info = item.get("video_info", {}) or {}
-    payload = {
+    row = {
         "week_of": str(week_of),
         "rank": rank,
         "ad_id": ad_id,
         "ad_url": (
             f"https://ads.tiktok.com/business/creativecenter/"
-            f"topads/{ad_id}/pc/en?countryCode=BR&period=7"
+            f"topads/{ad_id}/pc/en?countryCode={target.region}&period={target.period}"
         ),
         "caption": item.get("ad_title") or item.get("title") or "",
         "brand_name": item.get("brand_name") or item.get("advertiser_name") or "",
         "objective": item.get("objective_type") or item.get("objective") or "",
-        "region": "BR",
+        "region": target.region,
+        "industry": target.industry,
+        "period": target.period,
         "landing_page": item.get("landing_page_url") or item.get("click_url") or "",
         "duration_s": int(video_info.get("duration", 0) or 0),
         "likes": str(item.get("like_count") or item.get("likes") or ""),
@@ -111,181 +205,640 @@ async def upsert_trending_video(item: dict, week_of: date, rank: int):
         "raw_data": item,
         "is_active": True,
     }
+    row["content_hash"] = content_fingerprint(row)
+    return row
+
+
+# Campos que mudam toda semana sem o anuncio mudar: ficam fora do fingerprint
+_UNHASHED_FIELDS = {"week_of", "rank", "is_active", "raw_data", "content_hash"}
+
+
+def content_fingerprint(row: dict) -> str:
+    """
+    sha256 dos campos normalizados do anuncio. As URLs da CDN do TikTok
+    entram sem a query string (token de expiracao), senao todo anuncio
+    pareceria alterado a cada execucao.
+    """
+    fields = {k: v for k, v in row.items() if k not in _UNHASHED_FIELDS}
+    for key in ("video_url", "cover_url"):
+        fields[key] = (fields.get(key) or "").split("?", 1)[0]
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
 
-    url = f"{SUPABASE_URL}/rest/v1/trending_videos"
+async def upsert_trending_videos(client: httpx.AsyncClient, rows: list) -> int:
+    """
+    Upsert em lote: um unico POST com o array de linhas, chave composta
+    (ad_id, region, industry, period) de migrations/003.
+    Erros sobem para o chamador, para nao contar como salvo o que falhou.
+    """
+    # O Postgres rejeita o lote inteiro se a mesma chave aparecer duas vezes
+    # (ON CONFLICT DO UPDATE nao pode afetar a mesma linha duas vezes);
+    # fica a primeira ocorrencia, que tem o melhor rank.
+    unique = {}
+    for row in rows:
+        unique.setdefault((row["ad_id"], row["region"], row["industry"], row["period"]), row)
+    if not unique:
+        return 0
+
+    url = f"{SUPABASE_URL}/rest/v1/trending_videos?on_conflict=ad_id,region,industry,period"
     headers = {
         **supabase_headers(),
         "Prefer": "resolution=merge-duplicates,return=minimal",
     }
+    r = await client.post(url, headers=headers, json=list(unique.values()), timeout=60)
+    if r.status_code >= 400:
+        raise Exception(f"Upsert em lote falhou [{r.status_code}]: {r.text[:500]}")
+    return len(unique)
+
+
+def _target_filter(target: ScrapeTarget) -> str:
+    return f"region=eq.{target.region}&industry=eq.{target.industry}&period=eq.{target.period}"
+
+
+async def fetch_existing_rows(client: httpx.AsyncClient, target: ScrapeTarget, ad_ids: list) -> dict:
+    """
+    Estado atual do alvo: linhas ativas + linhas dos ads raspados agora
+    (que podem estar inativas e voltar ao ranking). So colunas leves.
+    """
+    ids = ",".join(f'"{ad_id}"' for ad_id in ad_ids)
+    url = (
+        f"{SUPABASE_URL}/rest/v1/trending_videos"
+        f"?select=id,ad_id,rank,week_of,is_active,content_hash"
+        f"&{_target_filter(target)}"
+        f"&or=(is_active.eq.true,ad_id.in.({ids}))"
+    )
+    r = await client.get(url, headers=supabase_headers(), timeout=30)
+    r.raise_for_status()
+    return {row["ad_id"]: row for row in r.json()}
+
+
+async def record_rank_history(client: httpx.AsyncClient, entries: list):
+    """Uma linha por (ad, alvo, semana) em trending_rank_history, so quando o rank muda."""
+    if not entries:
+        return
+    url = (
+        f"{SUPABASE_URL}/rest/v1/trending_rank_history"
+        f"?on_conflict=ad_id,region,industry,period,week_of"
+    )
+    headers = {**supabase_headers(), "Prefer": "resolution=merge-duplicates,return=minimal"}
+    r = await client.post(url, headers=headers, json=entries, timeout=30)
+    if r.status_code >= 400:
+        print(f"[scraper] Aviso: historico de rank nao gravado [{r.status_code}]: {r.text[:300]}")
+
+
+async def deactivate_rows(client: httpx.AsyncClient, row_ids: list):
+    """Desativa linhas pelo id (so as do alvo que sairam do ranking)."""
+    if not row_ids:
+        return
+    url = f"{SUPABASE_URL}/rest/v1/trending_videos?id=in.({','.join(row_ids)})"
+    r = await client.patch(url, headers=supabase_headers(), json={"is_active": False}, timeout=30)
+    r.raise_for_status()
+
+
+async def sync_target_rows(client: httpx.AsyncClient, target: ScrapeTarget, rows: list) -> dict:
+    """
+    Grava so o que mudou no alvo, comparando content_hash com o banco:
+      - novo ou conteudo alterado: upsert da linha completa (com raw_data)
+      - mesmo conteudo, rank/semana diferentes: upsert so das colunas leves
+      - identico: nada
+    Mudancas de rank vao para trending_rank_history, e as linhas ativas do
+    alvo que nao apareceram nesta execucao sao desativadas pelo id.
+    """
+    unique = {}
+    for row in rows:
+        unique.setdefault(row["ad_id"], row)
+    existing = await fetch_existing_rows(client, target, list(unique)) if unique else {}
+
+    full_rows, moved_rows, history = [], [], []
+    for ad_id, row in unique.items():
+        current = existing.get(ad_id)
+        if current is None or current.get("content_hash") != row["content_hash"]:
+            full_rows.append(row)
+        elif (current.get("rank"), current.get("week_of"), current.get("is_active")) != (row["rank"], row["week_of"], True):
+            moved_rows.append({
+                "ad_id": ad_id,
+                "region": row["region"],
+                "industry": row["industry"],
+                "period": row["period"],
+                "week_of": row["week_of"],
+                "rank": row["rank"],
+                "is_active": True,
+            })
+        if current is None or current.get("rank") != row["rank"]:
+            history.append({
+                "ad_id": ad_id,
+                "region": row["region"],
+                "industry": row["industry"],
+                "period": row["period"],
+                "week_of": row["week_of"],
+                "rank": row["rank"],
+                "previous_rank": current.get("rank") if current else None,
+            })
+
+    await upsert_trending_videos(client, full_rows)
+    await upsert_trending_videos(client, moved_rows)
+
+    stale = [r["id"] for ad_id, r in existing.items() if r.get("is_active") and ad_id not in unique]
+    await deactivate_rows(client, stale)
+    await record_rank_history(client, history)
+
+    return {
+        "items": len(unique),
+        "written": len(full_rows),
+        "rank_only": len(moved_rows),
+        "unchanged": len(unique) - len(full_rows) - len(moved_rows),
+        "deactivated": len(stale),
+    }
+
+
+# ─────────────────────────────────────────────
+# SESSION CACHE / DIRECT API
+# ─────────────────────────────────────────────
+# Headers da requisicao da pagina que nao devem ser reenviados
+_SKIP_SESSION_HEADERS = {"cookie", "content-length", "host", "connection", "accept-encoding"}
+
+
+class SessionRejected(Exception):
+    """O TikTok recusou a sessao salva (cookies expirados, assinatura invalida...)."""
+
+
+def list_api_path(target: ScrapeTarget, page: int = 1, limit: int = PAGE_SIZE) -> str:
+    return (
+        f"/{API_PATTERN}?period={target.period}&industry={target.industry}&page={page}"
+        f"&limit={limit}&order_by=for_you&country_code={target.region}"
+    )
+
+
+def _has_more(body: dict) -> bool:
+    pagination = ((body or {}).get("data") or {}).get("pagination") or {}
+    return pagination.get("has_more") is not False
+
+
+def load_session() -> Optional[dict]:
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            await client.post(url, headers=headers, json=payload)
-    except Exception as e:
-        print(f"[scraper] Erro ao salvar ad {ad_id}: {e}")
+        with open(SCRAPER_SESSION_PATH) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - session.get("saved_at", 0) > SCRAPER_SESSION_MAX_AGE:
+        print("[scraper] Sessao salva expirou, ignorando")
+        return None
+    return session
+
+
+def save_session(cookies: list, headers: dict):
+    session = {
+        "saved_at": time.time(),
+        "cookies": {c["name"]: c["value"] for c in cookies},
+        "headers": {k: v for k, v in headers.items() if not k.startswith(":") and k.lower() not in _SKIP_SESSION_HEADERS},
+    }
+    tmp_path = f"{SCRAPER_SESSION_PATH}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, SCRAPER_SESSION_PATH)
+        print(f"[scraper] Sessao salva ({len(session['cookies'])} cookies)")
+    except OSError as e:
+        print(f"[scraper] Aviso: nao foi possivel salvar a sessao: {e}")
+
+
+def invalidate_session():
+    try:
+        os.remove(SCRAPER_SESSION_PATH)
+    except OSError:
+        pass
+
+
+async def fetch_top_ads_direct(session: dict, target: ScrapeTarget, max_ads: int = MAX_ADS) -> list:
+    """
+    Chama a API top_ads direto via httpx com cookies/headers de uma sessao
+    de browser anterior, paginando ate max_ads. Levanta SessionRejected se
+    o TikTok nao aceitar a sessao.
+    """
+    materials = []
+    async with httpx.AsyncClient(
+        base_url=TIKTOK_API_BASE,
+        headers=session.get("headers") or {},
+        cookies=session.get("cookies") or {},
+        timeout=20,
+    ) as client:
+        page = 1
+        while len(materials) < max_ads:
+            res = await client.get(list_api_path(target, page=page))
+            if res.status_code != 200:
+                raise SessionRejected(f"HTTP {res.status_code}")
+            try:
+                body = res.json()
+            except ValueError:
+                raise SessionRejected("resposta nao e JSON")
+            if body.get("code") not in (0, None):
+                raise SessionRejected(f"code={body.get('code')} {body.get('msg', '')}")
+
+            batch = _extract_materials(body)
+            if not batch:
+                if page == 1:
+                    raise SessionRejected("nenhum anuncio na primeira pagina")
+                break
+            materials.extend(batch)
+            if not _has_more(body):
+                break
+            page += 1
+
+    return materials[:max_ads]
+
+
+# ─────────────────────────────────────────────
+# BROWSER
+# ─────────────────────────────────────────────
+# Recursos que a pagina do Creative Center baixa mas o scraper nunca usa
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_URL_PARTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "connect.facebook.net",
+    "analytics.tiktok.com",
+    "/monitor_browser/",
+    "mon-va.byteoversea.com",
+    "mcs-va.tiktok",
+    "/slardar/",
+)
+
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+    Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
+    Object.defineProperty(navigator, 'languages', { get: () => ['pt-BR', 'pt', 'en-US'] });
+    window.chrome = { runtime: {}, loadTimes: function(){}, csi: function(){}, app: {} };
+    Object.defineProperty(navigator, 'platform', { get: () => 'Win32' });
+"""
+
+
+class RunBrowser:
+    """
+    Um Chromium + contexto por execucao, compartilhado pelos alvos raspados
+    em paralelo. Cada run e um processo filho (POST /scrape-trending), entao
+    o browser nao sobrevive entre runs: o custo de subir o Chromium e pago
+    uma vez por run, e so quando algum alvo cai no modo browser.
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._lock = asyncio.Lock()
+        self.requests_blocked = 0
+
+    async def context(self):
+        async with self._lock:
+            if self._context is not None:
+                return self._context
+
+            # Importado aqui: o worker importa este modulo (create_scraper_run)
+            # e nao deve carregar o Playwright
+            from playwright.async_api import async_playwright
+
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
+                headless=True,
+                args=[
+                    "--no-sandbox",
+                    "--disable-setuid-sandbox",
+                    "--disable-dev-shm-usage",
+                    "--disable-gpu",
+                    "--disable-blink-features=AutomationControlled",
+                    "--disable-web-security",
+                ],
+            )
+            self._context = await self._browser.new_context(
+                user_agent=(
+                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                    "AppleWebKit/537.36 (KHTML, like Gecko) "
+                    "Chrome/120.0.0.0 Safari/537.36"
+                ),
+                locale="pt-BR",
+                viewport={"width": 1280, "height": 800},
+            )
+            # Hide automation fingerprints
+            await self._context.add_init_script(STEALTH_SCRIPT)
+            await self._context.route("**/*", self._route)
+            print("[scraper] Browser iniciado")
+            return self._context
+
+    async def _route(self, route, request):
+        url = request.url
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in url for part in BLOCKED_URL_PARTS):
+            self.requests_blocked += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def close(self):
+        async with self._lock:
+            for closer in (self._context, self._browser):
+                if closer is not None:
+                    try:
+                        await closer.close()
+                    except Exception:
+                        pass
+            if self._playwright is not None:
+                try:
+                    await self._playwright.stop()
+                except Exception:
+                    pass
+            self._playwright = self._browser = self._context = None
+
+
+run_browser = RunBrowser()
 
 
 # ─────────────────────────────────────────────
 # PLAYWRIGHT SCRAPER
 # ─────────────────────────────────────────────
-async def scrape_tiktok_creative_center() -> list:
+def _extract_materials(body: dict) -> list:
+    data = (body or {}).get("data", {}) or {}
+    return data.get("materials") or data.get("list") or data.get("ad_list") or []
+
+
+def _is_list_response(response) -> bool:
+    return API_PATTERN in response.url and "list" in response.url
+
+
+# Chama a API interna a partir do contexto JS da pagina: usa cookies da
+# pagina e, se disponivel, a assinatura X-Bogus do SDK do TikTok
+_EVALUATE_FETCH = """
+    async (apiPath) => {
+        const headers = { 'Accept': 'application/json' };
+
+        // Use TikTok SDK signature if available
+        if (window.byted_acrawler &&
+                typeof byted_acrawler.frontierSign === 'function') {
+            try {
+                const signed = byted_acrawler.frontierSign(apiPath);
+                if (signed && signed['X-Bogus']) {
+                    headers['X-Bogus'] = signed['X-Bogus'];
+                }
+            } catch(e) {}
+        }
+
+        const resp = await fetch('https://ads.tiktok.com' + apiPath, {
+            credentials: 'include',
+            headers,
+        });
+        return await resp.json();
+    }
+"""
+
+
+async def scrape_tiktok_creative_center(target: ScrapeTarget, stats: Optional[dict] = None) -> list:
     """
-    Abre TikTok Creative Center via Playwright, aguarda carregamento do SDK
-    do TikTok e usa page.evaluate() para chamar a API interna a partir do
-    contexto JS da pagina, aproveitando cookies e autenticacao automaticamente.
-    Fallback: interceptacao de resposta de rede.
+    Abre o Creative Center do alvo numa pagina do contexto compartilhado,
+    espera a propria pagina chamar a API top_ads (sinal de que SDK e cookies
+    estao prontos) e pagina a API interna via page.evaluate() ate MAX_ADS.
+    Fallback: a primeira pagina interceptada da propria navegacao.
+    Se `stats` for passado, acumula tempo de parede e bytes transferidos.
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                "--no-sandbox",
-                "--disable-setuid-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-gpu",
-                "--disable-blink-features=AutomationControlled",
-                "--disable-web-security",
-            ],
-        )
-        context = await browser.new_context(
-            user_agent=(
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/120.0.0.0 Safari/537.36"
-            ),
-            locale="pt-BR",
-            viewport={"width": 1280, "height": 800},
-        )
-        page = await context.new_page()
-
-        # Hide automation fingerprints
-        await page.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-            Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
-            Object.defineProperty(navigator, 'languages', { get: () => ['pt-BR', 'pt', 'en-US'] });
-            window.chrome = { runtime: {}, loadTimes: function(){}, csi: function(){}, app: {} };
-            Object.defineProperty(navigator, 'platform', { get: () => 'Win32' });
-        """)
-
-        # --- Strategy 1: page.evaluate() inside page JS context ---
-        # This uses the page's own cookies + TikTok SDK for auth automatically
-        print("[scraper] Navegando para TikTok Creative Center...")
+    started = time.monotonic()
+    blocked_before = run_browser.requests_blocked
+    transferred = {"bytes": 0}
+
+    context = await run_browser.context()
+    page = await context.new_page()
+
+    async def count_bytes(request):
         try:
-            await page.goto(TIKTOK_CC_URL, wait_until="networkidle", timeout=60000)
-        except Exception as e:
-            print(f"[scraper] Timeout na navegacao (continuando): {e}")
+            sizes = await request.sizes()
+            transferred["bytes"] += sizes["responseBodySize"] + sizes["responseHeadersSize"]
+        except Exception:
+            pass
 
-        await page.wait_for_timeout(5000)
+    page.on("requestfinished", count_bytes)
 
-        print("[scraper] Tentando page.evaluate() para chamar API interna...")
+    try:
+        print(f"[scraper] [{target}] Navegando para TikTok Creative Center...")
+        page_materials = []
         try:
-            result = await page.evaluate("""
-                async () => {
-                    const apiPath = '/creative_radar_api/v1/top_ads/v2/list'
-                        + '?period=7&industry=14104000000&page=1&limit=20'
-                        + '&order_by=for_you&country_code=BR';
-                    const headers = { 'Accept': 'application/json' };
-
-                    // Use TikTok SDK signature if available
-                    if (window.byted_acrawler &&
-                            typeof byted_acrawler.frontierSign === 'function') {
-                        try {
-                            const signed = byted_acrawler.frontierSign(apiPath);
-                            if (signed && signed['X-Bogus']) {
-                                headers['X-Bogus'] = signed['X-Bogus'];
-                            }
-                        } catch(e) {}
-                    }
-
-                    const resp = await fetch('https://ads.tiktok.com' + apiPath, {
-                        credentials: 'include',
-                        headers,
-                    });
-                    return await resp.json();
-                }
-            """)
-            materials = (
-                result.get("data", {}).get("materials")
-                or result.get("data", {}).get("list")
-                or result.get("data", {}).get("ad_list")
-                or []
-            )
-            code = result.get("code")
-            print(f"[scraper] page.evaluate() retornou code={code}, {len(materials)} ads")
-            if materials:
-                await browser.close()
-                return materials[:MAX_ADS]
+            async with page.expect_response(_is_list_response, timeout=45000) as response_info:
+                await page.goto(
+                    TIKTOK_CC_URL.format(period=target.period, region=target.region, industry=target.industry),
+                    wait_until="domcontentloaded",
+                    timeout=60000,
+                )
+            response = await response_info.value
+            page_materials = _extract_materials(await response.json())
+            print(f"[scraper] [{target}] Pagina chamou a API: {len(page_materials)} ads")
+            if page_materials:
+                # Guarda cookies + headers que a pagina usou para o modo direto
+                save_session(
+                    await context.cookies(TIKTOK_API_BASE),
+                    await response.request.all_headers(),
+                )
         except Exception as e:
-            print(f"[scraper] page.evaluate() falhou: {e}")
+            print(f"[scraper] [{target}] API da pagina nao respondeu a tempo (continuando): {e}")
+
+        materials = []
+        page_number = 1
+        while len(materials) < MAX_ADS:
+            try:
+                result = await page.evaluate(_EVALUATE_FETCH, list_api_path(target, page=page_number))
+            except Exception as e:
+                print(f"[scraper] [{target}] page.evaluate() falhou na pagina {page_number}: {e}")
+                break
+            batch = _extract_materials(result)
+            if not batch:
+                print(f"[scraper] [{target}] page.evaluate() retornou code={result.get('code')} "
+                      f"sem ads na pagina {page_number}")
+                break
+            materials.extend(batch)
+            if not _has_more(result):
+                break
+            page_number += 1
+
+        if materials:
+            print(f"[scraper] [{target}] page.evaluate(): {len(materials)} ads em {page_number} pagina(s)")
+            return materials[:MAX_ADS]
+
+        print(f"[scraper] [{target}] Fallback: usando resposta interceptada da pagina ({len(page_materials)} ads)")
+        return page_materials[:MAX_ADS]
+
+    finally:
+        await page.close()
+        elapsed = time.monotonic() - started
+        blocked = run_browser.requests_blocked - blocked_before
+        print(f"[scraper] [{target}] Scrape em {elapsed:.1f}s, {transferred['bytes'] / 1024:.0f} KB transferidos, "
+              f"{blocked} requests bloqueados")
+        if stats is not None:
+            stats["bytes_transferred"] = stats.get("bytes_transferred", 0) + transferred["bytes"]
+            stats["requests_blocked"] = stats.get("requests_blocked", 0) + blocked
+
+
+async def fetch_trending_ads(target: ScrapeTarget, stats: Optional[dict] = None) -> list:
+    """
+    Caminho rapido primeiro: API direta com a sessao salva. O browser so
+    sobe quando nao ha sessao ou o TikTok a rejeita. `stats` e o dict deste
+    alvo: recebe o modo usado ("direct" / "browser").
+    """
+    if stats is not None:
+        stats["mode"] = "direct"
+    session = load_session()
+    if session:
+        started = time.monotonic()
+        try:
+            materials = await fetch_top_ads_direct(session, target)
+            print(f"[scraper] [{target}] Modo direto: {len(materials)} ads em {time.monotonic() - started:.1f}s")
+            return materials
+        except (SessionRejected, httpx.HTTPError) as e:
+            print(f"[scraper] [{target}] Sessao rejeitada ({e}), voltando para o browser")
+            invalidate_session()
 
-        # --- Strategy 2: response interception (fallback) ---
-        print("[scraper] Fallback: interceptacao de resposta de rede...")
-        captured_materials = []
+    if stats is not None:
+        stats["mode"] = "browser"
+    return await scrape_tiktok_creative_center(target, stats)
 
-        async def handle_response(response):
-            if API_PATTERN in response.url and "list" in response.url:
-                try:
-                    body = await response.json()
-                    mats = (
-                        body.get("data", {}).get("materials")
-                        or body.get("data", {}).get("list")
-                        or body.get("data", {}).get("ad_list")
-                        or []
-                    )
-                    if mats:
-                        print(f"[scraper] Interceptacao: {len(mats)} ads")
-                        captured_materials.extend(mats)
-                except Exception as e:
-                    print(f"[scraper] Aviso ao parsear resposta: {e}")
-
-        page.on("response", handle_response)
-
-        # Trigger fresh API call by loading with period=30
+
+async def mirror_trending_assets(targets: List[ScrapeTarget]) -> dict:
+    """Etapa pos-scrape: espelha os assets de cada alvo gravado. Nunca falha o run."""
+    from asset_mirror import mirror_assets
+
+    totals = {}
+    for target in targets:
         try:
-            await page.goto(
-                TIKTOK_CC_URL.replace("period=7", "period=30"),
-                wait_until="networkidle",
-                timeout=60000,
-            )
-        except Exception:
-            pass
-        await page.wait_for_timeout(8000)
+            for key, value in (await mirror_assets(_target_filter(target))).items():
+                totals[key] = totals.get(key, 0) + value
+        except Exception as e:
+            print(f"[scraper] [{target}] Aviso: espelhamento de assets falhou: {e}")
+    return totals
 
-        await browser.close()
-        print(f"[scraper] Total capturado (fallback): {len(captured_materials)} ads")
-        return captured_materials[:MAX_ADS]
 
 # ─────────────────────────────────────────────
 # MAIN SCRAPER FUNCTION
 # ─────────────────────────────────────────────
-async def run_scraper() -> dict:
-    today = date.today()
-    week_of = today - timedelta(days=today.weekday())
-
-    print(f"[scraper] Iniciando para semana {week_of}")
-    run_id = await create_scraper_run(week_of)
+async def scrape_target(
+    client: httpx.AsyncClient,
+    target: ScrapeTarget,
+    week_of: date,
+    semaphore: asyncio.Semaphore,
+    progress: dict,
+    run_id: Optional[str] = None,
+) -> dict:
+    """Raspa um alvo, grava as linhas assim que ele termina e reporta o progresso."""
+    async with semaphore:
+        started = time.monotonic()
+        # Por alvo: os alvos rodam em paralelo, um dict compartilhado ficaria com o modo do ultimo
+        stats = {}
+        try:
+            materials = await fetch_trending_ads(target, stats)
+            rows = [
+                row for rank, item in enumerate(materials, start=1)
+                if (row := build_trending_row(item, week_of, rank, target))
+            ]
+            result = await sync_target_rows(client, target, rows)
+        finally:
+            progress["targets_done"] += 1
+        progress["items_scraped"] += result["items"]
+        print(f"[scraper] [{target}] {result['items']} ads em {time.monotonic() - started:.1f}s ({stats['mode']}): "
+              f"{result['written']} gravados, {result['rank_only']} so rank, "
+              f"{result['unchanged']} sem mudanca, {result['deactivated']} desativados")
+        await update_scraper_progress(client, run_id, **progress)
+        return {"target": str(target), **result, **stats}
+
+
+def _aggregate_scrape_stats(target_results: list) -> dict:
+    """Modo do run ("direct", "browser" ou "mixed") e totais de trafego somados dos alvos."""
+    modes = {r["mode"] for r in target_results if r.get("mode")}
+    totals = {"mode": modes.pop() if len(modes) == 1 else ("mixed" if modes else "direct")}
+    for key in ("bytes_transferred", "requests_blocked"):
+        if any(key in r for r in target_results):
+            totals[key] = sum(r.get(key, 0) for r in target_results)
+    return totals
+
+
+async def run_scraper(targets: Optional[List[ScrapeTarget]] = None, run_id: Optional[str] = None) -> dict:
+    """
+    Raspa todos os alvos. `run_id` e o scraper_run ja criado por quem
+    disparou o processo (POST /scrape-trending); sem ele, cria um novo.
+    """
+    week_of = current_week()
+    targets = targets or parse_targets(SCRAPER_TARGETS)
 
-    try:
-        materials = await scrape_tiktok_creative_center()
+    print(f"[scraper] Iniciando para semana {week_of}: {len(targets)} alvo(s), "
+          f"concorrencia {SCRAPER_CONCURRENCY}")
 
-        if not materials:
-            msg = "Nenhum anuncio capturado. Pagina pode ter mudado ou houve timeout."
-            print(f"[scraper] AVISO: {msg}")
-            await finish_scraper_run(run_id, "warning", 0, msg)
-            return {"status": "warning", "message": msg, "items": 0}
+    async with httpx.AsyncClient(timeout=15) as client:
+        if run_id is None:
+            run_id = await create_scraper_run(client, week_of)
 
-        await deactivate_old_ads(week_of)
+        try:
+            started = time.monotonic()
+            progress = {"targets_total": len(targets), "targets_done": 0, "items_scraped": 0}
+            await update_scraper_progress(client, run_id, **progress)
+            semaphore = asyncio.Semaphore(SCRAPER_CONCURRENCY)
+            results = await asyncio.gather(
+                *(scrape_target(client, t, week_of, semaphore, progress, run_id) for t in targets),
+                return_exceptions=True,
+            )
+            scrape_stats = _aggregate_scrape_stats([r for r in results if not isinstance(r, Exception)])
+            scrape_stats["scrape_seconds"] = round(time.monotonic() - started, 2)
+
+            per_target, errors, saved = [], [], 0
+            for target, result in zip(targets, results):
+                if isinstance(result, Exception):
+                    print(f"[scraper] [{target}] ERRO: {result}")
+                    errors.append(f"{target}: {result}")
+                    per_target.append({"target": str(target), "error": str(result)})
+                else:
+                    saved += result["items"]
+                    per_target.append(result)
+
+            if errors and not saved:
+                raise Exception("; ".join(errors))
+
+            if MIRROR_ASSETS and saved:
+                scrape_stats["assets"] = await mirror_trending_assets(
+                    [t for t, r in zip(targets, results) if not isinstance(r, Exception)]
+                )
+
+            if not saved:
+                msg = "Nenhum anuncio capturado. Pagina pode ter mudado ou houve timeout."
+                print(f"[scraper] AVISO: {msg}")
+                await finish_scraper_run(client, run_id, week_of, "warning", 0, msg)
+                return {"status": "warning", "message": msg, "items": 0, "targets": per_target, **scrape_stats}
+
+            # A desativacao ja foi feita por alvo em sync_target_rows; um alvo
+            # que falhou mantem os ads antigos ativos
+            status = "warning" if errors else "success"
+            await finish_scraper_run(
+                client, run_id, week_of, status, saved,
+                "; ".join(errors) if errors else None,
+            )
+            print(f"[scraper] Concluido: {saved} ads salvos para semana {week_of}")
+            return {"status": status, "items": saved, "week_of": str(week_of), "targets": per_target, **scrape_stats}
 
-        saved = 0
-        for rank, item in enumerate(materials, start=1):
-            await upsert_trending_video(item, week_of, rank)
-            saved += 1
+        except Exception as e:
+            error_msg = str(e)
+            print(f"[scraper] ERRO: {error_msg}")
+            await finish_scraper_run(client, run_id, week_of, "error", 0, error_msg)
+            raise
 
-        await finish_scraper_run(run_id, "success", saved)
-        print(f"[scraper] Concluido: {saved} ads salvos para semana {week_of}")
-        return {"status": "success", "items": saved, "week_of": str(week_of)}
 
-    except Exception as e:
-        error_msg = str(e)
-        print(f"[scraper] ERRO: {error_msg}")
-        await finish_scraper_run(run_id, "error", 0, error_msg)
-        raise
+# ─────────────────────────────────────────────
+# CLI: processo isolado disparado pelo worker
+# ─────────────────────────────────────────────
+async def _main(run_id: Optional[str]) -> int:
+    try:
+        result = await run_scraper(run_id=run_id)
+        print(f"[scraper] Resultado: {json.dumps(result)}")
+        return 0 if result.get("status") in ("success", "warning") else 1
+    except Exception:
+        return 1
+    finally:
+        await run_browser.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="TikTok Creative Center scraper")
+    parser.add_argument("--run-id", help="scraper_runs.id ja criado pelo worker")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.run_id)))
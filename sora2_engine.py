@@ -14,8 +14,10 @@ Image input must match video output resolution exactly.
 import os
 import io
 import uuid
+import time
 import asyncio
 import httpx
+from typing import Any, Awaitable, Callable, Optional
 from PIL import Image
 
 
@@ -34,6 +36,12 @@ SORA_FALLBACK_SIZE_PRO = "1920x1080"
 # Valid durations for both sora-2 and sora-2-pro
 SORA_VALID_DURATIONS = [4, 8, 12, 16, 20]
 
+# Overridable so benchmarks can point the engine at a local stand-in server
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com").rstrip("/")
+# Floored so 0 (natural against the fake providers) polls fast instead of spinning
+SORA_POLL_INTERVAL = max(0.05, float(os.environ.get("SORA_POLL_INTERVAL_SECONDS", "15")))
+SORA_POLL_TIMEOUT = 1800  # 30 minutes max
+
 
 def map_aspect_to_sora_size(aspect_ratio: str, model: str = "sora-2") -> str:
     """Map aspect ratio string to Sora resolution. Pro uses 1080p, standard uses 720p."""
@@ -198,13 +206,19 @@ async def call_sora(
     custom_instructions: str = None,
     model_override: str = None,
     prompt_language: str = "pt",
-) -> bytes:
+    on_submitted: Optional[Callable[[str], None]] = None,
+    on_stage: Optional[Callable[..., None]] = None,
+    relay: Optional[Callable[[httpx.Response], Awaitable[Any]]] = None,
+) -> Any:
     """
     Generate video via OpenAI Sora 2 API.
     1. POST /v1/videos (multipart) to start generation
     2. Poll GET /v1/videos/{id} until completed
     3. Download GET /v1/videos/{id}/content
-    Returns raw video bytes.
+    Returns raw video bytes, or relay()'s result (see wait_for_sora_video).
+    on_submitted(video_id) is called as soon as the generation is accepted,
+    so the caller can persist it and resume with wait_for_sora_video().
+    on_stage("rendering", worker_progress=...) is called on every poll.
     """
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
@@ -247,8 +261,7 @@ async def call_sora(
             else:
                 print(f"WARNING: Supabase upload failed ({upload_res.status_code}), falling back to multipart")
 
-    # Step 1b: Submit generation and poll
-    # Use shorter timeout for submit (60s) and longer for polling/download (2min per request)
+    # Step 1b: Submit generation (polling/download happen in wait_for_sora_video)
     async with httpx.AsyncClient(timeout=60) as client:
         if image_public_url:
             # JSON format with image_url (new API format)
@@ -265,7 +278,7 @@ async def call_sora(
 
             print(f"Submitting to Sora API (JSON): model={sora_model}, seconds={sora_duration}, size={sora_size}")
             submit_res = await client.post(
-                "https://api.openai.com/v1/videos",
+                f"{OPENAI_API_BASE}/v1/videos",
                 headers=headers,
                 json=json_body,
             )
@@ -283,7 +296,7 @@ async def call_sora(
 
             print(f"Submitting to Sora API (multipart): model={sora_model}, seconds={sora_duration}, size={sora_size}")
             submit_res = await client.post(
-                "https://api.openai.com/v1/videos",
+                f"{OPENAI_API_BASE}/v1/videos",
                 headers=headers,
                 files=files,
                 data=form_data,
@@ -299,13 +312,42 @@ async def call_sora(
 
         print(f"Sora generation started: video_id={video_id}")
 
+    if on_submitted:
+        on_submitted(video_id)
+
+    return await wait_for_sora_video(video_id, on_stage=on_stage, relay=relay)
+
+
+async def wait_for_sora_video(
+    video_id: str,
+    on_stage: Optional[Callable[..., None]] = None,
+    relay: Optional[Callable[[httpx.Response], Awaitable[Any]]] = None,
+) -> Any:
+    """
+    Poll a submitted Sora generation until it finishes and download it.
+    Also used to resume generations submitted before a worker restart.
+    With relay, the content response is handed over unread (streaming) and
+    relay(response)'s result is returned instead of the bytes.
+    """
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise Exception("OPENAI_API_KEY not configured")
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+    }
+
+    async with httpx.AsyncClient(timeout=60) as client:
         # Step 2: Poll until completed or failed
         # Use a dedicated client with generous timeout for polling (each request is light)
-        poll_url = f"https://api.openai.com/v1/videos/{video_id}"
-        max_polls = 120  # 120 * 15s = 30 minutes max
+        poll_url = f"{OPENAI_API_BASE}/v1/videos/{video_id}"
+        deadline = time.monotonic() + SORA_POLL_TIMEOUT
         max_retries = 3  # retries per poll on transient errors
-        for i in range(max_polls):
-            await asyncio.sleep(15)
+        i = 0
+        while True:
+            if time.monotonic() >= deadline:
+                raise Exception("Sora generation timed out after 30 minutes")
+            await asyncio.sleep(SORA_POLL_INTERVAL)
 
             # Retry on transient errors (network hiccups, 5xx)
             poll_data = None
@@ -326,17 +368,25 @@ async def call_sora(
             status = poll_data.get("status", "unknown")
             print(f"Sora poll [{i+1}]: status={status}")
 
+            if on_stage and status in ("queued", "in_progress"):
+                on_stage("rendering", worker_progress=poll_data.get("progress"))
+
             if status == "completed":
                 break
             elif status == "failed":
                 error_msg = poll_data.get("error", "Unknown error")
                 raise Exception(f"Sora generation failed: {error_msg}")
-        else:
-            raise Exception("Sora generation timed out after 30 minutes")
+            i += 1
 
         # Step 3: Download video content (may be large, use longer timeout)
         print("Downloading Sora video...")
-        download_url = f"https://api.openai.com/v1/videos/{video_id}/content"
+        download_url = f"{OPENAI_API_BASE}/v1/videos/{video_id}/content"
+
+        if relay is not None:
+            async with client.stream("GET", download_url, headers=headers, timeout=120) as download_res:
+                download_res.raise_for_status()
+                return await relay(download_res)
+
         download_res = await client.get(download_url, headers=headers, timeout=120)
         download_res.raise_for_status()
 
@@ -0,0 +1,215 @@
+"""
+Coalescing writer for per-row job status (video_generations).
+
+Stage transitions (downloading, preprocessing, submitted, rendering,
+uploading) are cheap to report: each call only replaces the row's pending
+update in memory. A background flusher wakes up every `flush_interval`,
+groups rows whose pending payloads are identical into one PATCH
+(id=in.(...)) and sends the groups concurrently over the caller's pooled
+client. Rapid transitions on the same row collapse into the latest one.
+
+Final writes (completed / failed) are sticky: once queued, and while their
+PATCH is in flight, later stage updates for that row are dropped, so a stage
+can never land after the terminal write. A newer final for a row is held
+until the one in flight returns, so the last final queued is the last sent. A failed final is retried with
+backoff until it succeeds (unless a newer final for the row replaced it).
+on_persisted runs only after the final write landed, so callers can defer
+bookkeeping (e.g. closing the operation journal entry) until the row is
+really done; final() also returns a future for callers that want to wait.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import metrics
+
+DOWNLOADING = "downloading"
+PREPROCESSING = "preprocessing"
+SUBMITTED = "submitted"
+RENDERING = "rendering"
+UPLOADING = "uploading"
+
+# send(row_ids, payload) -> raises on failure
+SendFn = Callable[[List[str], dict], Awaitable[None]]
+
+
+@dataclass
+class _Pending:
+    payload: dict
+    final: bool = False
+    attempts: int = 0
+    retry_at: float = 0.0
+    on_persisted: List[Callable[[], None]] = field(default_factory=list)
+
+
+class StatusWriter:
+
+    def __init__(
+        self,
+        name: str,
+        send: SendFn,
+        flush_interval: float = 1.0,
+        max_batch: int = 100,
+        max_backoff: float = 60.0,
+    ):
+        self.name = name
+        self.send = send
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_backoff = max_backoff
+        self._pending: Dict[str, _Pending] = {}
+        # Finals whose PATCH is being sent (already out of _pending)
+        self._inflight: Dict[str, _Pending] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._closing = False
+
+    # -------------------------------------------------
+    # Producers
+    # -------------------------------------------------
+    def stage(self, row_id: str, stage: str, **fields):
+        """Report a stage transition. Coalesced with any update not yet flushed."""
+        current = self._pending.get(row_id)
+        if (current is not None and current.final) or row_id in self._inflight:
+            metrics.incr(f"{self.name}.stage_dropped")
+            return
+        if current is not None:
+            metrics.incr(f"{self.name}.coalesced")
+        # "now()" like the other PostgREST writes; identical payloads batch together
+        self._pending[row_id] = _Pending({"worker_stage": stage, "worker_stage_at": "now()", **fields})
+        self._ensure_running()
+
+    def final(
+        self,
+        row_id: str,
+        payload: dict,
+        on_persisted: Optional[Callable[[], None]] = None,
+    ) -> "asyncio.Future[None]":
+        """
+        Queue the terminal write for a row; retried until it succeeds, flushed
+        right away. The returned future resolves once the write landed.
+        """
+        current = self._pending.get(row_id)
+        callbacks = current.on_persisted if current is not None else []
+        if on_persisted is not None:
+            callbacks.append(on_persisted)
+        persisted = asyncio.get_running_loop().create_future()
+        callbacks.append(lambda: persisted.done() or persisted.set_result(None))
+        self._pending[row_id] = _Pending(payload, final=True, on_persisted=callbacks)
+        self._ensure_running()
+        if self._wake is not None:
+            self._wake.set()
+        return persisted
+
+    # -------------------------------------------------
+    # Flusher
+    # -------------------------------------------------
+    def _ensure_running(self):
+        if self._closing:
+            return
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Send everything that is due, one PATCH per distinct payload."""
+        now = time.monotonic()
+        # A row whose final is still in flight waits for it: two finals sent
+        # concurrently could land in either order
+        due = {row_id: p for row_id, p in self._pending.items()
+               if p.retry_at <= now and row_id not in self._inflight}
+        if not due:
+            return
+        for row_id, pending in due.items():
+            del self._pending[row_id]
+            if pending.final:
+                self._inflight[row_id] = pending
+
+        groups: Dict[tuple, List[str]] = {}
+        for row_id, pending in due.items():
+            key = (pending.final, tuple(sorted((k, repr(v)) for k, v in pending.payload.items())))
+            groups.setdefault(key, []).append(row_id)
+
+        batches = []
+        for row_ids in groups.values():
+            for i in range(0, len(row_ids), self.max_batch):
+                batches.append(row_ids[i:i + self.max_batch])
+
+        results = await asyncio.gather(
+            *(self.send(ids, due[ids[0]].payload) for ids in batches),
+            return_exceptions=True,
+        )
+        metrics.incr(f"{self.name}.flushes")
+
+        for row_id, pending in due.items():
+            if self._inflight.get(row_id) is pending:
+                del self._inflight[row_id]
+                if row_id in self._pending and self._wake is not None:
+                    # A newer final was held back behind this one
+                    self._wake.set()
+
+        for ids, result in zip(batches, results):
+            if not isinstance(result, Exception):
+                metrics.incr(f"{self.name}.rows_written", len(ids))
+                for row_id in ids:
+                    for callback in due[row_id].on_persisted:
+                        try:
+                            callback()
+                        except Exception as e:
+                            print(f"[{self.name}] on_persisted callback failed for {row_id}: {e}")
+                continue
+
+            metrics.incr(f"{self.name}.failed_writes", len(ids))
+            for row_id in ids:
+                pending = due[row_id]
+                if not pending.final:
+                    # Stage updates are best effort; the next stage or the final write supersedes them
+                    print(f"[{self.name}] Warning: stage update for {row_id} failed: {result}")
+                    continue
+                queued = self._pending.get(row_id)
+                if queued is not None and queued.final:
+                    # A newer final was queued meanwhile: keep it, but keep our callbacks too
+                    queued.on_persisted.extend(pending.on_persisted)
+                    continue
+                pending.attempts += 1
+                delay = min(self.max_backoff, 2 ** pending.attempts)
+                pending.retry_at = time.monotonic() + delay
+                self._pending[row_id] = pending
+                print(f"[{self.name}] Final write for {row_id} failed (attempt {pending.attempts}), "
+                      f"retrying in {delay:.0f}s: {result}")
+
+    async def close(self, timeout: float = 10.0):
+        """Flush what is pending (finals get a few more tries) and stop the flusher."""
+        # Let an in-flight flush finish instead of cancelling it halfway
+        self._closing = True
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+            self._task = None
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            for pending in self._pending.values():
+                pending.retry_at = 0.0
+            await self.flush()
+            if self._pending:
+                await asyncio.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+        if self._pending:
+            print(f"[{self.name}] Warning: {len(self._pending)} status write(s) not persisted at shutdown")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "pending_final": sum(1 for p in self._pending.values() if p.final),
+            "inflight_final": len(self._inflight),
+        }
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, Cost
+
+
+def test_waiter_that_gives_up_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(ram_mb=100, disk_mb=100, encode_slots=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("merge", Cost(encode_slots=1)):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued_before = controller.utilization()["queued"]
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        queued_after = controller.utilization()["queued"]
+
+        # The freed queue slot is usable right away: no false "queue full"
+        replacement = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, replacement)
+        return queued_before, queued_after, controller.utilization()
+
+    queued_before, queued_after, utilization = asyncio.run(scenario())
+    assert (queued_before, queued_after) == (1, 0)
+    assert utilization["encode_slots"]["used"] == 0
+    assert utilization["queued"] == 0
+
+
+def test_timed_out_waiter_is_rejected_and_removed():
+    async def scenario():
+        controller = AdmissionController(ram_mb=100, disk_mb=100, encode_slots=1, max_wait_seconds=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("merge", Cost(encode_slots=1)):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.admit("watermark", Cost(encode_slots=1)):
+                pass
+        queued = controller.utilization()["queued"]
+        release.set()
+        await holder
+        return rejected.value, queued
+
+    rejected, queued = asyncio.run(scenario())
+    assert rejected.endpoint == "watermark"
+    assert rejected.retry_after >= 1
+    assert queued == 0
+
+
+def test_abandoned_head_unblocks_smaller_waiters():
+    async def scenario():
+        controller = AdmissionController(ram_mb=100, disk_mb=100, encode_slots=2)
+        release = asyncio.Event()
+        admitted = []
+
+        async def hold(name, cost):
+            async with controller.admit(name, cost):
+                admitted.append(name)
+                await release.wait()
+
+        holder = asyncio.create_task(hold("small-1", Cost(ram_mb=60)))
+        await asyncio.sleep(0)
+        big = asyncio.create_task(hold("big", Cost(ram_mb=100)))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(hold("small-2", Cost(ram_mb=30)))
+        await asyncio.sleep(0)
+        blocked = list(admitted)
+        big.cancel()
+        await asyncio.gather(big, return_exceptions=True)
+        await asyncio.sleep(0)
+        unblocked = list(admitted)
+        release.set()
+        await asyncio.gather(holder, small)
+        return blocked, unblocked
+
+    blocked, unblocked = asyncio.run(scenario())
+    assert blocked == ["small-1"]
+    assert unblocked == ["small-1", "small-2"]
+
+
+def test_queue_full_is_rejected():
+    async def scenario():
+        controller = AdmissionController(ram_mb=100, disk_mb=100, encode_slots=1, max_queue=0)
+        async with controller.admit("merge", Cost(encode_slots=1)):
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with controller.admit("merge", Cost(encode_slots=1)):
+                    pass
+        return rejected.value
+
+    assert asyncio.run(scenario()).reason == "queue full"
+
+
+def test_oversized_cost_is_clamped_and_runs_alone():
+    async def scenario():
+        controller = AdmissionController(ram_mb=100, disk_mb=100, encode_slots=1)
+        async with controller.admit("merge", Cost(ram_mb=500, disk_mb=500, encode_slots=4)):
+            return controller.utilization()
+
+    utilization = asyncio.run(scenario())
+    assert utilization["ram_mb"]["used"] == 100
+    assert utilization["encode_slots"]["used"] == 1
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+
+import httpx
+
+from clip_cache import ClipCache, SegmentCache
+
+
+class Origin:
+    """Serves `clips` with strong ETags and honours If-None-Match."""
+
+    def __init__(self, clips):
+        self.clips = clips
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        body = self.clips[request.url.path]
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        self.requests.append((request.url.path, request.headers.get("if-none-match")))
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"etag": etag})
+        return httpx.Response(200, content=body, headers={"etag": etag})
+
+
+def fetch_all(cache, origin, paths, dest_dir):
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(origin.handler)) as client:
+            return [
+                await cache.fetch(client, f"http://origin{path}", os.path.join(dest_dir, f"{i}.mp4"))
+                for i, path in enumerate(paths)
+            ]
+
+    return asyncio.run(scenario())
+
+
+def test_second_fetch_revalidates_with_etag(tmp_path):
+    origin = Origin({"/a.mp4": b"a" * 1000})
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=10_000)
+
+    miss, hit = fetch_all(cache, origin, ["/a.mp4", "/a.mp4"], str(tmp_path))
+
+    assert (miss.source, hit.source) == ("miss", "hit")
+    assert origin.requests[0][1] is None
+    assert origin.requests[1][1] is not None
+    assert hit.sha256 == hashlib.sha256(b"a" * 1000).hexdigest()
+    with open(hit.path, "rb") as f:
+        assert f.read() == b"a" * 1000
+    assert cache.stats()["bytes_saved"] == 1000
+
+
+def test_changed_clip_is_downloaded_again(tmp_path):
+    origin = Origin({"/a.mp4": b"old" * 100})
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=10_000)
+    fetch_all(cache, origin, ["/a.mp4"], str(tmp_path))
+
+    origin.clips["/a.mp4"] = b"new" * 200
+    [result] = fetch_all(cache, origin, ["/a.mp4"], str(tmp_path))
+
+    assert result.source == "miss"
+    assert result.size == 600
+    assert cache.stats()["bytes"] == 600
+
+
+def test_least_recently_used_clip_is_evicted(tmp_path):
+    origin = Origin({"/a.mp4": b"a" * 400, "/b.mp4": b"b" * 400, "/c.mp4": b"c" * 400})
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=1000)
+
+    fetch_all(cache, origin, ["/a.mp4", "/b.mp4", "/a.mp4", "/c.mp4"], str(tmp_path))
+    sources = [r.source for r in fetch_all(cache, origin, ["/a.mp4", "/b.mp4"], str(tmp_path))]
+
+    assert sources == ["hit", "miss"]
+    assert cache.stats()["bytes"] <= 1000
+
+
+def test_evicted_body_stays_readable_for_the_caller(tmp_path):
+    origin = Origin({"/a.mp4": b"a" * 800, "/b.mp4": b"b" * 800})
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=1000)
+
+    first, _ = fetch_all(cache, origin, ["/a.mp4", "/b.mp4"], str(tmp_path))
+
+    with open(first.path, "rb") as f:
+        assert f.read() == b"a" * 800
+
+
+def test_response_without_etag_is_not_cached(tmp_path):
+    def handler(request):
+        return httpx.Response(200, content=b"x" * 100)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await cache.fetch(client, "http://origin/x.mp4", str(tmp_path / "x.mp4"))
+
+    cache = ClipCache(str(tmp_path / "cache"), max_bytes=10_000)
+    assert asyncio.run(scenario()).source == "uncached"
+    assert cache.stats()["entries"] == 0
+
+
+def test_index_is_rebuilt_and_foreign_files_kept(tmp_path):
+    root = tmp_path / "cache"
+    origin = Origin({"/a.mp4": b"a" * 100})
+    fetch_all(ClipCache(str(root), max_bytes=10_000), origin, ["/a.mp4"], str(tmp_path))
+    (root / "notes.txt").write_text("not ours")
+    (root / ("f" * 64 + ".mp4.part")).write_bytes(b"interrupted")
+
+    cache = ClipCache(str(root), max_bytes=10_000)
+    [result] = fetch_all(cache, origin, ["/a.mp4"], str(tmp_path))
+
+    assert result.source == "hit"
+    assert (root / "notes.txt").exists()
+    assert not (root / ("f" * 64 + ".mp4.part")).exists()
+
+
+def test_segment_cache_put_get_and_evict(tmp_path):
+    cache = SegmentCache(str(tmp_path / "segments"), max_bytes=1000)
+    keys = [SegmentCache.key("sha", 0.0, end, "mp4") for end in (1.0, 2.0)]
+    for key, size in zip(keys, (600, 600)):
+        segment = tmp_path / f"{key}.src"
+        segment.write_bytes(b"s" * size)
+        cache.put(key, str(segment))
+
+    assert not cache.get(keys[0], str(tmp_path / "out0.mp4"))
+    assert cache.get(keys[1], str(tmp_path / "out1.mp4"))
+    assert (tmp_path / "out1.mp4").read_bytes() == b"s" * 600
+    assert SegmentCache.key("sha", 0.0, None, "mp4") != SegmentCache.key("sha", 0.0, 1.0, "mp4")
@@ -0,0 +1,111 @@
+import asyncio
+
+from events import EventHub
+
+
+async def collect(hub, job_id, last_event_id=0):
+    events = []
+    async for item in hub.subscribe(job_id, last_event_id=last_event_id, heartbeat=5):
+        if item is not None:
+            events.append(item[1:])
+    return events
+
+
+def test_late_subscriber_gets_the_final_event():
+    async def scenario():
+        hub = EventHub()
+        hub.publish("job", "progress", {"stage": "rendering"})
+        hub.publish("job", "done", {"url": "u"})
+        return await asyncio.wait_for(collect(hub, "job"), timeout=5)
+
+    assert asyncio.run(scenario()) == [("progress", {"stage": "rendering"}), ("done", {"url": "u"})]
+
+
+def test_subscriber_before_first_publish_waits():
+    async def scenario():
+        hub = EventHub()
+        subscriber = asyncio.create_task(collect(hub, "job"))
+        await asyncio.sleep(0)
+        waiting = hub.stats()["waiting"]
+        hub.publish("job", "progress", {})
+        hub.publish("job", "done", {})
+        return waiting, await asyncio.wait_for(subscriber, timeout=5), hub.stats()
+
+    waiting, events, stats = asyncio.run(scenario())
+    assert waiting == 1
+    assert [e for e, _ in events] == ["progress", "done"]
+    assert stats == {"jobs": 1, "waiting": 0, "subscribers": 0}
+
+
+def test_history_is_a_ring_buffer():
+    async def scenario():
+        hub = EventHub(history=3)
+        for i in range(10):
+            hub.publish("job", "progress", {"i": i})
+        hub.publish("job", "done", {})
+        return await asyncio.wait_for(collect(hub, "job"), timeout=5)
+
+    assert asyncio.run(scenario()) == [("progress", {"i": 8}), ("progress", {"i": 9}), ("done", {})]
+
+
+def test_skip_repeat_drops_identical_events():
+    async def scenario():
+        hub = EventHub()
+        for _ in range(3):
+            hub.publish("job", "progress", {"stage": "rendering"}, skip_repeat=True)
+        hub.publish("job", "done", {})
+        return await asyncio.wait_for(collect(hub, "job"), timeout=5)
+
+    assert len(asyncio.run(scenario())) == 2
+
+
+def test_finished_jobs_expire_after_retention():
+    async def scenario():
+        hub = EventHub(retain_seconds=0.05)
+        hub.publish("old", "done", {})
+        hub.publish("running", "progress", {})
+        await asyncio.sleep(0.1)
+        hub.publish("new", "progress", {})
+        return set(hub._jobs)
+
+    assert asyncio.run(scenario()) == {"running", "new"}
+
+
+def test_max_jobs_drops_finished_before_running():
+    async def scenario():
+        hub = EventHub(max_jobs=2)
+        hub.publish("finished", "done", {})
+        hub.publish("running", "progress", {})
+        hub.publish("new", "progress", {})
+        return set(hub._jobs)
+
+    assert asyncio.run(scenario()) == {"running", "new"}
+
+
+def test_reused_job_id_does_not_replay_old_done():
+    async def scenario():
+        hub = EventHub()
+        hub.publish("job", "done", {"try": 1})
+        hub.publish("job", "progress", {"try": 2})
+        subscriber = asyncio.create_task(collect(hub, "job"))
+        await asyncio.sleep(0)
+        hub.publish("job", "done", {"try": 2})
+        return await asyncio.wait_for(subscriber, timeout=5)
+
+    assert asyncio.run(scenario()) == [("progress", {"try": 2}), ("done", {"try": 2})]
+
+
+def test_waiting_entries_are_capped():
+    async def scenario():
+        hub = EventHub(max_waiting=1)
+        first = asyncio.create_task(collect(hub, "a"))
+        await asyncio.sleep(0)
+        rejected = await asyncio.wait_for(collect(hub, "b"), timeout=5)
+        accepts = hub.accepts("c")
+        hub.publish("a", "done", {})
+        await first
+        return rejected, accepts
+
+    rejected, accepts = asyncio.run(scenario())
+    assert rejected == []
+    assert accepts is False
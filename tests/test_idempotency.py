@@ -0,0 +1,84 @@
+import asyncio
+
+import idempotency
+from idempotency import IdempotencyRegistry
+
+
+def test_retry_attaches_to_running_job():
+    async def scenario():
+        registry = IdempotencyRegistry("test")
+        calls = 0
+        release = asyncio.Event()
+
+        async def job():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return {"status": "success", "n": calls}
+
+        first = asyncio.create_task(registry.run("gen-1", job))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(registry.run("gen-1", job))
+        await asyncio.sleep(0)
+        assert registry.is_running("gen-1")
+        release.set()
+        return await first, await second, calls
+
+    (r1, o1), (r2, o2), calls = asyncio.run(scenario())
+    assert calls == 1
+    assert (o1, o2) == (idempotency.STARTED, idempotency.ATTACHED)
+    assert r1 is r2
+
+
+def test_success_is_cached_failure_is_not():
+    async def scenario():
+        registry = IdempotencyRegistry("test")
+        results = iter([{"status": "failed"}, {"status": "success"}, {"status": "failed"}])
+
+        async def job():
+            return next(results)
+
+        outcomes = [await registry.run("gen-1", job) for _ in range(3)]
+        return outcomes, registry.stats()
+
+    outcomes, stats = asyncio.run(scenario())
+    assert [o for _, o in outcomes] == [idempotency.STARTED, idempotency.STARTED, idempotency.CACHED]
+    assert outcomes[2][0] == {"status": "success"}
+    assert stats == {"inflight": 0, "cached_results": 1}
+
+
+def test_caller_cancel_does_not_cancel_job():
+    async def scenario():
+        registry = IdempotencyRegistry("test")
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+            return {"status": "success"}
+
+        caller = asyncio.create_task(registry.run("gen-1", job))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0)
+        still_running = registry.is_running("gen-1")
+        release.set()
+        return still_running, await registry.run("gen-1", job)
+
+    still_running, (result, outcome) = asyncio.run(scenario())
+    assert still_running
+    assert result == {"status": "success"}
+    assert outcome in (idempotency.ATTACHED, idempotency.CACHED)
+
+
+def test_expired_result_runs_again():
+    async def scenario():
+        registry = IdempotencyRegistry("test", ttl_seconds=-1)
+
+        async def job():
+            return {"status": "success"}
+
+        await registry.run("gen-1", job)
+        return await registry.run("gen-1", job)
+
+    _, outcome = asyncio.run(scenario())
+    assert outcome == idempotency.STARTED
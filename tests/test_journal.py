@@ -0,0 +1,69 @@
+import sqlite3
+import time
+
+import journal
+from journal import OperationJournal
+
+
+def test_pending_survives_reopen(tmp_path):
+    path = str(tmp_path / "ops.db")
+    OperationJournal(path).record("op-1", "veo", "gen-1", {"prompt": "x"})
+
+    entries = OperationJournal(path).pending()
+    assert [(e.operation_id, e.provider, e.generation_id, e.context, e.attempts) for e in entries] == [
+        ("op-1", "veo", "gen-1", {"prompt": "x"}, 0)
+    ]
+
+
+def test_completed_entries_are_not_replayed(tmp_path):
+    ops = OperationJournal(str(tmp_path / "ops.db"))
+    ops.record("op-1", "veo", "gen-1", {})
+    ops.record("op-2", "sora", "gen-2", {})
+    ops.complete("op-1")
+    ops.complete("op-2", journal.FAILED)
+    ops.complete(None)
+
+    assert ops.pending() == []
+    assert ops.stats() == {journal.DONE: 1, journal.FAILED: 1}
+
+
+def test_replay_is_oldest_first_and_counts_attempts(tmp_path):
+    ops = OperationJournal(str(tmp_path / "ops.db"))
+    ops.record("op-1", "veo", "gen-1", {})
+    time.sleep(0.01)
+    ops.record("op-2", "veo", "gen-2", {})
+
+    assert [e.operation_id for e in ops.pending()] == ["op-1", "op-2"]
+    assert [e.attempts for e in ops.pending()] == [1, 1]
+
+
+def test_replay_abandons_after_max_attempts(tmp_path):
+    ops = OperationJournal(str(tmp_path / "ops.db"))
+    ops.record("op-1", "veo", "gen-1", {})
+
+    for _ in range(3):
+        assert len(ops.pending(max_attempts=3)) == 1
+    assert ops.pending(max_attempts=3) == []
+    assert ops.stats() == {journal.ABANDONED: 1}
+
+
+def test_replay_abandons_stale_entries(tmp_path):
+    path = str(tmp_path / "ops.db")
+    ops = OperationJournal(path)
+    ops.record("op-old", "veo", "gen-1", {})
+    ops.record("op-new", "veo", "gen-2", {})
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE operations SET created_at = ? WHERE operation_id = 'op-old'", (time.time() - 3600,))
+
+    assert [e.operation_id for e in ops.pending(max_age_seconds=60)] == ["op-new"]
+    assert ops.stats() == {journal.ABANDONED: 1, journal.PENDING: 1}
+
+
+def test_record_again_resets_the_entry(tmp_path):
+    ops = OperationJournal(str(tmp_path / "ops.db"))
+    ops.record("op-1", "veo", "gen-1", {"try": 1})
+    ops.pending()
+    ops.record("op-1", "veo", "gen-1", {"try": 2})
+
+    [entry] = ops.pending()
+    assert (entry.context, entry.attempts) == ({"try": 2}, 0)
@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+import status_writer
+from status_writer import StatusWriter
+
+
+class FakeTable:
+    """Records every PATCH; fails the next `fail` ones. `gate` holds sends until set."""
+
+    def __init__(self, fail: int = 0):
+        self.fail = fail
+        self.calls = []
+        self.rows = {}
+        self.gate = None
+
+    async def send(self, row_ids, payload):
+        self.calls.append((sorted(row_ids), payload))
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("PATCH failed")
+        for row_id in row_ids:
+            self.rows[row_id] = payload
+
+    async def sent(self, count: int):
+        """Wait until the background flusher has issued `count` PATCHes."""
+        while len(self.calls) < count:
+            await asyncio.sleep(0)
+
+
+def test_stage_updates_coalesce_and_batch():
+    async def scenario():
+        table = FakeTable()
+        writer = StatusWriter("test", table.send, flush_interval=3600)
+        writer.stage("a", status_writer.DOWNLOADING)
+        writer.stage("a", status_writer.PREPROCESSING)
+        writer.stage("a", status_writer.RENDERING)
+        writer.stage("b", status_writer.RENDERING)
+        writer.stage("c", status_writer.UPLOADING)
+        await writer.flush()
+        await writer.close()
+        return table
+
+    table = asyncio.run(scenario())
+    assert len(table.calls) == 2
+    assert sorted(ids for ids, _ in table.calls) == [["a", "b"], ["c"]]
+    assert table.rows["a"]["worker_stage"] == status_writer.RENDERING
+
+
+def test_stage_after_final_is_dropped():
+    async def scenario():
+        table = FakeTable()
+        writer = StatusWriter("test", table.send, flush_interval=3600)
+        writer.stage("a", status_writer.RENDERING)
+        persisted = writer.final("a", {"status": "completed"})
+        writer.stage("a", status_writer.UPLOADING)
+        await writer.flush()
+        await writer.close()
+        return table, persisted
+
+    table, persisted = asyncio.run(scenario())
+    assert table.calls == [(["a"], {"status": "completed"})]
+    assert persisted.done()
+
+
+def test_stage_while_final_in_flight_is_dropped():
+    async def scenario():
+        table = FakeTable()
+        table.gate = asyncio.Event()
+        writer = StatusWriter("test", table.send, flush_interval=3600)
+        writer.final("a", {"status": "completed"})
+        await asyncio.wait_for(table.sent(1), timeout=5)
+        assert writer.stats()["inflight_final"] == 1
+        writer.stage("a", status_writer.UPLOADING)
+        table.gate.set()
+        await writer.close()
+        return table
+
+    table = asyncio.run(scenario())
+    assert table.calls == [(["a"], {"status": "completed"})]
+    assert table.rows["a"] == {"status": "completed"}
+
+
+def test_failed_final_is_retried_and_callbacks_run_once_persisted():
+    async def scenario():
+        table = FakeTable(fail=1)
+        writer = StatusWriter("test", table.send, flush_interval=3600)
+        done = []
+        persisted = writer.final("a", {"status": "completed"}, on_persisted=lambda: done.append("a"))
+        await writer.flush()
+        after_failure = (list(done), persisted.done(), writer.stats()["pending_final"])
+        # Skip the backoff
+        writer._pending["a"].retry_at = 0.0
+        await writer.flush()
+        await writer.close()
+        return table, done, persisted, after_failure
+
+    table, done, persisted, after_failure = asyncio.run(scenario())
+    assert after_failure == ([], False, 1)
+    assert len(table.calls) == 2
+    assert done == ["a"]
+    assert persisted.done()
+
+
+def test_newer_final_waits_for_the_one_in_flight():
+    async def scenario():
+        table = FakeTable()
+        table.gate = asyncio.Event()
+        writer = StatusWriter("test", table.send, flush_interval=3600)
+        done = []
+        first = writer.final("a", {"status": "failed"}, on_persisted=lambda: done.append("first"))
+        await asyncio.wait_for(table.sent(1), timeout=5)
+        second = writer.final("a", {"status": "completed"}, on_persisted=lambda: done.append("second"))
+        await writer.flush()
+        sent_while_in_flight = len(table.calls)
+        table.gate.set()
+        await writer.close()
+        return table, done, first, second, sent_while_in_flight
+
+    table, done, first, second, sent_while_in_flight = asyncio.run(scenario())
+    assert sent_while_in_flight == 1
+    assert [payload for _, payload in table.calls] == [{"status": "failed"}, {"status": "completed"}]
+    assert table.rows["a"] == {"status": "completed"}
+    assert done == ["first", "second"]
+    assert first.done() and second.done()
+
+
+def test_newer_final_replaces_a_failed_one_and_keeps_its_callbacks():
+    async def scenario():
+        table = FakeTable(fail=1)
+        table.gate = asyncio.Event()
+        writer = StatusWriter("test", table.send, flush_interval=3600)
+        done = []
+        first = writer.final("a", {"status": "failed"}, on_persisted=lambda: done.append("first"))
+        await asyncio.wait_for(table.sent(1), timeout=5)
+        second = writer.final("a", {"status": "completed"}, on_persisted=lambda: done.append("second"))
+        table.gate.set()
+        await writer.close()
+        return table, done, first, second
+
+    table, done, first, second = asyncio.run(scenario())
+    assert [payload for _, payload in table.calls] == [{"status": "failed"}, {"status": "completed"}]
+    assert table.rows["a"] == {"status": "completed"}
+    assert sorted(done) == ["first", "second"]
+    assert first.done() and second.done()
+
+
+@pytest.mark.parametrize("fail", [0, 2])
+def test_close_flushes_pending_finals(fail):
+    async def scenario():
+        table = FakeTable(fail=fail)
+        writer = StatusWriter("test", table.send, flush_interval=3600)
+        writer.final("a", {"status": "completed"})
+        await writer.close(timeout=5)
+        return table, writer.stats()
+
+    table, stats = asyncio.run(scenario())
+    assert table.rows["a"] == {"status": "completed"}
+    assert stats["pending"] == 0
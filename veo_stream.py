@@ -0,0 +1,146 @@
+"""
+Incremental reader for Veo fetchPredictOperation responses.
+
+A finished operation without storageUri carries each video inline as
+"bytesBase64Encoded": "<30-60MB of base64>". Parsing that with
+response.json() and then b64decode() keeps the raw body, the decoded
+string and the video bytes in memory at once. InlineVideoExtractor is fed
+the body chunk by chunk instead:
+
+  - everything outside those values is copied into a small JSON skeleton
+  - each bytesBase64Encoded value is decoded as it arrives and written to
+    its own file; the skeleton gets a placeholder that resolve() maps back
+    to the file path
+
+feed() is plain blocking code so callers can run it in a worker thread
+(asyncio.to_thread) and keep the event loop free while a 1080p result is
+decoded.
+"""
+
+import base64
+import json
+import os
+from typing import Any, List, Optional
+
+INLINE_KEY = b"bytesBase64Encoded"
+_PLACEHOLDER = "@inline-video:"
+
+
+class InlineVideoExtractor:
+
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+        self.paths: List[str] = []
+        self.sizes: List[int] = []
+        self._skeleton = bytearray()
+        # Outside strings / inside a string / inside an inline video value
+        self._in_string = False
+        self._escaped = False
+        self._string = bytearray()
+        self._last_string: Optional[bytes] = None
+        self._expect_value = False
+        self._out = None
+        self._b64_carry = b""
+        self._slash_carry = False
+
+    # -------------------------------------------------
+    # Inline value: base64 straight to a file
+    # -------------------------------------------------
+    def _open_value(self):
+        path = os.path.join(self.workdir, f"inline_{len(self.paths)}.mp4")
+        self._out = open(path, "wb")
+        self.paths.append(path)
+        self.sizes.append(0)
+        self._skeleton += f'"{_PLACEHOLDER}{len(self.paths) - 1}"'.encode()
+
+    def _write_b64(self, data: bytes):
+        # JSON may escape "/" as "\/"; a trailing backslash can be split from its "/"
+        if self._slash_carry:
+            data = b"\\" + data
+            self._slash_carry = False
+        if data.endswith(b"\\"):
+            data, self._slash_carry = data[:-1], True
+        data = self._b64_carry + data.replace(b"\\/", b"/")
+        usable = len(data) - len(data) % 4
+        self._b64_carry = data[usable:]
+        if usable:
+            decoded = base64.b64decode(data[:usable])
+            self._out.write(decoded)
+            self.sizes[-1] += len(decoded)
+
+    def _close_value(self):
+        if self._b64_carry:
+            decoded = base64.b64decode(self._b64_carry + b"=" * (-len(self._b64_carry) % 4))
+            self._out.write(decoded)
+            self.sizes[-1] += len(decoded)
+            self._b64_carry = b""
+        self._out.close()
+        self._out = None
+
+    # -------------------------------------------------
+    # Feed
+    # -------------------------------------------------
+    def feed(self, chunk: bytes):
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._out is not None:
+                end = chunk.find(b'"', i)
+                # A quote preceded by the carried backslash cannot occur in base64, so any quote ends it
+                if end < 0:
+                    self._write_b64(chunk[i:])
+                    return
+                self._write_b64(chunk[i:end])
+                self._close_value()
+                i = end + 1
+                continue
+
+            if self._in_string:
+                c = chunk[i]
+                self._skeleton.append(c)
+                if self._escaped:
+                    self._escaped = False
+                    self._string.append(c)
+                elif c == 0x5C:  # backslash
+                    self._escaped = True
+                    self._string.append(c)
+                elif c == 0x22:  # closing quote
+                    self._in_string = False
+                    self._last_string = bytes(self._string)
+                else:
+                    self._string.append(c)
+                i += 1
+                continue
+
+            c = chunk[i]
+            if c == 0x22:
+                if self._expect_value:
+                    self._expect_value = False
+                    self._open_value()
+                    i += 1
+                    continue
+                self._in_string = True
+                self._string.clear()
+                self._skeleton.append(c)
+            elif c == 0x3A and self._last_string == INLINE_KEY:  # ':' after the key
+                self._expect_value = True
+                self._skeleton.append(c)
+            elif c in b" \t\r\n":
+                self._skeleton.append(c)
+            else:
+                self._expect_value = False
+                self._last_string = None
+                self._skeleton.append(c)
+            i += 1
+
+    def finish(self) -> Any:
+        """Parse the skeleton. Inline values come back as placeholders, see resolve()."""
+        if self._out is not None:
+            self._out.close()
+            raise ValueError("response ended inside an inline video value")
+        return json.loads(bytes(self._skeleton))
+
+    def resolve(self, value: Any) -> Optional[str]:
+        """File path for a bytesBase64Encoded placeholder, None for anything else."""
+        if isinstance(value, str) and value.startswith(_PLACEHOLDER):
+            return self.paths[int(value[len(_PLACEHOLDER):])]
+        return None